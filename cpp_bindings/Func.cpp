@@ -1,6 +1,8 @@
 #include <llvm-c/Core.h> // for LLVMModuleRef and LLVMValueRef
+#include <llvm-c/BitReader.h>
 #include <llvm-c/ExecutionEngine.h>
 #include <llvm-c/Target.h>
+#include <llvm-c/TargetMachine.h>
 #include <llvm-c/Transforms/IPO.h>
 #include <llvm-c/Transforms/PassManagerBuilder.h>
 #include <sys/time.h>
@@ -13,9 +15,13 @@
 #include "Image.h"
 #include "Uniform.h"
 #include <sstream>
+#include <fstream>
+#include <map>
 
 #include <dlfcn.h>
+#include <errno.h>
 #include <unistd.h>
+#include <sys/wait.h>
 
 namespace Halide {
     
@@ -711,10 +717,158 @@ namespace Halide {
         doCompileToFile(target, moduleName, args, stmt);
     }
 
+    bool Func::compileToObject(const std::string &moduleName, std::string target,
+                               std::string cpu, std::string features, bool pic) {
+        compileToFile(moduleName, target);
+
+        std::string bc_name = moduleName + ".bc";
+        std::string obj_name = moduleName + ".o";
+        char *errStr = NULL;
+
+        LLVMMemoryBufferRef buffer;
+        if (LLVMCreateMemoryBufferWithContentsOfFile(bc_name.c_str(), &buffer, &errStr)) {
+            fprintf(stderr, "Could not read %s: %s\n", bc_name.c_str(), errStr);
+            LLVMDisposeMessage(errStr);
+            return false;
+        }
+        LLVMModuleRef module;
+        bool error = LLVMParseBitcode(buffer, &module, &errStr);
+        LLVMDisposeMemoryBuffer(buffer);
+        if (error) {
+            fprintf(stderr, "Could not parse %s: %s\n", bc_name.c_str(), errStr);
+            LLVMDisposeMessage(errStr);
+            return false;
+        }
+
+        LLVMInitializeAllTargetInfos();
+        LLVMInitializeAllTargets();
+        LLVMInitializeAllTargetMCs();
+        LLVMInitializeAllAsmPrinters();
+
+        std::string triple = LLVMGetTarget(module);
+        LLVMTargetRef llvmTarget;
+        if (triple.empty() || LLVMGetTargetFromTriple(triple.c_str(), &llvmTarget, &errStr)) {
+            fprintf(stderr, "No LLVM target for triple \"%s\": %s\n", triple.c_str(), errStr ? errStr : "");
+            if (errStr) LLVMDisposeMessage(errStr);
+            LLVMDisposeModule(module);
+            return false;
+        }
+
+        // Same passes as opt -O3 -always-inline
+        LLVMPassManagerBuilderRef builder = LLVMPassManagerBuilderCreate();
+        LLVMPassManagerBuilderSetOptLevel(builder, 3);
+        LLVMPassManagerBuilderUseInlinerWithThreshold(builder, 275);    // opt -O3 inline threshold
+        LLVMPassManagerRef functionPassManager = LLVMCreateFunctionPassManagerForModule(module);
+        LLVMPassManagerRef modulePassManager = LLVMCreatePassManager();
+        LLVMAddAlwaysInlinerPass(modulePassManager);
+        LLVMPassManagerBuilderPopulateFunctionPassManager(builder, functionPassManager);
+        LLVMPassManagerBuilderPopulateModulePassManager(builder, modulePassManager);
+        LLVMPassManagerBuilderDispose(builder);
+
+        LLVMInitializeFunctionPassManager(functionPassManager);
+        for (LLVMValueRef f = LLVMGetFirstFunction(module); f; f = LLVMGetNextFunction(f)) {
+            LLVMRunFunctionPassManager(functionPassManager, f);
+        }
+        LLVMFinalizeFunctionPassManager(functionPassManager);
+        LLVMRunPassManager(modulePassManager, module);
+        LLVMDisposePassManager(functionPassManager);
+        LLVMDisposePassManager(modulePassManager);
+
+        // Same as llc -O3 -filetype=obj
+        LLVMTargetMachineRef machine = 
+            LLVMCreateTargetMachine(llvmTarget, (char *)triple.c_str(), (char *)cpu.c_str(), (char *)features.c_str(),
+                                    LLVMCodeGenLevelAggressive, pic ? LLVMRelocPIC : LLVMRelocDefault,
+                                    LLVMCodeModelDefault);
+        error = LLVMTargetMachineEmitToFile(machine, module, (char *)obj_name.c_str(), LLVMObjectFile, &errStr);
+        if (error) {
+            fprintf(stderr, "Could not emit %s: %s\n", obj_name.c_str(), errStr);
+            LLVMDisposeMessage(errStr);
+        }
+        LLVMDisposeTargetMachine(machine);
+        LLVMDisposeModule(module);
+        return !error;
+    }
+
     void Func::setErrorHandler(void (*handler)(char *)) {
         contents->errorHandler = handler;
     }
 
+    // Compiled code of a lowered function, as stored in the JIT cache
+    struct JITCacheEntry {
+        void (*functionPtr)(void *);
+        void (*copyToHost)(buffer_t *);
+        void (*freeBuffer)(buffer_t *);
+    };
+
+    // In-memory JIT cache of up to HL_JIT_CACHE_SIZE entries (default 64, 0 disables it). Compiled code cannot be
+    // unloaded while Funcs compiled from it may still be realized, so nothing is evicted: once the cache is full,
+    // newly compiled code is not cached.
+    static std::map<std::string, JITCacheEntry> jitCache;
+
+    static size_t jitCacheSize() {
+        char *size = getenv("HL_JIT_CACHE_SIZE");
+        return size ? atoi(size) : 64;
+    }
+
+    static bool jitCacheGet(const std::string &key, JITCacheEntry &entry) {
+        std::map<std::string, JITCacheEntry>::iterator it = jitCache.find(key);
+        if (it == jitCache.end()) return false;
+        entry = it->second;
+        return true;
+    }
+
+    static void jitCachePut(const std::string &key, const JITCacheEntry &entry) {
+        if (jitCache.size() >= jitCacheSize()) return;
+        jitCache.insert(std::make_pair(key, entry));
+    }
+
+    // Run argv[0] with arguments argv (NULL terminated) without a shell, and return whether it exited with status 0
+    static bool runCommand(const char *const argv[]) {
+        pid_t pid = fork();
+        if (pid < 0) return false;
+        if (pid == 0) {
+            execvp(argv[0], (char *const *) argv);
+            _exit(127);
+        }
+        int status;
+        while (waitpid(pid, &status, 0) < 0) {
+            if (errno != EINTR) return false;
+        }
+        return WIFEXITED(status) && WEXITSTATUS(status) == 0;
+    }
+
+    // Stable (across processes and builds) 64 bit FNV-1a hash of a JIT cache key, in hex
+    static std::string jitCacheHash(const std::string &key) {
+        uint64_t h = 14695981039346656037ULL;
+        for (size_t i = 0; i < key.size(); i++) {
+            h = (h ^ (unsigned char) key[i]) * 1099511628211ULL;
+        }
+        char buf[32];
+        snprintf(buf, sizeof(buf), "%016llx", (unsigned long long) h);
+        return buf;
+    }
+
+    // Load path.so of the on-disk JIT cache into entry. Fails if it is missing, or if path.key shows it was built
+    // for another key (a hash collision).
+    static bool jitCacheLoad(const std::string &path, const std::string &key, const std::string &moduleName, JITCacheEntry &entry) {
+        std::ifstream keyFile((path + ".key").c_str(), std::ios::in | std::ios::binary);
+        if (!keyFile) return false;
+        std::stringstream storedKey;
+        storedKey << keyFile.rdbuf();
+        if (storedKey.str() != key) return false;
+
+        void *handle = dlopen((path + ".so").c_str(), RTLD_NOW | RTLD_LOCAL);
+        if (!handle) return false;
+        entry.functionPtr = (void (*)(void *))dlsym(handle, (moduleName + "_c_wrapper").c_str());
+        if (!entry.functionPtr) {
+            dlclose(handle);
+            return false;
+        }
+        entry.copyToHost = (void (*)(buffer_t *))dlsym(handle, "__copy_to_host");
+        entry.freeBuffer = (void (*)(buffer_t *))dlsym(handle, "__free_buffer");
+        return true;
+    }
+
     void Func::compileJIT() {
 
         // If JITting doesn't work well on this platform (ARM), try
@@ -782,6 +936,64 @@ namespace Halide {
         // argument list for the llvm function
         MLVal args = inferArguments();
 
+        // Reuse the code of an identical lowered function (same
+        // definitions, schedule and target) compiled before: by this
+        // process (in memory), or by any process when HL_JIT_CACHE
+        // names a directory of cached shared objects. CUDA modules
+        // need the setup below, so they are always compiled. The
+        // error handler is global to a module, so Funcs with their
+        // own handler always get a module of their own.
+        std::string cacheKey;
+        if (!use_gpu() && !contents->errorHandler) {
+            cacheKey = getTarget() + (use_avx() ? " avx\n" : "\n") + std::string(serializeEntry(name(), args, stmt));
+            JITCacheEntry entry;
+            bool found = jitCacheGet(cacheKey, entry);
+
+            char *cacheDir = getenv("HL_JIT_CACHE");
+            if (!found && cacheDir && *cacheDir) {
+                // The module name is also the entrypoint name, so it
+                // is built in the current directory (like
+                // HL_PSEUDOJIT) then moved into the cache.
+                std::string moduleName = name() + "_jit" + jitCacheHash(cacheKey);
+                std::string path = std::string(cacheDir) + "/" + moduleName;
+                found = jitCacheLoad(path, cacheKey, moduleName, entry);
+                if (!found) {
+                    char suffix[32];
+                    snprintf(suffix, sizeof(suffix), ".%d", (int) getpid());
+                    std::string tmpPath = path + suffix;
+                    std::string objName = moduleName + ".o", soName = tmpPath + ".so";
+                    const char *link[] = {"gcc", "-shared", objName.c_str(), "-o", soName.c_str(), NULL};
+                    bool built = compileToObject(moduleName, getTarget(), use_avx() ? "corei7-avx" : "",
+                                                 use_avx() ? "+avx" : "", true) && runCommand(link);
+                    if (built) {
+                        std::ofstream keyFile((tmpPath + ".key").c_str(), std::ios::out | std::ios::binary);
+                        keyFile << cacheKey;
+                        keyFile.close();
+                        built = keyFile.good() &&
+                            rename((tmpPath + ".so").c_str(), (path + ".so").c_str()) == 0 &&
+                            rename((tmpPath + ".key").c_str(), (path + ".key").c_str()) == 0;
+                    }
+                    unlink((moduleName + ".bc").c_str());
+                    unlink((moduleName + ".o").c_str());
+                    unlink((moduleName + ".h").c_str());
+                    unlink((tmpPath + ".so").c_str());
+                    unlink((tmpPath + ".key").c_str());
+                    found = built && jitCacheLoad(path, cacheKey, moduleName, entry);
+                    if (!found) {
+                        fprintf(stderr, "Could not build %s.so for the JIT cache, compiling in memory\n", path.c_str());
+                    }
+                }
+                if (found) jitCachePut(cacheKey, entry);
+            }
+
+            if (found) {
+                contents->functionPtr = entry.functionPtr;
+                contents->copyToHost = entry.copyToHost;
+                contents->freeBuffer = entry.freeBuffer;
+                return;
+            }
+        }
+
         // Create the llvm module and entrypoint from the imperative IR
         MLVal tuple;
         tuple = doCompile(getTarget(), name(), args, stmt);
@@ -898,6 +1110,8 @@ namespace Halide {
         contents->functionPtr = (void (*)(void*))ptr;
 
         // Retrieve some functions inside the module that we'll want to call from C++
+        contents->copyToHost = NULL;
+        contents->freeBuffer = NULL;
         LLVMValueRef copyToHost = LLVMGetNamedFunction(module, "__copy_to_host");
         if (copyToHost) {
             ptr = LLVMGetPointerToGlobal(FuncContents::ee, copyToHost);
@@ -911,15 +1125,23 @@ namespace Halide {
         }
 
         // If we have a custom error handler, hook it up here
+        LLVMValueRef setErrorHandler = LLVMGetNamedFunction(module, "set_error_handler");
+        typedef void (*handler_t)(char *);
+        void (*setErrorHandlerFn)(handler_t) = NULL;
+        if (setErrorHandler) {
+            ptr = LLVMGetPointerToGlobal(FuncContents::ee, setErrorHandler);
+            setErrorHandlerFn = (void (*)(void (*)(char *)))ptr;
+        }
         if (contents->errorHandler) {
-            LLVMValueRef setErrorHandler = LLVMGetNamedFunction(module, "set_error_handler");
-            assert(setErrorHandler && 
+            assert(setErrorHandlerFn && 
                    "Could not find the set_error_handler function in the compiled module\n");
-            ptr = LLVMGetPointerToGlobal(FuncContents::ee, setErrorHandler);
-            typedef void (*handler_t)(char *);
-            void (*setErrorHandlerFn)(handler_t) = (void (*)(void (*)(char *)))ptr;
             setErrorHandlerFn(contents->errorHandler);
         }
+
+        if (!cacheKey.empty()) {
+            JITCacheEntry entry = {contents->functionPtr, contents->copyToHost, contents->freeBuffer};
+            jitCachePut(cacheKey, entry);
+        }
     }
 
     size_t im_size(const DynImage &im, int dim) {
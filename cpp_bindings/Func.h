@@ -160,6 +160,12 @@ namespace Halide {
         void compileJIT();
         void compileToFile(const std::string &name, std::string target = "");
 
+        // Compile to a native object file name.o (and name.h), running the equivalent
+        // of "opt -O3 -always-inline | llc -O3" in-process. Returns false on failure.
+        // Pass pic = true for objects which will be linked into a shared library.
+        bool compileToObject(const std::string &name, std::string target = "",
+                             std::string cpu = "", std::string features = "", bool pic = false);
+
         void setErrorHandler(void (*)(char *));
 
         void compileToFile(const std::string &name, std::vector<Arg> args, std::string target = "");
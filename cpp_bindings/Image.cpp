@@ -13,6 +13,7 @@ namespace Halide {
         Contents(const Type &t, int a, int b, int c);
         Contents(const Type &t, int a, int b, int c, int d);
         Contents(const Type &t, std::vector<int> sizes);
+        Contents(const Type &t, std::vector<int> sizes, std::vector<int> strides, unsigned char *data);
         ~Contents();
         
         void allocate(size_t bytes);
@@ -64,6 +65,24 @@ namespace Halide {
         allocate(total * (t.bits/8));
     }
     
+    DynImage::Contents::Contents(const Type &t, std::vector<int> sizes, std::vector<int> strides, unsigned char *data) :
+        type(t), size(sizes), stride(strides), name(uniqueName('i')), data(data), copyToHost(NULL), freeBuffer(NULL) {
+        assert(sizes.size() == strides.size() && sizes.size() <= 4);
+
+        buf.host = data;
+        buf.dev = 0;
+        buf.host_dirty = false;
+        buf.dev_dirty = false;
+        buf.extent[0] = buf.extent[1] = buf.extent[2] = buf.extent[3] = 1;
+        for (size_t i = 0; i < size.size(); i++) {
+            assert(sizes[i] > 0 && "Images must have positive sizes");
+            buf.extent[i] = size[i];
+            buf.stride[i] = stride[i];
+        }
+        buf.min[0] = buf.min[1] = buf.min[2] = buf.min[3] = 0;
+        buf.elem_size = type.bits/8;
+    }
+
     DynImage::Contents::~Contents() {
         if (freeBuffer) {
             fprintf(stderr, "freeBuffer %p\n", &buf);
@@ -102,6 +121,8 @@ namespace Halide {
 
     DynImage::DynImage(const Type &t, int a, int b, int c, int d) : contents(new Contents(t, a, b, c, d)) {}
     DynImage::DynImage(const Type &t, std::vector<int> sizes) : contents(new Contents(t, sizes)) {}
+    DynImage::DynImage(const Type &t, std::vector<int> sizes, std::vector<int> strides, unsigned char *data) :
+        contents(new Contents(t, sizes, strides, data)) {}
 
     DynImage::DynImage(const DynImage &other) : contents(other.contents) {}
 
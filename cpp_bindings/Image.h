@@ -18,6 +18,8 @@ namespace Halide {
         DynImage(const Type &t, int a, int b, int c);
         DynImage(const Type &t, int a, int b, int c, int d);
         DynImage(const Type &t, std::vector<int> sizes);
+        // An image over existing memory (not owned, so it must outlive the image), with strides in elements
+        DynImage(const Type &t, std::vector<int> sizes, std::vector<int> strides, unsigned char *data);
         DynImage(const DynImage &other);
 
         Expr operator()(const Expr &a) const;
@@ -20,7 +20,8 @@ namespace Halide {
         // arrays with static storage duration should be initialized to zero automatically
         static int instances[256]; 
         char prefix_cstr[2] = {prefix, '\0'};
-        return std::string(prefix_cstr) + int_to_str(instances[(unsigned char)prefix]++);
+        // Atomic, since images may be allocated (e.g. by a decoding thread) concurrently
+        return std::string(prefix_cstr) + int_to_str(__sync_fetch_and_add(&instances[(unsigned char)prefix], 1));
     }
 
     std::string int_to_str(int x) {
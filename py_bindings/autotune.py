@@ -90,17 +90,29 @@ import examples
 import md5
 import signal
 import multiprocessing
-import threadmap
 import threading
 import shutil
 import autotune_template
+import autotune_cost
+import autotune_library
 import psutil
 import operator
+import math
 import glob
 import re
 import json
 import socket
 import datetime
+import platform
+import select
+import traceback
+import cStringIO
+import cPickle
+import Queue
+import fcntl
+import errno
+import pipes
+import heapq
 from valid_schedules import *
 
 sys.path += ['../util']
@@ -140,12 +152,42 @@ class AutotuneParams:
       -prob_mutate_chunk       p Find a chunk() call and replace with a new random chunk() call
       -crossover_mutate_prob   p Probability that mutate() is called after crossover
       -crossover_random_prob   p Probability that crossover is run with a randomly generated parent
+      -adaptive_operators      b Learn mutation mode and population share weights for the pipeline being tuned, crediting
+                                 operators whose children beat the tournament cutoff (UCB, starting from the above)
+      -operator_ucb_c          p Exploration bonus of adaptive operator selection
+      -operator_decay          p Factor by which operator rewards are discounted each generation
+
+    Cost Model:
+    
+      -cost_model              b Screen children with a regression model of run time trained on timed schedules, and
+                                 compile only those predicted fastest (0 or 1)
+      -cost_model_logs         s Glob of log_schedule.txt files from earlier runs to train on ('' for none)
+      -cost_model_min_samples  n Timed schedules needed before the model is used
+      -cost_model_oversample   n Generate this many times the non-elite children and keep the predicted fastest
+      -cost_model_explore      p Fraction of the kept children chosen at random from those not predicted fastest
 
     Compilation and Running:
     
       -trials                  n Timing runs per schedule
+      -adaptive_trials         b Time with adaptive_min_trials runs first, stop there if clearly slower than the elite cutoff
+                                 (the tournament_size-th best time so far) and add runs up to trials_max for near-ties (0 or 1)
+      -adaptive_min_trials     n Timing runs before the first adaptive decision
+      -adaptive_margin         p Relative difference from the elite cutoff within which a schedule counts as a near-tie
+      -trials_max              n Maximum timing runs per schedule with adaptive_trials
+      -abort_margin            t Stop timing a schedule once its best trial so far is slower than the elite cutoff times
+                                 this factor, recording the partial time as 'aborted' (0 to disable)
+      -fidelity_levels         n Successive halving: first time each generation with 1 trial on this many nested crops of
+                                 the first input image (smallest first), promoting the fastest fidelity_promote fraction
+                                 from each level to the next, so only the finalists get full trials (0 to disable)
+      -fidelity_crop           p Width and height of each crop relative to the next larger level
+      -fidelity_promote        p Fraction of the schedules timed at a crop level which are promoted to the next level
+      -validate                b Reject new children which fail static checks before compiling them (0 or 1)
+      -validate_lower_timeout  t Also lower each new child in a helper process forked at startup, rejecting it if
+                                 lowering fails or takes longer than this timeout (0 to skip lowering)
       -compile_timeout         t Compile timeout in seconds
-      -compile_memory_limit    n Compile memory limit in MB or None for no limit
+      -compile_memory_limit    n Compile address space limit in MB or None for no limit (see limit_memory())
+      -compile_server          b Compile in persistent worker processes which build the pipeline once (0 or 1)
+      -inprocess_codegen       b Emit object files from the bindings instead of piping bitcode through opt and llc (0 or 1)
       -run_timeout_mul         t Fastest run time multiplied by this factor plus bias is cutoff
       -run_timeout_bias        t Additional bias time to allow tester process to start up and shut down
       -run_timeout_default     t Assumed 'fastest run time' before best run time is established
@@ -153,6 +195,21 @@ class AutotuneParams:
       -check_output            b Compare output with known reference output (0 or 1)
       -compile_threads         n Number of threads to use for parallel compile (None defaults to number virtual cores)
       -hl_threads              n Passed as HL_NUMTHREADS (None defaults to HL_NUMTHREADS if set, else virtual cores over 2)
+      -result_db               s Persistent timing database reused across runs, e.g. ~/.autotune_results.txt
+                                 (shared by every run that names the same file, '' to disable)
+      -schedule_library        s Persistent library of the best schedules of past runs, keyed by pipeline structure
+                                 (Func graph and stencil footprints), which seeds new runs, e.g. ~/.autotune_library.txt
+                                 ('' to disable)
+      -library_seeds           n Seeds taken from the closest matches in the schedule library
+      -measure_cpus            s CPUs reserved for timing as a taskset -c list, e.g. 0-3 (compiles use the other CPUs and
+                                 schedules are timed as soon as they compile). None to time after all compiles finish.
+      -timing_partitions       n Time this many schedules at once, each pinned to its own share of the timing CPUs with
+                                 HL_NUMTHREADS set to the size of the share
+      -timing_calibrate_tolerance
+                               p Use a single timing partition if concurrent timing is slower than timing alone by more
+                                 than this fraction
+      -steady_state            b Steady-state GA: breed children as compile slots free up and replace the worst individuals
+                                 as soon as children are timed, instead of waiting for whole generations (0 or 1)
 
     Input and Output Options:
 
@@ -161,10 +218,40 @@ class AutotuneParams:
       -tune_dir                s Autotuning output directory or None to use a default directory
       -in_images               s List of input images to test (can pass multiple images using -in_images a.png:b.png)
       -runner_file             s Runner C++ filename, defaults to within runner/ directory.
+      -shared_runner           b Build the default runner once and load each schedule into it as a shared library (0 or 1)
+      -timing_server           b Time schedules in a resident shared runner which decodes input images once (0 or 1,
+                                 needs shared_runner)
+      -timing_server_libs      n Restart the timing server after it has loaded this many schedules
       -summary_file            s Summary output filename, defaults to summary.txt
       -plot_file               s Convergence plot filename, defaults to plot.png
       -unbiased_file           s Stores unbiased timing comparisons, defaults to unbiased.txt (summary has biased times)
+      -checkpoint              b Save the tuner state to tune_dir after each generation, for 'autotune resume' (0 or 1)
+      -checkpoint_file         s Checkpoint filename, defaults to checkpoint.pkl
       
+    Island Model:
+    
+      -islands                 n Number of populations (islands), which periodically exchange elites. With more than one
+                                 and no island_index, islands are run as local subprocesses in subdirectories of tune_dir
+      -island_index            n Index of this island, for islands started by hand (e.g. on several hosts), or -1
+      -island_dir              s Migration directory shared by the islands (None defaults to tune_dir/islands)
+      -migrate_every           n Generations between migrations
+      -migrants                n Elites each island sends per migration
+
+    Search:
+    
+      -search                  b Instead of the genetic algorithm, decide the Funcs one at a time (callers first) by
+                                 timing every enumerated schedule of each Func for the best partial schedules so far,
+                                 for small pipelines (0 or 1)
+      -search_depth            n Maximum fragments per Func enumerated by search
+      -search_beam             n Partial schedules kept after each Func is decided
+      -search_measure          n Candidates timed per Func once the cost model is trained, those predicted fastest
+                                 (0 to time all)
+      -search_max_candidates   n Schedules enumerated per partial schedule and Func, the rest are skipped (0 for
+                                 no limit)
+      -refine_rounds           n After tuning, rounds of local search which time the schedules whose tile, split,
+                                 vectorize or unroll constants are next to those of the best schedule (0 to disable)
+      -refine_margin           p Relative improvement needed to move to a neighbor in local search
+
     Experimental Features:
     
       -max_nontrivial          n When generating random schedules, max number of nontrivial (non-root/inline) funcs
@@ -202,12 +289,24 @@ class AutotuneParams:
     max_depth = DEFAULT_MAX_DEPTH
     
     trials = 5                  # Timing runs per schedule
+    adaptive_trials = False     # Adapt timing runs per schedule to its distance from the elite cutoff (see docstring)
+    adaptive_min_trials = 2     # Timing runs before the first adaptive decision
+    adaptive_margin = 0.1       # Relative difference from the elite cutoff within which a schedule counts as a near-tie
+    trials_max = 15             # Maximum timing runs per schedule with adaptive_trials
+    abort_margin = 0.0          # Abort timing once best trial so far exceeds the elite cutoff times this, e.g. 3.0 (0 to disable)
+    fidelity_levels = 0         # Successive halving: time first on this many crops of the first input image (see docstring)
+    fidelity_crop = 0.25        # Width and height of each crop relative to the next larger level
+    fidelity_promote = 0.25     # Fraction of the schedules timed at a crop level which are promoted to the next level
     generations = 50
     
     group_generations = 0            # Iters to run with grouping constraints enabled (0 to not use grouping)
     
+    validate = False                    # Reject new children which fail static checks before compiling them
+    validate_lower_timeout = 5.0        # Also lower each new child in a helper process (0 to skip lowering)
     compile_timeout = 40.0 #15.0        # Compile timeout in sec
-    compile_memory_limit = 2500         # Compile memory limit in MB or None for no limit
+    compile_memory_limit = 8000         # Compile address space limit in MB or None for no limit (see limit_memory())
+    compile_server = False              # Compile in persistent worker processes which build the pipeline once
+    inprocess_codegen = False           # Emit object files from the bindings instead of piping bitcode through opt and llc
     
     run_timeout_mul = 2.0 #3.0           # Fastest run time multiplied by this factor plus bias is cutoff
     run_timeout_bias = 5.0               # Run subprocess additional bias to allow tester process to start up and shut down
@@ -216,6 +315,15 @@ class AutotuneParams:
     
     crossover_mutate_prob = 0.15     # Probability that mutate() is called after crossover
     crossover_random_prob = 0.1      # Probability that crossover is run with a randomly generated parent
+    adaptive_operators = False       # Learn mutation mode and population share weights (see docstring)
+    operator_ucb_c = 0.5             # Exploration bonus of adaptive operator selection
+    operator_decay = 0.8             # Factor by which operator rewards are discounted each generation
+    
+    cost_model = False              # Screen children with a learned model of run time (see docstring)
+    cost_model_logs = ''            # Glob of log_schedule.txt files from earlier runs to train on
+    cost_model_min_samples = 32     # Timed schedules needed before the model is used
+    cost_model_oversample = 4       # Generate this many times the non-elite children and keep the predicted fastest
+    cost_model_explore = 0.1        # Fraction of kept children chosen at random from those not predicted fastest
     
     num_print = 10
 
@@ -225,8 +333,27 @@ class AutotuneParams:
     
     compile_threads = None          # Number of processes to use simultaneously for parallel compile (None defaults to number of virtual/hyperthreaded cores)
     hl_threads = None               # Passed in as HL_NUMTHREADS (None defaults to HL_NUMTHREADS if set or else number of virtual/hyperthreaded cores divided by 2)
+    result_db = ''                  # Persistent timing database reused across runs, e.g. ~/.autotune_results.txt ('' to disable)
+    schedule_library = ''           # Persistent library of best schedules which seeds new runs, e.g. ~/.autotune_library.txt ('' to disable)
+    library_seeds = 4               # Seeds taken from the closest matches in the schedule library
+    measure_cpus = None             # CPUs reserved for timing (taskset -c list such as '0-3'), compiles use the rest
+    steady_state = False            # Steady-state GA which overlaps breeding, compiling and timing (see docstring)
+    timing_partitions = 1           # Time this many schedules at once on disjoint CPU sets (see docstring)
+    timing_calibrate_tolerance = 0.05   # Use a single timing partition if concurrent timing is slower by more than this
 
     tune_dir = None                 # Autotuning output directory or None to use a default directory
+    islands = 1                     # Number of island populations which periodically exchange elites
+    island_index = -1               # Index of this island, or -1 to run islands as local subprocesses
+    island_dir = None               # Migration directory shared by the islands (None defaults to tune_dir/islands)
+    migrate_every = 5               # Generations between migrations
+    migrants = 2                    # Elites each island sends per migration
+    search = False                  # Deterministic search over Func schedules instead of the genetic algorithm
+    search_depth = 2                # Maximum fragments per Func enumerated by search
+    search_beam = 4                 # Partial schedules kept after each Func is decided
+    search_measure = 64             # Candidates timed per Func once the cost model is trained (0 to time all)
+    search_max_candidates = 1000    # Schedules enumerated per partial schedule and Func (0 for no limit)
+    refine_rounds = 0               # After tuning, rounds of local search on the constants of the best schedule (0 to disable)
+    refine_margin = 0.01            # Relative improvement needed to move to a neighbor in local search
     tune_link = None                # Symlink (string) pointing to tune_dir (if available)
     
     in_images = []                  # List of input images to test (can pass multiple images using -in_images a.png:b.png)
@@ -236,10 +363,15 @@ class AutotuneParams:
     prob_reasonable = 0.0           # Probability to sample reasonable schedule when sampling random schedule
     
     runner_file = 'default_runner.cpp'
+    shared_runner = False           # Build the default runner once and load each schedule into it as a shared library
+    timing_server = False           # Time schedules in a resident shared runner which decodes input images once
+    timing_server_libs = 64         # Restart the timing server after it has loaded this many schedules
     summary_file = 'summary.txt'
     plot_file = 'plot.png'
     unbiased_file = 'unbiased.txt'  # For unbiased timing comparisons (summary is biased)
     params_file = 'params.txt'      # Serializes AutotuneParams to this file
+    checkpoint = False              # Save the tuner state after each generation, for 'autotune resume'
+    checkpoint_file = 'checkpoint.pkl'
     
     def __init__(self, argd={}, **kw):
         for (key, value) in kw.items():
@@ -249,7 +381,7 @@ class AutotuneParams:
                 raise ValueError('unknown command-line switch %s'%key)
             if key == 'in_images':
                 self.in_images = value.split(':')
-            elif isinstance(getattr(self, key), str) or key in ['tune_dir', 'tune_link']:
+            elif isinstance(getattr(self, key), str) or key in ['tune_dir', 'tune_link', 'measure_cpus', 'island_dir']:
                 setattr(self, key, argd[key])
             else:
                 setattr(self, key, float(argd[key]) if ('.' in value or isinstance(getattr(self, key), float)) else int(argd[key]))
@@ -270,14 +402,15 @@ class AutotuneParams:
         set_cuda(self.cuda)
 
     @staticmethod
-    def loads(s):
+    def loads(s, argd={}):
+        "Deserialize from dumps() output, overriding with command-line switches argd."
         def deunicode(x):
             if isinstance(x, unicode):
                 return str(x)
             return x
         d = json.loads(s)
         d = dict([(deunicode(key), deunicode(value)) for (key, value) in d.items()])
-        return AutotuneParams(**d)
+        return AutotuneParams(argd, **d)
     
     def dumps(self):
         d = {}
@@ -397,6 +530,106 @@ def sample_prob(d):
             return key
     return key
     
+class OperatorBandit:
+    """
+    Adaptive operator selection by UCB credit assignment over a set of operators (arms).
+    
+    Each arm has a prior weight, its configured probability. weights() scales each prior by the arm's UCB score
+    (smoothed success rate plus an exploration bonus), so operators which produce improvements are sampled more
+    often and arms with zero prior stay disabled. decay() discounts old rewards, since the most useful operators
+    change over the course of tuning.
+    """
+    def __init__(self, prior, c=0.5, decay=0.8):
+        self.prior = dict(prior)
+        self.c = c
+        self.decay_factor = decay
+        self.count = dict((arm, 0.0) for arm in prior)
+        self.reward = dict((arm, 0.0) for arm in prior)
+    
+    def add(self, arm, reward):
+        if arm in self.count:
+            self.count[arm] += 1
+            self.reward[arm] += reward
+    
+    def decay(self):
+        for arm in self.count:
+            self.count[arm] *= self.decay_factor
+            self.reward[arm] *= self.decay_factor
+    
+    def weights(self):
+        total = sum(self.count.values())
+        ans = {}
+        for arm in self.prior:
+            n = self.count[arm]
+            score = (self.reward[arm]+1)/(n+2) + self.c*(math.log(total+1)/(n+1))**0.5
+            ans[arm] = self.prior[arm]*score
+        return ans
+
+def genome_operators(genomelog):
+    """
+    Operators which produced a child, as (population mode, mutation mode or None), from its genomelog.
+    
+    Returns None for elite copies and migrants.
+    """
+    if '(elite copy of' in genomelog or genomelog.startswith('migrant('):
+        return None
+    m = re.search(r'mutate_(\w+)\(', genomelog)
+    mutation = m.group(1) if m is not None else None
+    if genomelog.startswith('crossover('):
+        return ('crossover', mutation)
+    elif genomelog.startswith('mutate_'):
+        return ('mutated', mutation)
+    return ('random', None)
+
+class OperatorSelection:
+    """
+    Learns mutation mode weights (prob_mutate_*) and population shares (prob_pop, except elitism) for the pipeline
+    being tuned, with an OperatorBandit for each. A child scores a reward if its time beats the cutoff for
+    tournament selection in the population it was bred from.
+    """
+    def __init__(self, p):
+        self.mutate = OperatorBandit(p.dict_prob_mutate(), p.operator_ucb_c, p.operator_decay)
+        self.pop = OperatorBandit(dict((key, value) for (key, value) in p.prob_pop.items() if key != 'elitism'), p.operator_ucb_c, p.operator_decay)
+    
+    def decay(self):
+        "Discount rewards so far, once per generation."
+        self.mutate.decay()
+        self.pop.decay()
+    
+    def update(self, scheduleL, timeL, cutoff):
+        "Credit the operators which produced the children scheduleL, with timing dicts timeL (cutoff is a time or None)."
+        for (schedule, time_dict) in zip(scheduleL, timeL):
+            ops = genome_operators(schedule.genomelog)
+            if ops is None:
+                continue
+            T = time_dict['time']
+            reward = 1.0 if get_error_str(T) is None and (cutoff is None or T < cutoff) else 0.0
+            self.pop.add(ops[0], reward)
+            if ops[1] is not None:
+                self.mutate.add(ops[1], reward)
+    
+    def params(self, p):
+        "Copy of AutotuneParams p using the learned weights."
+        ans = copy.copy(p)
+        for (key, value) in self.mutate.weights().items():
+            setattr(ans, 'prob_mutate_' + key, value)
+        ans.prob_pop = dict(self.pop.weights())
+        ans.prob_pop['elitism'] = p.prob_pop['elitism']
+        return ans
+    
+    def __str__(self):
+        def format_weights(d):
+            total = max(sum(d.values()), 1e-30)
+            return ', '.join('%s=%.2f' % (key, value/total) for (key, value) in sorted(d.items()))
+        return 'Operator weights: mutate %s; population %s' % (format_weights(self.mutate.weights()), format_weights(self.pop.weights()))
+
+def tournament_cutoff(p, timeL):
+    "Time needed to be in the top p.tournament_size of timing dicts timeL, or None if nothing succeeded."
+    times = sorted(x['time'] for x in timeL if get_error_str(x['time']) is None)
+    if len(times) == 0:
+        return None
+    return times[min(p.tournament_size, len(times))-1]
+
 def crossover(a, b, constraints):
     "Cross over two schedules, using 2 point crossover. Raise BadScheduleError if no valid crossovers possible."
     a0 = a
@@ -650,11 +883,18 @@ def apply_grouping(schedule, grouping):
         return Schedule(schedule.root_func, ans, schedule.genomelog, schedule.generation, schedule.index, schedule.identity_str)
     return schedule
     
-def next_generation(prevL, p, root_func, constraints, generation_idx, timeL):
+def next_generation(prevL, p, root_func, constraints, generation_idx, timeL, cost_model=None, validator=None):
     """"
     Get next generation using elitism/mutate/crossover/random.
     
     Here prevL is list of Schedule instances sorted by decreasing fitness, and p is AutotuneParams.
+    
+    If cost_model (an autotune_cost.CostModel) has at least p.cost_model_min_samples samples then
+    p.cost_model_oversample times as many non-elite children are generated, and those with the lowest
+    predicted times are kept (plus a fraction p.cost_model_explore chosen at random from the rest).
+    
+    If validator is given then new children (other than elite copies) for which validator(schedule) is False are
+    discarded. With a cost model only the children about to be kept are validated.
     """
     assert len(prevL) == len(timeL)
     bothL = sorted([(timeL[i]['time'], prevL[i], timeL[i]) for i in range(len(timeL))])
@@ -667,15 +907,21 @@ def next_generation(prevL, p, root_func, constraints, generation_idx, timeL):
     if is_grouping(p, generation_idx):
         grouping = default_grouping(root_func)
 
+    screen = [cost_model is not None and len(cost_model) >= p.cost_model_min_samples]
+    def valid(schedule):
+        return validator is None or validator(schedule)
+
     ans = []
-    schedule_strs = set()
+    schedule_hashes = set()
     def append_unique(schedule, mode):
         schedule = apply_grouping(schedule, grouping)
         if not schedule.check(schedule):
             raise Duplicate
-        s = str(schedule).strip()
-        if s not in schedule_strs:
-            schedule_strs.add(s)
+        s = schedule.hash()
+        if s not in schedule_hashes:
+            schedule_hashes.add(s)
+            if mode != 'elite' and not screen[0] and not valid(schedule):
+                raise BadScheduleError
             schedule.generation = generation_idx
             schedule.index = len(ans)
             schedule.identity_str = None
@@ -721,10 +967,12 @@ def next_generation(prevL, p, root_func, constraints, generation_idx, timeL):
     P_mutated   = p.prob_pop['mutated']*1.0 / P_total
     P_random    = p.prob_pop['random']*1.0 / P_total
     
-    nrest = p.population_size - len(ans)
-    ncrossover = int(P_crossover*nrest)
-    nmutated = int(P_mutated*nrest)
-    nrandom = nrest-ncrossover-nmutated
+    nelite = len(ans)
+    nrest = p.population_size - nelite
+    ngenerate = nrest*p.cost_model_oversample if screen[0] else nrest
+    ncrossover = int(P_crossover*ngenerate)
+    nmutated = int(P_mutated*ngenerate)
+    nrandom = ngenerate-ncrossover-nmutated
     for i in range(ncrossover):
 #        print 'crossover %d/%d'%(i, ncrossover)
         do_until_success(do_crossover)
@@ -734,6 +982,29 @@ def next_generation(prevL, p, root_func, constraints, generation_idx, timeL):
     for i in range(nrandom):
 #        print 'random %d/%d'%(i,nrandom)
         do_until_success(do_random)
+    
+    if screen[0]:
+        def take_valid(L, n):
+            "Remove from the front of L and return up to n schedules which pass the validator."
+            taken = []
+            while len(taken) < n and len(L):
+                schedule = L.pop(0)
+                if valid(schedule):
+                    taken.append(schedule)
+            return taken
+        predictL = [x[2] for x in sorted([(cost_model.predict(x), x.index, x) for x in ans[nelite:]])]
+        nexplore = int(nrest*p.cost_model_explore)
+        keepL = take_valid(predictL, nrest-nexplore)
+        random.shuffle(predictL)
+        keepL += take_valid(predictL, nrest-len(keepL))
+        ans[nelite:] = keepL
+        for (i, schedule) in enumerate(ans):
+            schedule.index = i
+        
+        # Top up with unscreened random children if too many failed validation
+        screen[0] = False
+        while len(ans) < p.population_size:
+            do_until_success(do_random)
        
     assert len(ans) == p.population_size, (len(ans), p.population_size)
     
@@ -745,7 +1016,7 @@ class AutotuneTimer:
     def __init__(self):
         self.start_time = time.time()
     
-def time_generation(L, p, test_gen_func, timer, constraints, display_text='', save_output=False, compare_schedule=None, trials_override=None, output_stats=None):
+def time_generation(L, p, test_gen_func, timer, constraints, display_text='', save_output=False, compare_schedule=None, trials_override=None, output_stats=None, on_result=None):
     #T0 = time.time()
     #Tcompile = [0.0]
     #Trun = [0.0]
@@ -754,31 +1025,21 @@ def time_generation(L, p, test_gen_func, timer, constraints, display_text='', sa
         stats_str = 'compile time=%d secs, run time=%d secs, total=%d secs, compile_threads=%d, hl_threads=%d'%(timer.compile_time, timer.run_time, time.time()-timer.start_time, p.compile_threads, p.hl_threads)
         if output_stats is not None:
             output_stats[:] = [stats_str]
-        sys.stderr.write('\n'*100 + '%s (%s)\n  Tune dir: %s\n%s\n'%(msg,stats_str,p.tune_link + ' => %s'%p.tune_dir if p.tune_link else p.tune_dir, display_text))
+        text = display_text() if callable(display_text) else display_text
+        sys.stderr.write('\n'*100 + '%s (%s)\n  Tune dir: %s\n%s\n'%(msg,stats_str,p.tune_link + ' => %s'%p.tune_dir if p.tune_link else p.tune_dir, text))
         sys.stderr.flush()
 
-    test_gen_iter = iter(test_gen_func(L, constraints, status_callback, timer, save_output, compare_schedule, trials_override))
-    def time_schedule():
-        info = test_gen_iter.next() #test_func(current, constraints)()
-        #print 'time_schedule', current, info
-        #timer.compile_time += info['compile_avg']
-        #timer.run_time += info['run']
-        return info #['time']
-        #out = test_func(current)
-        #current.apply()
-        #T = []
-        #for i in range(p.trials):
-        #    dout = out()
-        #    T.append(dout['time'])
-        #return min(T) #sum(T)/len(T)
-    
+    if on_result is None:
+        test_gen_iter = iter(test_gen_func(L, constraints, status_callback, timer, save_output, compare_schedule, trials_override))
+    else:
+        test_gen_iter = iter(test_gen_func(L, constraints, status_callback, timer, save_output, compare_schedule, trials_override, on_result))
     ans = []
     success = 0
-    for i in range(len(L)):
+    for info in test_gen_iter:
         Tstart = time.time()
         if AUTOTUNE_VERBOSE:
-            print 'Timing %d/%d'%(i, len(L)),
-        ans.append(time_schedule())
+            print 'Timing %d'%len(ans),
+        ans.append(info)
         #ans.append(time_schedule(L[i]))
         success += get_error_str(ans[-1]['time']) is None #< COMPILE_TIMEOUT
         timer.total_time = time.time()-timer.start_time
@@ -790,10 +1051,11 @@ def time_generation(L, p, test_gen_func, timer, constraints, display_text='', sa
     #print 'Statistics: %s'%stats_str
     return ans
 
-def log_sched(p, schedule, s, no_output=False, filename=LOG_SCHEDULE_FILENAME, f={}):
+def log_sched(p, schedule, s, no_output=False, filename=LOG_SCHEDULE_FILENAME, f={}, mode='wt'):
+    "Log to filename in p.tune_dir, which is opened with the given mode on first use (so by default cleared)."
     if LOG_SCHEDULES:
         if filename not in f:
-            f[filename] = open(os.path.join(p.tune_dir, filename),'wt')
+            f[filename] = open(os.path.join(p.tune_dir, filename), mode)
         if no_output:
             return
         if schedule is not None:
@@ -809,6 +1071,32 @@ RUN_TIMEOUT      = 10004.0
 RUN_FAIL         = 10005.0
 RUN_CHECK_FAIL   = 10006.0
 
+def parse_trial_line(line):
+    "Time in seconds from a runner progress line 'Trial <time>', or None for any other line."
+    L = line.split()
+    if len(L) != 2 or L[0] != 'Trial':
+        return None
+    try:
+        return float(L[1])
+    except ValueError:
+        return None
+
+def parse_run_output(out):
+    "Parse runner result line 'Success best [median [time_1 ... time_n]]' into (best, median or None, trial times)."
+    L = out.split()
+    best = float(L[1])
+    median = float(L[2]) if len(L) > 2 else None
+    samples = [float(x) for x in L[3:]] if len(L) > 3 else [best]
+    return (best, median, samples)
+
+def confidence_interval(samples):
+    "Approximate 95% confidence interval [lo, hi] for the mean of timing samples."
+    mean = float(numpy.mean(samples))
+    if len(samples) < 2:
+        return [mean, mean]
+    h = 1.96*float(numpy.std(samples, ddof=1))/len(samples)**0.5
+    return [mean-h, mean+h]
+
 def get_error_str(timeval):
     "Get error string from special (high-valued) timing value (one of the above constants)."
     d = {COMPILE_TIMEOUT:  'COMPILE_TIMEOUT',
@@ -821,43 +1109,145 @@ def get_error_str(timeval):
         return d[timeval]
     return None
 
+RESULT_DB_VOLATILE = [COMPILE_TIMEOUT, COMPILE_MEMLIMIT, RUN_TIMEOUT]     # Depend on limits of the current run, so never stored
+SERVER_EXITED = ['Compile server exited', 'Timing server exited']       # Failures of a helper process, not of the schedule
+
+def build_fingerprint(runner_file):
+    "Identify the Halide build and runner behind timings (size and modification time of the bindings, library and runner source)."
+    L = []
+    for filename in [os.path.join(_scriptpath, '_cHalide.so'), os.path.join(_scriptpath, '../cpp_bindings/libHalide.a'),
+                     os.path.join(_scriptpath, 'runner', runner_file)]:
+        try:
+            st = os.stat(filename)
+            L.append('%s:%d:%d' % (os.path.basename(filename), st.st_size, int(st.st_mtime)))
+        except OSError:
+            L.append(os.path.basename(filename) + ':missing')
+    return ','.join(L)
+
+def host_fingerprint():
+    "Identify the machine timings were taken on (hostname, cores, architecture, HL_TARGET)."
+    return '%s/%d/%s/%s' % (socket.gethostname(), multiprocessing.cpu_count(), platform.machine(), os.getenv('HL_TARGET') or 'x86_64')
+
+class ResultDatabase:
+    """
+    Persistent timing results shared across autotuner runs.
+
+    Stored as one JSON record per line (appended as results arrive, later records win), keyed by
+    ResultDatabase.key(filter_func_name, schedule.canonical_str(), in_images, hl_threads, out_dims, build),
+    where build is build_fingerprint() so results are not reused after the compiler, runtime or runner change.
+    The number of trials actually run (which adaptive trials and early abort vary) is the 'trials' entry of the
+    timing dict, so a result is only reused for at most as many trials as it was timed with.
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        self.lock = threading.Lock()
+        self.d = {}
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rt') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.d[str(record['key'])] = record['value']
+                    except (ValueError, KeyError):
+                        pass            # Ignore partially written records (e.g. from a killed run)
+
+    @staticmethod
+    def key(filter_func_name, schedule_str, in_images, hl_threads, out_dims, build):
+        L = [filter_func_name, schedule_str.strip(), [os.path.abspath(x) for x in in_images], int(hl_threads),
+             [int(x) for x in out_dims], build, host_fingerprint()]
+        return md5.md5(json.dumps(L)).hexdigest()
+
+    def get(self, key, trials=0):
+        "Get copy of stored timing dict or None if not present or timed with fewer than trials trials (errors have no 'trials')."
+        with self.lock:
+            if key in self.d and self.d[key].get('trials', trials) >= trials:
+                return dict(self.d[key])
+        return None
+
+    def put(self, key, value, info={}):
+        """
+        Store timing dict value (info is additional human readable context written with the record), unless a
+        result with more trials is already stored.
+        """
+        with self.lock:
+            if key in self.d and self.d[key].get('trials', 0) > value.get('trials', 0):
+                return
+            self.d[key] = dict(value)
+            record = dict(info)
+            record.update({'key': key, 'value': value})
+            with open(self.filename, 'at') as f:
+                f.write(json.dumps(record) + '\n')
+
 SLEEP_TIME = 0.01
+TIMING_CALIBRATE_COUNT = 4      # Schedules re-timed alone to calibrate concurrent timing partitions
 
-def wait_timeout(proc, timeout, T0=None, memory_limit=None):
-    "Wait for subprocess to end (returns return code) or timeout (returns None)."
+def read_select(fd, timeout):
+    "Wait up to timeout seconds for fd to become readable and return os.read() data, or None on timeout."
+    while True:
+        try:
+            (readable, _, _) = select.select([fd], [], [], max(timeout, 0.0))
+            break
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+    if not len(readable):
+        return None
+    return os.read(fd, 65536)
+
+def read_timeout(proc, timeout, T0=None, line_callback=None):
+    """
+    Read the output of proc until it closes its stdout, then return (return code, output).
+    
+    Blocks in select() rather than polling. On timeout returns (RUN_LIMIT_TIMEOUT, partial output). If line_callback
+    is given it is called with each line of output as it arrives, and if it returns True then reading stops and
+    (RUN_LIMIT_ABORTED, partial output) is returned.
+    """
     if T0 is None:
         T0 = time.time()
+    fd = proc.stdout.fileno()
+    chunks = []
+    partial = ''
     while True:
-        p = proc.poll()
-        if p is not None:
-            return p
-        if time.time() > T0+timeout:
-            return RUN_LIMIT_TIMEOUT
-        if memory_limit is not None and get_mem_recurse(proc.pid) > memory_limit:
-            return RUN_LIMIT_MEMLIMIT
-        time.sleep(SLEEP_TIME)
+        data = read_select(fd, T0+timeout-time.time())
+        if data is None:
+            return (RUN_LIMIT_TIMEOUT, ''.join(chunks))
+        if len(data) == 0:
+            break
+        chunks.append(data)
+        if line_callback is not None:
+            lines = (partial + data).split('\n')
+            partial = lines.pop()
+            for line in lines:
+                if line_callback(line):
+                    return (RUN_LIMIT_ABORTED, ''.join(chunks))
+    return (proc.wait(), ''.join(chunks))
+
+MEMORY_ERROR_STRS = ['MemoryError', 'bad_alloc', 'Out of memory', 'out of memory', 'Cannot allocate memory']
+
+def is_memory_error(out):
+    "Whether output of a failed process shows that it ran out of memory (see limit_memory())."
+    return any(x in out for x in MEMORY_ERROR_STRS)
+
+def limit_memory(L, memory_limit, shell=False):
+    """
+    Wrap command L (shell string if shell else argument list) so the kernel caps the address space (RLIMIT_AS) of
+    the process and each of its children at memory_limit bytes. Returns L unchanged if memory_limit is None.
+    
+    This is not a limit on resident memory: address space also counts memory that is reserved but never touched,
+    such as thread stacks and glibc's per-thread malloc arenas (64 MB each), so it must be set well above the
+    resident size of a normal compile. It still stops a runaway compile before it exhausts the machine.
+    """
+    if memory_limit is None:
+        return L
+    ulimit = 'ulimit -Sv %d' % max(int(memory_limit)//1024, 1)
+    if shell:
+        return ulimit + '; ' + L
+    return ['sh', '-c', ulimit + '; exec "$@"', 'sh'] + list(L)
 
 RUN_LIMIT_TIMEOUT = -2000
 RUN_LIMIT_MEMLIMIT = -2001
-RUN_LIMIT_ERRCODES = [RUN_LIMIT_TIMEOUT, RUN_LIMIT_MEMLIMIT]
-
-def get_mem_recurse(pid):
-    "Get memory in bytes used by pid."
-    proc = psutil.Process(pid)
-    #ans = proc.get_memory_info()[0]
-    #print 'Memory used:', ans
-    #return ans
-    ans = 0
-    for x in [proc] + proc.get_children():
-        try:
-            ans += x.get_memory_info()[0]
-        except psutil.error.Error:
-            pass
-    #f = open('memused.txt','at')
-    #f.write(str(ans) + '\n')
-    #f.close()
-    return ans
-    #return sum(x.get_memory_info()[0] for x in L)
+RUN_LIMIT_ABORTED = -2003
+RUN_LIMIT_ERRCODES = [RUN_LIMIT_TIMEOUT, RUN_LIMIT_MEMLIMIT, RUN_LIMIT_ABORTED]
 
 def kill_recursive(pid, timeout=1.0):
     proc = psutil.Process(pid)
@@ -877,7 +1267,7 @@ def kill_recursive(pid, timeout=1.0):
             print 'Could not kill pid %d and children' % pid
             break
     
-def run_limit(L, timeout, last_line=False, time_from_subproc=False, shell=False, memory_limit=None, remote_host=None):
+def run_limit(L, timeout, last_line=False, time_from_subproc=False, shell=False, memory_limit=None, remote_host=None, line_callback=None, cwd=None):
     """
     Run shell command in list form, e.g. L=['python', 'autotune.py'], using subprocess.
     
@@ -885,31 +1275,23 @@ def run_limit(L, timeout, last_line=False, time_from_subproc=False, shell=False,
     
     If timed out then status code is set to RUN_LIMIT_TIMEOUT.
     
-    If memory_limit is not None then it should be a max RSS of the process and children in bytes. If the process exceeds this amount
-    it will be killed and the status code set ot RUN_LIMIT_MEMLIMIT.
+    If memory_limit is not None then it should be a max address space in bytes, enforced by the kernel for the process and
+    each of its children. If the process runs out of memory the status code is set to RUN_LIMIT_MEMLIMIT.
+    
+    If line_callback is not None it is called with each line of output as it arrives. If it returns True the process is
+    killed and the status code set to RUN_LIMIT_ABORTED.
+    
+    The process runs in directory cwd if given (the tuner's threads must not change the process-wide directory).
     """
-    fout = tempfile.TemporaryFile()
-    proc = subprocess.Popen(L, stdout=fout, stderr=fout, shell=shell)
-    pid = proc.pid
-    T0 = None
     if time_from_subproc:
         raise NotImplementedError
-        while True:
-            fout.seek(0)
-            fout_s = fout.readline()
-            try:
-                T0 = float(fout_s)
-                break
-            except ValueError:
-                pass
-            time.sleep(SLEEP_TIME)
-        print 'Read T0: %f'% T0
-        #sys.exit(1)
-    status = wait_timeout(proc, timeout, T0, memory_limit)
-    if status in RUN_LIMIT_ERRCODES:
+    proc = subprocess.Popen(limit_memory(L, memory_limit, shell), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=shell, cwd=cwd)
+    (status, ans) = read_timeout(proc, timeout, line_callback=line_callback)
+    if status in [RUN_LIMIT_TIMEOUT, RUN_LIMIT_ABORTED]:
         kill_recursive(proc.pid)
+        proc.wait()
         if remote_host:
-            print 'run timeout - sending remote killall over ssh'
+            print 'run timeout or abort - sending remote killall over ssh'
             remote_kill_cmd = 'ssh %(remote_host)s killall -rq \'f*_*.exe\'' % locals()
             try:
                 subprocess.check_output(remote_kill_cmd, shell=True)
@@ -917,22 +1299,324 @@ def run_limit(L, timeout, last_line=False, time_from_subproc=False, shell=False,
                 print '...already dead?'
                 pass
         return status, ''
+    if status != 0 and memory_limit is not None and is_memory_error(ans):
+        return RUN_LIMIT_MEMLIMIT, ''
         
-    fout.seek(0)
-    ans = fout.read()
     if last_line:
         ans = ans.strip().split('\n')[-1].strip()
     return proc.returncode, ans
 
+class ChildServer:
+    """
+    Persistent child process answering requests: one JSON value per line on its stdin, one JSON reply per line on its stdout.
+
+    The process is started lazily and is killed (and restarted on the next request) if a request times out or the
+    child dies. If memory_limit is not None the child's address space is limited to that many bytes (see limit_memory()).
+    """
+    def __init__(self, args, env=None, memory_limit=None):
+        self.args = args
+        self.env = env
+        self.memory_limit = memory_limit
+        self.proc = None
+        self.buf = ''
+
+    def start(self):
+        self.ferr = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(limit_memory(self.args, self.memory_limit), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.ferr, env=self.env)
+        self.buf = ''
+
+    def kill(self):
+        if self.proc is not None:
+            try:
+                kill_recursive(self.proc.pid)
+                self.proc.wait()
+            except psutil.error.Error:
+                pass
+            self.proc = None
+
+    def stderr_tail(self, n=4096):
+        "Last n bytes written by the child to stderr."
+        self.ferr.seek(0, os.SEEK_END)
+        self.ferr.seek(max(self.ferr.tell()-n, 0))
+        return self.ferr.read()
+
+    def readline(self, timeout, T0):
+        "Read reply line (returns (0, line)) or (RUN_LIMIT_TIMEOUT|RUN_LIMIT_EXITED, None)."
+        fd = self.proc.stdout.fileno()
+        while '\n' not in self.buf:
+            data = read_select(fd, T0+timeout-time.time())
+            if data is None:
+                return (RUN_LIMIT_TIMEOUT, None)
+            if len(data) == 0:
+                return (RUN_LIMIT_EXITED, None)
+            self.buf += data
+        (line, self.buf) = self.buf.split('\n', 1)
+        return (0, line)
+
+    def request(self, obj, timeout):
+        "Send request and return (status, reply), where status is 0 on success (reply is then decoded JSON) else a RUN_LIMIT_* code."
+        (status, line) = self.request_line(json.dumps(obj), timeout)
+        if status != 0:
+            return (status, None)
+        return (0, json.loads(line))
+
+    def request_line(self, line, timeout, progress=None):
+        """
+        As request(), but send a single raw line of text and return the reply line.
+        
+        Lines starting with 'Trial ' before the reply are progress reports, which are passed to progress(line) if given.
+        If that returns True the child is killed and RUN_LIMIT_ABORTED returned.
+        """
+        if self.proc is None:
+            self.start()
+        T0 = time.time()
+        try:
+            self.proc.stdin.write(line + '\n')
+            self.proc.stdin.flush()
+        except IOError:
+            status = RUN_LIMIT_EXITED
+        else:
+            while True:
+                (status, line) = self.readline(timeout, T0)
+                if status != 0 or not line.startswith('Trial '):
+                    break
+                if progress is not None and progress(line):
+                    status = RUN_LIMIT_ABORTED
+                    break
+        if status != 0:
+            self.kill()
+            if status == RUN_LIMIT_EXITED and self.memory_limit is not None and is_memory_error(self.stderr_tail()):
+                status = RUN_LIMIT_MEMLIMIT
+            return (status, None)
+        return (0, line)
+
+RUN_LIMIT_EXITED = -2002
+
+class CompileServerPool:
+    """
+    Pool of n persistent 'autotune.py autotune_compile_server' processes.
+
+    Each worker builds the pipeline once and then compiles many schedules, avoiding interpreter startup and
+    pipeline construction per schedule.
+    """
+    def __init__(self, n, hl_threads, memory_limit=None, cpus=None):
+        env = dict(os.environ)
+        env['HL_NUMTHREADS'] = str(hl_threads)
+        self.free = Queue.Queue()
+        for i in range(n):
+            self.free.put(ChildServer(taskset(['python', os.path.join(_scriptpath, 'autotune.py'), 'autotune_compile_server'], cpus), env, memory_limit))
+
+    def compile(self, args, timeout):
+        "Given argument list for autotune_child() return (status_code, last line of output) in the same format as run_limit()."
+        server = self.free.get()
+        try:
+            (status, reply) = server.request(args, timeout)
+            if status == 0 and reply.get('memlimit', False):
+                server.kill()
+                status = RUN_LIMIT_MEMLIMIT
+        finally:
+            self.free.put(server)
+        if status == RUN_LIMIT_EXITED:
+            return (1, 'Compile server exited')
+        if status != 0:
+            return (status, '')
+        return (0, str(reply['out']))
+
+class TimingServer:
+    """
+    Resident shared runner processes ('runner_*.exe --server', one per runner binary) which decode each input and
+    reference image once and then time many schedules loaded as shared libraries.
+    
+    Halide's thread pool lives inside each loaded library and cannot safely be unloaded, so a server is restarted
+    after it has loaded max_libs libraries.
+    """
+    def __init__(self, hl_threads, max_libs, cpus=None):
+        self.env = dict(os.environ)
+        self.env['HL_NUMTHREADS'] = str(hl_threads)
+        self.max_libs = max_libs
+        self.cpus = cpus
+        self.servers = {}
+        self.libs = {}
+
+    def run(self, runner_exe, lib, func_name, trials, in_image, ref_output, out_w, out_h, out_channels, save_filename, timeout, progress=None):
+        "Time shared library lib and return (status_code, result line) in the same format as run_limit() (progress is its line_callback)."
+        runner_exe = os.path.abspath(runner_exe)
+        lib = os.path.abspath(lib)
+        if runner_exe not in self.servers:
+            self.servers[runner_exe] = ChildServer(taskset([runner_exe, '--server'], self.cpus), self.env)
+            self.libs[runner_exe] = set()
+        server = self.servers[runner_exe]
+        libs = self.libs[runner_exe]
+        if lib not in libs and len(libs) >= self.max_libs:
+            server.kill()
+        if server.proc is None:
+            libs.clear()
+        libs.add(lib)
+        
+        request = [lib, func_name, str(trials), in_image, ref_output, str(out_w), str(out_h), str(out_channels), save_filename]
+        (status, line) = server.request_line('\t'.join(request), timeout, progress)
+        if status == RUN_LIMIT_EXITED:
+            return (1, 'Timing server exited')
+        if status != 0:
+            return (status, '')
+        return (0, line.strip())
+
+class WorkQueue:
+    """
+    Pool of n threads calling func(i, item) on items submitted with put(). As items finish, (tag, i, item, result) is
+    put on the done queue, which may be shared by several WorkQueues (see next_result()).
+    """
+    def __init__(self, func, n, done, tag):
+        self.func = func
+        self.done = done
+        self.tag = tag
+        self.todo = Queue.Queue()
+        self.pending = 0
+        self.threads = [threading.Thread(target=self.work) for i in range(max(n, 1))]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def work(self):
+        while True:
+            item = self.todo.get()
+            if item is None:
+                return
+            (i, x) = item
+            try:
+                self.done.put((self.tag, i, x, self.func(i, x), None))
+            except Exception:
+                self.done.put((self.tag, i, x, None, sys.exc_info()))
+
+    def put(self, i, item):
+        self.pending += 1
+        self.todo.put((i, item))
+
+    def close(self):
+        for t in self.threads:
+            self.todo.put(None)
+
+def next_result(done, queues):
+    """
+    Wait for the next item to finish on the done queue shared by the WorkQueues in dict queues (keyed by tag), and
+    return (tag, i, item, result). Exceptions raised by workers are re-raised here.
+    """
+    (tag, i, item, ans, exc_info) = done.get()
+    queues[tag].pending -= 1
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+    return (tag, i, item, ans)
+
+def parse_cpu_list(s):
+    "Set of CPU numbers from a list in the format of taskset -c, e.g. '0-3,8'."
+    ans = set()
+    for part in s.split(','):
+        if '-' in part:
+            (a, b) = part.split('-')
+            ans.update(range(int(a), int(b)+1))
+        elif part.strip():
+            ans.add(int(part))
+    return ans
+
+def compile_cpu_list(p):
+    "CPUs (as a taskset -c list) for compiling: all but p.measure_cpus, or None if no CPUs are reserved for timing."
+    if p.measure_cpus is None:
+        return None
+    L = sorted(set(range(multiprocessing.cpu_count())) - parse_cpu_list(str(p.measure_cpus)))
+    if len(L) == 0:
+        raise ValueError('measure_cpus leaves no CPUs to compile on')
+    return ','.join(str(x) for x in L)
+
+def timing_partition_list(p):
+    """
+    List of CPU lists (taskset -c format, or None for no pinning) on which schedules are timed concurrently.
+    
+    The CPUs of p.measure_cpus (or all CPUs) are split into p.timing_partitions contiguous parts.
+    """
+    if p.timing_partitions <= 1:
+        return [p.measure_cpus]
+    cpus = sorted(parse_cpu_list(str(p.measure_cpus))) if p.measure_cpus is not None else range(multiprocessing.cpu_count())
+    n = p.timing_partitions
+    if len(cpus) < n:
+        raise ValueError('timing_partitions=%d exceeds the %d CPUs available for timing' % (n, len(cpus)))
+    return [','.join(str(x) for x in cpus[k*len(cpus)//n:(k+1)*len(cpus)//n]) for k in range(n)]
+
+def taskset(L, cpus, shell=False):
+    "Wrap command L (shell string if shell else argument list) to run on CPU list cpus, or return L if cpus is None."
+    if cpus is None:
+        return L
+    if shell:
+        return 'taskset -c %s sh -c %s' % (cpus, pipes.quote(L))
+    return ['taskset', '-c', str(cpus)] + list(L)
+
 def identity_prefix():
     return 'f'
     
 def schedule_ref_output(p, schedule, j):
     return os.path.join(p.tune_dir, identity_prefix() + schedule.identity() + '_%d'%j + p.image_ext)
+
+FIDELITY_ALIGN = 64                 # Crop output sizes for successive halving are rounded down to a multiple of this
+
+def fidelity_crops(p, input, in_image, out_dims):
+    """
+    Crops of in_image for the p.fidelity_levels successive halving levels, smallest first, as a list of
+    (image filename, output dims, fraction of output pixels). The crop images are saved in p.tune_dir.
+    
+    Each crop is taken from the top-left corner with the same border as between the image and the output dims
+    (e.g. tune_out_dims of camera_pipe), and its output size is rounded down to a multiple of FIDELITY_ALIGN.
+    Levels which would not reduce the output size are left out.
+    """
+    A = numpy.asarray(halide.Image(input.type(), in_image))
+    (in_h, in_w) = A.shape[:2]
+    (out_w, out_h, out_channels) = out_dims
+    if out_w < 0:
+        out_w = in_w
+    if out_h < 0:
+        out_h = in_h
+    ans = []
+    for level in range(p.fidelity_levels, 0, -1):
+        scale = p.fidelity_crop**level
+        w = max(int(out_w*scale)//FIDELITY_ALIGN*FIDELITY_ALIGN, FIDELITY_ALIGN)
+        h = max(int(out_h*scale)//FIDELITY_ALIGN*FIDELITY_ALIGN, FIDELITY_ALIGN)
+        if w*h >= out_w*out_h or (len(ans) and w*h <= ans[-1][1][0]*ans[-1][1][1]):
+            continue
+        filename = os.path.join(p.tune_dir, 'fidelity_%d%s' % (level, os.path.splitext(in_image)[1]))
+        halide.Image(numpy.array(A[:h+in_h-out_h,:w+in_w-out_w])).save(filename)
+        ans.append((filename, (w, h, out_channels), float(w*h)/(out_w*out_h)))
+    return ans
     
 def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
     cache = {}
     best_run_time = [p.run_timeout_default]
+    elite_times = []                # Best times of the tournament_size fastest schedules so far
+    elite_lock = threading.Lock()
+
+    def add_elite(T, replace=None):
+        "Add best time T, replacing the earlier time replace of the same schedule (if given and still present)."
+        with elite_lock:
+            if replace is not None and replace in elite_times:
+                elite_times.remove(replace)
+            elite_times.append(T)
+            elite_times.sort()
+            del elite_times[p.tournament_size:]
+
+    def elite_cutoff():
+        "Best time needed to be among the tournament_size fastest schedules so far, or None if too few have been timed."
+        with elite_lock:
+            return elite_times[-1] if len(elite_times) >= p.tournament_size else None
+
+    def more_trials(T, ntrials):
+        "Whether an adaptively timed schedule with best time T after ntrials timing runs should get more runs."
+        if ntrials >= p.trials_max:
+            return False
+        cutoff = elite_cutoff()
+        if cutoff is None:
+            return ntrials < p.trials
+        if T > cutoff*(1+p.adaptive_margin):            # Clearly cannot make the tournament
+            return False
+        if ntrials < p.trials:
+            return True
+        return T > cutoff*(1-p.adaptive_margin)         # Near-tie with the elite
 
     nproc = p.compile_threads
     hl_threads = p.hl_threads
@@ -945,9 +1629,41 @@ def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
     
     (input, out_func, evaluate_func, scope) = call_filter_func(filter_func_name)
     (out_w, out_h, out_channels) = scope.get('tune_out_dims', (-1, -1, -1))
+    fidelity = fidelity_crops(p, input, p.in_images[0], (out_w, out_h, out_channels)) if p.fidelity_levels > 0 else []
+
+    result_db = ResultDatabase(p.result_db) if (allow_cache and p.result_db) else None
+    build = build_fingerprint(p.runner_file) if result_db is not None else None
+    compile_memory_limit = p.compile_memory_limit*(1000**2) if p.compile_memory_limit is not None else None
+    compile_cpus = compile_cpu_list(p)
+    compile_pool = CompileServerPool(nproc, hl_threads, compile_memory_limit, compile_cpus) if p.compile_server else None
+
+    # Schedules are timed concurrently on the timing partitions, each with HL_NUMTHREADS equal to its number of CPUs
+    partitions = timing_partition_list(p)
+    run_hl_threads = [hl_threads if len(partitions) == 1 else len(parse_cpu_list(partitions[0]))]     # Until calibrate() falls back
+    timing_servers = [TimingServer(run_hl_threads[0], p.timing_server_libs, cpus) if p.timing_server else None for cpus in partitions]
+    free_slots = [Queue.Queue()]
+    for slot in range(len(partitions)):
+        free_slots[0].put(slot)
+    calibrated = [len(partitions) == 1]
     
-    def test_func(scheduleL, constraints, status_callback, timer, save_output=False, compare_schedule=None, trials_override=None):       # FIXME: Handle constraints
-        in_images = p.in_images
+    def test_func(scheduleL, constraints, status_callback, timer, save_output=False, compare_schedule=None, trials_override=None, on_result=None):       # FIXME: Handle constraints
+        """
+        Compile and time the schedules in scheduleL, returning a list of timing dicts in the same order.
+        
+        Schedules are compiled in parallel. Normally all compiles finish before the schedules are timed in serial (or
+        p.timing_partitions at a time). If p.measure_cpus is set then each schedule is instead timed (on the reserved
+        CPUs) as soon as it has compiled, while the remaining schedules are still compiling on the other CPUs.
+        
+        scheduleL may also be an iterator, which is then pipelined in the same way: schedules are only pulled from it
+        as compile threads become free, and on_result(schedule, timing dict) is called for each timed schedule (in
+        completion order) before more are pulled, so the iterator can breed from the results so far.
+        
+        If p.fidelity_levels is set (and scheduleL is a list timed after all compiles finish) the runs use successive
+        halving: all schedules are first timed once on the smallest crop, and only the fastest are promoted through
+        the larger crops to the full timing. The times of schedules dropped at a crop level are scaled up by the
+        median ratio of the next level's times to that level's times among the promoted schedules.
+        """
+        in_images = p.in_images                 # Absolute paths (see autotune())
         assert len(in_images) > 0, 'No input images'
         do_check = False
         if p.check_output and compare_schedule is not None:
@@ -958,7 +1674,7 @@ def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
         def do_save_output(i):
             return save_output and i == 0
             
-        def subprocess_args(i, schedule, schedule_str, compile=True, j=0, trials=None):
+        def subprocess_args(i, schedule, schedule_str, compile=True, j=0, trials=None, level=None):
             if trials is None:
                 if trials_override is not None:
                     trials = trials_override[i]
@@ -976,7 +1692,11 @@ def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
                 with open(params_file, 'wt') as f_param:
                     f_param.write(p.dumps())
                     
-            sh_args = ['HL_NUMTHREADS=%d'%hl_threads, 'python', 'autotune.py', 'autotune_%s_child'%mode_str, filter_func_name, schedule_str, os.path.abspath(in_images[j]), '%d'%trials, binary_file, save_filename, (ref_output[j] if do_check else ''), str(out_w), str(out_h), str(out_channels), str(hl_threads), str(p.runner_file), params_file]
+            threads = hl_threads if compile else run_hl_threads[0]
+            (in_image, dims, check_filename) = (in_images[j], (out_w, out_h, out_channels), ref_output[j] if do_check else '')
+            if level is not None:
+                (in_image, dims, check_filename) = (fidelity[level][0], fidelity[level][1], '')
+            sh_args = ['HL_NUMTHREADS=%d'%threads, 'python', os.path.join(_scriptpath, 'autotune.py'), 'autotune_%s_child'%mode_str, filter_func_name, schedule_str, in_image, '%d'%trials, binary_file, save_filename, check_filename, str(dims[0]), str(dims[1]), str(dims[2]), str(threads), str(p.runner_file), params_file]
             sh_line = (' '.join(sh_args[:5]) + ' "' + repr(sh_args[5])[1:-1] + '" ' + ' '.join(sh_args[6:9]) + ' '  +
                            ('"' + sh_args[9] + '"') + ' ' +
                            ('"' + sh_args[10] + '"' if p.check_output else '""') + ' ' + ' '.join(sh_args[11:15]) + (' "' + sh_args[15] + '"') + (' "' + sh_args[16] + '"') + '\n')
@@ -985,23 +1705,56 @@ def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
                 os.chmod(sh_name, 0755)
                 sh_f.write(sh_line)
             return (sh_args, sh_line, binary_file + p.image_ext)
+
+        def db_key(i, schedule):
+            return ResultDatabase.key(filter_func_name, schedule.canonical_str(), in_images, run_hl_threads[0], (out_w, out_h, out_channels), build)
+
+        def db_trials(i):
+            "Fewest trials a stored result must have been timed with to be reused (adaptive trials may stop after the minimum)."
+            if trials_override is not None:
+                return trials_override[i]
+            return min(p.adaptive_min_trials, p.trials) if p.adaptive_trials else p.trials
+
+        def db_lookup(i, schedule, output):
+            "Timing dict from a previous run of the tuner or None (reference outputs are always regenerated)."
+            if result_db is None or do_save_output(i):
+                return None
+            ans = result_db.get(db_key(i, schedule), db_trials(i))
+            if ans is None:
+                return None
+            if get_error_str(ans['time']) is None:
+                best_run_time[0] = min(best_run_time[0], ans['time'])
+                add_elite(ans['time'])
+            ans['output'] = output
+            ans['cached'] = True
+            return ans
             
-        # Compile all schedules in parallel
+        total_str = '/%d'%len(scheduleL) if hasattr(scheduleL, '__len__') else ''
+
+        # Compile schedules in parallel
         compile_count = [0]
         lock = threading.Lock()
-        def compile_schedule(i):
-            status_callback('Compile %d/%d'%(compile_count[0]+1,len(scheduleL)))
+        def compile_schedule(i, schedule):
+            status_callback('Compile %d%s'%(compile_count[0]+1,total_str))
             
-            schedule = scheduleL[i]
             schedule_str = str(schedule)
 
             (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, True)
 
-            if schedule_str in cache:
-                return cache[schedule_str]
+            if schedule.hash() in cache:
+                return cache[schedule.hash()]
+
+            ans = db_lookup(i, schedule, output)
+            if ans is not None:
+                with lock:
+                    compile_count[0] += 1
+                return ans
             
             T0 = time.time()
-            res,out = run_limit(arg_line, p.compile_timeout, last_line=True, memory_limit=p.compile_memory_limit*(1000**2), shell=True)
+            if compile_pool is not None:
+                res,out = compile_pool.compile(argL[3:], p.compile_timeout)
+            else:
+                res,out = run_limit(taskset(arg_line, compile_cpus, True), p.compile_timeout, last_line=True, memory_limit=compile_memory_limit, shell=True)
             Tcompile = time.time()-T0
             
             timer.compile_time = timer_compile + time.time() - Tbegin_compile
@@ -1013,26 +1766,28 @@ def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
             if res == RUN_LIMIT_MEMLIMIT:
                 return {'time': COMPILE_MEMLIMIT, 'compile': Tcompile, 'run': 0.0, 'output': output, 'compile_out': 'None'}
             if not out.startswith('Success'):
-                return {'time': COMPILE_FAIL, 'compile': Tcompile, 'run': 0.0, 'output': output, 'compile_out': out}
+                return {'time': COMPILE_FAIL, 'compile': Tcompile, 'run': 0.0, 'output': output, 'compile_out': out, 'server_exited': out in SERVER_EXITED}
             return {'time': 0.0, 'compile': Tcompile, 'run': 0.0, 'output': output, 'compile_out': out}
         
-        timer_compile = timer.compile_time
-        Tbegin_compile = time.time()
-        shuffled_idx = range(len(scheduleL))
-        #random.shuffle(shuffled_idx)       # Causes mismatches during run
-        compiledL = threadmap.map(compile_schedule, shuffled_idx, n=nproc)
-
-        #Ttotal_compile = time.time()-Tbegin_compile
-        
-        assert len(compiledL) == len(scheduleL)
-        
         def max_run_time(trials):
             return best_run_time[0]*p.run_timeout_mul*p.trials+p.run_timeout_bias+(p.run_save_timeout if save_output else 0.0)
             
-        # Run schedules in serial
-        def run_schedule(i):
-            status_callback('Run %d/%d'%(i+1,len(scheduleL)))
-            schedule = scheduleL[i]
+        # Run schedules, one at a time on each timing partition
+        def run_schedule(i, schedule, compiled_ans, use_cache=True, level=None, retime=None):
+            slots = free_slots[0]
+            slot = slots.get()
+            try:
+                return run_on_partition(i, schedule, compiled_ans, slot, use_cache, level, retime)
+            finally:
+                slots.put(slot)
+
+        run_count = [0]
+        def run_on_partition(i, schedule, compiled_ans, slot, use_cache, level=None, retime=None):
+            "If retime is not None the schedule was already timed with best time retime, which the new time replaces in the elite times."
+            with lock:
+                run_count[0] += 1
+                count = run_count[0]
+            status_callback('Run %d%s'%(count,total_str))
             schedule_str = str(schedule)
             
             T0 = time.time()
@@ -1040,77 +1795,453 @@ def default_tester(input, out_func, p, filter_func_name, allow_cache=True):
             def parse_out_error(out):
                 if res == RUN_LIMIT_TIMEOUT:
                     return {'time': RUN_TIMEOUT, 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out']}
-                elif not out.startswith('Success') or len(out.split()) != 2:
+                elif not out.startswith('Success') or len(out.split()) < 2:
                     code = RUN_FAIL
                     if out.startswith('RUN_CHECK_FAIL'):
                         code = RUN_CHECK_FAIL
-                    return {'time': code, 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out']}
+                    return {'time': code, 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out'],
+                            'server_exited': out in SERVER_EXITED}
                 return None
                 
             # Write (as a side-effect) the run script
             (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, False)
 
-            if schedule_str in cache:
-                return cache[schedule_str]
+            if use_cache and schedule.hash() in cache:
+                return cache[schedule.hash()]
 
-            compiled_ans = compiledL[i]
-            if get_error_str(compiled_ans['time']) is not None:
+            if get_error_str(compiled_ans['time']) is not None or compiled_ans.get('cached', False):
                 return compiled_ans
 
+            # A single trial on the crop of a successive halving level
+            if level is not None:
+                (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, False, trials=1, level=level)
+                res,out = autotune_child(argL[3:], max_run_time(1), timing_servers[slot], partitions[slot])
+                ans = parse_out_error(out)
+                if ans is None:
+                    T = parse_run_output(out)[0]
+                    ans = {'time': T, 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out'],
+                           'trials': 1, 'samples': [T], 'level': level}
+                timer.run_time = timer_run + time.time() - Tbegin_run
+                return ans
+
             # Check the list of input images against their reference outputs (if provided)
             if do_check or do_save_output(i):
                 for j in range(1, len(in_images)):
                     (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, False, j, 1)
-                    res,out = autotune_child(argL[3:], max_run_time(1))
+                    res,out = autotune_child(argL[3:], max_run_time(1), timing_servers[slot], partitions[slot])
                     ans = parse_out_error(out)
                     if ans is not None:
                         return ans
                 
             #res,out = run_timeout(subprocess_args(schedule, schedule_str, False), best_run_time[0]*p.run_timeout_mul*p.trials+p.run_timeout_bias, last_line=True)
-            (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, False)
-            res,out = autotune_child(argL[3:], max_run_time(p.trials))
+            adaptive = p.adaptive_trials and trials_override is None
+            (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, False, trials=min(p.adaptive_min_trials, p.trials) if adaptive else None)
+            ntrials = int(argL[7])
+
+            trial_times = []
+            def progress(line):
+                "Abort once the trials so far show that the schedule cannot make the tournament."
+                # Without a timing server this sees every output line (stderr included), so skip all but trial reports
+                T = parse_trial_line(line)
+                if T is None:
+                    return False
+                trial_times.append(T)
+                cutoff = elite_cutoff()
+                return p.abort_margin > 0 and cutoff is not None and min(trial_times) > cutoff*p.abort_margin
+            res,out = autotune_child(argL[3:], max_run_time(ntrials), timing_servers[slot], partitions[slot], progress)
             
-            ans = parse_out_error(out)
-            if ans is None:
-                T = float(out.split()[1])
+            ans = parse_out_error(out) if res != RUN_LIMIT_ABORTED else None
+            if res == RUN_LIMIT_ABORTED:
+                ans = {'time': min(trial_times), 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out'],
+                       'trials': len(trial_times), 'samples': trial_times, 'aborted': True}
+            elif ans is None:
+                (T, median, samples) = parse_run_output(out)
+                while adaptive and more_trials(T, ntrials):
+                    extra = min(p.trials, p.trials_max-ntrials)
+                    (argL, arg_line, output) = subprocess_args(i, schedule, schedule_str, False, trials=extra)
+                    res,out = autotune_child(argL[3:], max_run_time(extra), timing_servers[slot], partitions[slot])
+                    if parse_out_error(out) is not None:
+                        break
+                    ntrials += extra
+                    (T_extra, median, samples_extra) = parse_run_output(out)
+                    T = min(T, T_extra)
+                    samples += samples_extra
                 best_run_time[0] = min(best_run_time[0], T)
-                ans = {'time': T, 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out']}
+                add_elite(T, retime)
+                ans = {'time': T, 'compile': compiled_ans['compile'], 'run': time.time()-T0, 'output': output, 'compile_out': compiled_ans['compile_out'],
+                       'trials': ntrials, 'samples': samples, 'median': float(numpy.median(samples)), 'ci95': confidence_interval(samples)}
                         
             timer.run_time = timer_run + time.time() - Tbegin_run
             
             return ans
         
-        # Run, cache and display schedule in serial
-        def run_full(i):
-            ans = run_schedule(i)
-            
-            schedule = scheduleL[i]
-            cache.setdefault(str(schedule), ans)
+        # Cache and display schedules in the main thread
+        runD = {}
+        def finish(i, schedule, ans):
+            cache.setdefault(schedule.hash(), ans)
+            if (result_db is not None and not ans.get('cached', False) and not ans.get('aborted', False) and not ans.get('server_exited', False) and
+                'fidelity' not in ans and ans['time'] not in RESULT_DB_VOLATILE):
+                result_db.put(db_key(i, schedule), ans, {'filter_func': filter_func_name, 'schedule': str(schedule)})
 
             e = get_error_str(ans['time'])
             first_part = 'Error %s'%e if e is not None else 'Best time %.6f'%ans['time']
+            if ans.get('aborted', False):
+                first_part += ' (aborted after %d trials)'%ans['trials']
+            if 'fidelity' in ans:
+                first_part += ' (estimated from %dx%d crop)'%tuple(fidelity[ans['fidelity']][1][:2])
             log_sched(p, schedule, '%s, compile=%.6f, run=%.6f, compile_out=%s'%(first_part, ans['compile'], ans['run'], ans['compile_out']))
-            return ans
-            
-        Tbegin_run = time.time()
+            runD[i] = ans
+            if on_result is not None:
+                on_result(schedule, ans)
+
+        def calibrate(ranD):
+            "Compare the concurrent timings of this call with timing the same schedules alone, once per tester."
+            L = sorted([(runD[i]['time'], i) for i in ranD if get_error_str(runD[i]['time']) is None and not runD[i].get('cached', False)])
+            if len(L) < 2:
+                return
+            calibrated[0] = True
+            ratios = []
+            for (T, i) in L[:TIMING_CALIBRATE_COUNT]:
+                (schedule, compiled_ans) = ranD[i]
+                alone = run_schedule(i, schedule, compiled_ans, use_cache=False, retime=T)
+                if get_error_str(alone['time']) is None:
+                    ratios.append(T / alone['time'])
+            ratio = sorted(ratios)[len(ratios)//2] if len(ratios) else 1.0
+            msg = '# Timing partition calibration: concurrent/alone time ratio %.3f over %d schedules' % (ratio, len(ratios))
+            if ratio > 1 + p.timing_calibrate_tolerance:
+                # Time one schedule at a time with all of the timing CPUs and p.hl_threads, as without partitions
+                msg += ', falling back to a single timing partition'
+                partitions.append(p.measure_cpus)
+                timing_servers.append(TimingServer(hl_threads, p.timing_server_libs, p.measure_cpus) if p.timing_server else None)
+                run_hl_threads[0] = hl_threads
+                free_slots[0] = Queue.Queue()
+                free_slots[0].put(len(partitions)-1)
+            print msg
+            log_sched(p, None, msg, filename=p.summary_file)
+        
+        timer_compile = timer.compile_time
+        Tbegin_compile = time.time()
         timer_run = timer.run_time
-        runL = map(run_full, range(len(scheduleL)))
+        Tbegin_run = time.time()
+
+        done = Queue.Queue()
+        compile_queue = WorkQueue(compile_schedule, nproc, done, 'compile')
+        run_queue = WorkQueue(lambda i, item: run_schedule(i, item[0], item[1], level=item[2]), len(partitions), done, 'run')
+        queues = {'compile': compile_queue, 'run': run_queue}
+        pipelined = p.measure_cpus is not None or not isinstance(scheduleL, list)
+        staged = len(fidelity) > 0 and not pipelined and trials_override is None and not save_output
+        
+        levelD = {}                 # Index => ((schedule, compiled_ans, level), timing dict) at the current crop level
+        level_times = {}            # Index => list of times at the crop levels passed so far
+        demoted = {}                # Index => ((schedule, compiled_ans, level), timing dict) for schedules not promoted
+        def promote():
+            "Queue the fastest p.fidelity_promote fraction of the schedules timed at the current crop level for the next level."
+            L = sorted([(ans['time'], i) for (i, (item, ans)) in levelD.items()])
+            npromote = int(math.ceil(len(L)*p.fidelity_promote))
+            for (k, (T, i)) in enumerate(L):
+                (item, ans) = levelD[i]
+                level_times.setdefault(i, []).append(T)
+                if k < npromote:
+                    level = ans['level'] + 1
+                    run_queue.put(i, (item[0], item[1], level if level < len(fidelity) else None))
+                else:
+                    demoted[i] = (item, ans)
+            levelD.clear()
         
-#        for i in range(len(scheduleL)):
-#            schedule = scheduleL[i]
-            #runL[i]['compile_avg'] = Ttotal_compile/len(scheduleL)
+        def finish_demoted():
+            "Finish the schedules dropped at a crop level, scaling their times by the median time ratios between levels."
+            ratios = []
+            for level in range(len(fidelity)):
+                L = []
+                for (i, times) in level_times.items():
+                    if len(times) > level+1:
+                        L.append(times[level+1]/times[level])
+                    elif len(times) == level+1 and i not in demoted and i in runD and get_error_str(runD[i]['time']) is None:
+                        L.append(runD[i]['time']/times[level])
+                pixel_ratio = (fidelity[level+1][2] if level+1 < len(fidelity) else 1.0)/fidelity[level][2]
+                ratios.append(sorted(L)[len(L)//2] if len(L) else pixel_ratio)
+            for i in sorted(demoted):
+                (item, ans) = demoted[i]
+                ans = dict(ans)
+                ans['fidelity'] = ans.pop('level')
+                ans['time'] = ans['time']*reduce(operator.mul, ratios[ans['fidelity']:], 1.0)
+                finish(i, item[0], ans)
         
-        return runL
+        items = enumerate(scheduleL)
+        def submit(n):
+            "Pull schedules into the compile queue until n are compiling or awaiting their run."
+            if compile_queue.pending + run_queue.pending >= n:
+                return
+            for (i, schedule) in items:
+                compile_queue.put(i, schedule)
+                if compile_queue.pending + run_queue.pending >= n:
+                    break
+        compiledD = {}
+        ranD = {}
+        try:
+            submit(2*nproc if pipelined else len(scheduleL))
+            while compile_queue.pending or run_queue.pending:
+                (tag, i, item, ans) = next_result(done, queues)
+                if tag == 'compile':
+                    if pipelined:
+                        run_queue.put(i, (item, ans, None))
+                    else:
+                        compiledD[i] = (item, ans, 0 if staged else None)
+                        if compile_queue.pending == 0:
+                            Tbegin_run = time.time()
+                            for j in sorted(compiledD):
+                                run_queue.put(j, compiledD[j])
+                else:
+                    if 'level' in ans:
+                        levelD[i] = (item, ans)
+                    else:
+                        ranD[i] = item[:2]
+                        finish(i, item[0], ans)
+                    if pipelined:
+                        submit(2*nproc)
+                    elif len(levelD) and run_queue.pending == 0:
+                        promote()
+        finally:
+            compile_queue.close()
+            run_queue.close()
+        finish_demoted()
+
+        if not calibrated[0]:
+            calibrate(ranD)
         
+        return [runD[i] for i in sorted(runD)]
+    
+    def get_state():
+        "Timing cache and run time statistics, for checkpoints."
+        with elite_lock:
+            return {'cache': dict(cache), 'best_run_time': best_run_time[0], 'elite_times': list(elite_times)}
+    
+    def set_state(state):
+        cache.update(state['cache'])
+        best_run_time[0] = state['best_run_time']
+        with elite_lock:
+            elite_times[:] = state['elite_times']
+    
+    test_func.get_state = get_state
+    test_func.set_state = set_state
     return test_func
     
 
+class IslandMigration:
+    """
+    Directory based migration of elites between the populations (islands) of an island model genetic algorithm.
+    
+    send() overwrites island_<index>.json in island_dir with the island's current elites, and receive() reads the
+    files of the other islands. Islands never wait for each other, so they may run at different speeds, on other
+    hosts if island_dir is shared (e.g. over NFS).
+    """
+    def __init__(self, island_dir, index):
+        self.island_dir = island_dir
+        self.index = index
+        self.received = set()
+        try:
+            os.makedirs(island_dir)
+        except OSError:
+            if not os.path.isdir(island_dir):
+                raise
+    
+    def filename(self, index):
+        return os.path.join(self.island_dir, 'island_%03d.json' % index)
+    
+    def send(self, generation, scheduleL, timeL, n):
+        "Publish the n fastest schedules of scheduleL (with timing dicts timeL)."
+        bothL = sorted([(timeL[i]['time'], str(scheduleL[i]), scheduleL[i].identity()) for i in range(len(timeL)) if get_error_str(timeL[i]['time']) is None])
+        elites = [{'time': T, 'schedule': schedule_str, 'identity': identity} for (T, schedule_str, identity) in bothL[:n]]
+        filename = self.filename(self.index)
+        with open(filename + '.tmp', 'wt') as f:
+            f.write(json.dumps({'island': self.index, 'generation': generation, 'elites': elites}))
+        os.rename(filename + '.tmp', filename)
+    
+    def receive(self):
+        "List of (island index, identity, schedule string) for elites of other islands which were not received before."
+        ans = []
+        for filename in sorted(glob.glob(os.path.join(self.island_dir, 'island_*.json'))):
+            try:
+                d = json.loads(open(filename, 'rt').read())
+            except (IOError, ValueError):
+                continue
+            if d['island'] == self.index:
+                continue
+            for elite in d['elites']:
+                schedule_str = str(elite['schedule'])
+                if schedule_str not in self.received:
+                    self.received.add(schedule_str)
+                    ans.append((d['island'], str(elite['identity']), schedule_str))
+        return ans
+
+def receive_migrants(migration, root_func, constraints, generation_idx, seen):
+    "Schedule instances for new migrants from IslandMigration migration, skipping schedule hashes in the set seen."
+    ans = []
+    for (island, identity, schedule_str) in migration.receive():
+        try:
+            schedule = constraints.constrain(Schedule.fromstring(root_func, schedule_str, 'migrant(island %d, %s)' % (island, identity), generation_idx, 0))
+        except (ValueError, KeyError, BadScheduleError):
+            continue
+        s = schedule.hash()
+        if s not in seen and schedule.check():
+            seen.add(s)
+            ans.append(schedule)
+    return ans
+
+def autotune_islands(filter_func_name, p, switches):
+    """
+    Run p.islands populations of the tuner as local subprocesses which migrate elites through a shared directory.
+    
+    Here switches are the command-line switches to pass on to each island. Each island gets a subdirectory of
+    p.tune_dir (with its output in island_<index>.log) and an equal share of p.compile_threads. Islands on other
+    hosts can join by running 'autotune.py autotune' with the same -islands and a shared -island_dir, and their
+    own -island_index.
+    """
+    tune_dir = os.path.abspath(p.tune_dir if p.tune_dir is not None else tempfile.mkdtemp('', 'tune_'))
+    island_dir = os.path.abspath(p.island_dir if p.island_dir is not None else os.path.join(tune_dir, 'islands'))
+    if not os.path.exists(tune_dir):
+        os.makedirs(tune_dir)
+    procs = []
+    for i in range(p.islands):
+        args = [sys.executable, os.path.join(_scriptpath, 'autotune.py'), 'autotune', filter_func_name] + list(switches)
+        args += ['-island_index', str(i), '-island_dir', island_dir, '-tune_dir', os.path.join(tune_dir, 'island_%03d' % i),
+                 '-compile_threads', str(max(p.compile_threads // p.islands, 1))]
+        log = open(os.path.join(tune_dir, 'island_%03d.log' % i), 'wt')
+        print 'Island %d: %s' % (i, ' '.join(pipes.quote(x) for x in args))
+        procs.append(subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, cwd=_scriptpath))
+        log.close()
+    for (i, proc) in enumerate(procs):
+        print 'Island %d exited with status %d' % (i, proc.wait())
+    migration = IslandMigration(island_dir, -1)
+    for i in range(p.islands):
+        try:
+            d = json.loads(open(migration.filename(i), 'rt').read())
+        except (IOError, ValueError):
+            continue
+        if len(d['elites']):
+            print 'Island %d best time %.6f (%s, generation %d):' % (i, d['elites'][0]['time'], d['elites'][0]['identity'], d['generation'])
+            print d['elites'][0]['schedule']
+
 def check_schedules(currentL):
     "Verify that all schedules are valid (according to .check() rules at least)."
     for schedule in currentL:
         if not schedule.check():
             raise ValueError('schedule fails check: %s'%str(schedule))
 
+class LoweringServer:
+    """
+    Helper process which applies and lowers schedules of out_func, to check that Halide accepts them.
+    
+    The helper is forked when the LoweringServer is created, which must be before the tuner starts any threads (a
+    child forked from a threaded process can deadlock on locks held by the other threads). Each schedule is then
+    lowered in a fresh child forked from the single-threaded helper, since Halide errors during lowering abort the
+    process. A schedule still lowering after timeout seconds is rejected, and counted in self.timeouts.
+    """
+    def __init__(self, out_func, constraints, timeout):
+        self.timeout = timeout
+        self.timeouts = 0
+        self.buf = ''
+        (request_r, request_w) = os.pipe()
+        (reply_r, reply_w) = os.pipe()
+        self.pid = os.fork()
+        if self.pid == 0:
+            os.close(request_w)
+            os.close(reply_r)
+            try:
+                self.serve(out_func, constraints, os.fdopen(request_r, 'rt'), reply_w)
+            finally:
+                os._exit(0)
+        os.close(request_r)
+        os.close(reply_w)
+        for fd in [request_w, reply_r]:         # Not inherited by compile and timing processes
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+        self.request_f = os.fdopen(request_w, 'wt')
+        self.reply_fd = reply_r
+
+    def serve(self, out_func, constraints, request_f, reply_fd):
+        "Helper loop: each request line is a JSON schedule string, the reply line is 'ok', 'fail' or 'timeout'."
+        while True:
+            line = request_f.readline()
+            if not line:
+                break
+            schedule_str = json.loads(line)
+            (rfd, wfd) = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(rfd)
+                try:
+                    Schedule.fromstring(out_func, schedule_str).apply(constraints)
+                    out_func.serializeLowered()
+                    os.write(wfd, 'ok')
+                finally:
+                    os._exit(0)
+            os.close(wfd)
+            try:
+                data = read_select(rfd, self.timeout)
+            finally:
+                os.close(rfd)
+                if data is None:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                os.waitpid(pid, 0)
+            os.write(reply_fd, ('timeout' if data is None else 'ok' if data == 'ok' else 'fail') + '\n')
+
+    def lower(self, schedule):
+        "Whether schedule lowers without error within the timeout."
+        if self.pid is None:
+            return True
+        try:
+            self.request_f.write(json.dumps(str(schedule)) + '\n')
+            self.request_f.flush()
+            T0 = time.time()
+            while '\n' not in self.buf:
+                data = read_select(self.reply_fd, T0+self.timeout+10.0-time.time())
+                if not data:
+                    raise IOError('no reply')
+                self.buf += data
+        except (IOError, OSError):
+            print 'Validation: lowering helper died, schedules are only checked statically from now on'
+            self.close()
+            return True
+        (reply, self.buf) = self.buf.split('\n', 1)
+        if reply == 'timeout':
+            self.timeouts += 1
+            print 'Validation: lowering timed out after %.1f s, schedule rejected (%d timeouts): %s' % (self.timeout, self.timeouts, schedule.oneline())
+        return reply == 'ok'
+
+    def close(self):
+        "Stop the helper process."
+        if self.pid is None:
+            return
+        try:
+            self.request_f.close()
+        except (IOError, OSError):
+            pass
+        os.close(self.reply_fd)
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        os.waitpid(self.pid, 0)
+        self.pid = None
+
+def validate_schedule(schedule, lowering_server=None):
+    """
+    Quickly predict whether a schedule will compile, without invoking the compiler.
+    
+    Applies the static .check() rules with the schedule itself as partial schedule, so chunk() compute and store
+    variables are bounds-checked against the loops available from callers (chunk_vars()). If lowering_server is not
+    None the schedule must also lower without error in that LoweringServer.
+    """
+    try:
+        if not schedule.check(schedule):
+            return False
+    except (BadScheduleError, ValueError):
+        return False
+    return lowering_server is None or lowering_server.lower(schedule)
+
 #def autotune(input, out_func, p, tester=default_tester, tester_kw={'in_images': 'lena_crop2.png'}):
 def call_filter_func(filter_func_name, cache={}):
     if not '(' in filter_func_name:         # Call the function if no parentheses (args) given
@@ -1125,7 +2256,24 @@ def call_filter_func(filter_func_name, cache={}):
     cache[filter_func_name] = ans
     return ans
 
-def autotune(filter_func_name, p, tester=default_tester, constraints=Constraints(), seed_scheduleL=[]):
+def write_checkpoint(filename, state):
+    "Atomically save a tuner state dict (see autotune()) to filename."
+    with open(filename + '.tmp', 'wb') as f:
+        cPickle.dump(state, f, 2)
+    os.rename(filename + '.tmp', filename)
+
+def load_checkpoint(filename):
+    "Load a tuner state dict saved by write_checkpoint()."
+    with open(filename, 'rb') as f:
+        return cPickle.load(f)
+
+def autotune(filter_func_name, p, tester=default_tester, constraints=Constraints(), seed_scheduleL=[], resume=None):
+    """
+    Tune filter_func_name using AutotuneParams p.
+    
+    If resume is a state from load_checkpoint() then tuning continues after the checkpointed generation instead
+    of starting from the seed schedules (p.tune_dir should be the checkpoint's directory).
+    """
     timer = AutotuneTimer()
 
     p = copy.deepcopy(p)
@@ -1148,51 +2296,28 @@ def autotune(filter_func_name, p, tester=default_tester, constraints=Constraints
     except:
         pass
         
-    log_sched(p, None, None, no_output=True)    # Clear log file
-    begin_str = '# Begin tuning on %s, %s' % (socket.gethostname(), str(datetime.datetime.now())[:19].strip())
+    log_mode = 'wt' if resume is None else 'at'
+    log_sched(p, None, None, no_output=True, mode=log_mode)    # Clear log file (unless resuming)
+    begin_str = '# %s tuning on %s, %s' % ('Begin' if resume is None else 'Resume', socket.gethostname(), str(datetime.datetime.now())[:19].strip())
     try:
         begin_str += ', git rev. ' + subprocess.check_output('git rev-parse HEAD',shell=True).strip()[:8]
     except subprocess.CalledProcessError:
         pass
-    log_sched(p, None, begin_str + '\n', filename=p.summary_file)
+    log_sched(p, None, begin_str + '\n', filename=p.summary_file, mode=log_mode)
 
     #random.seed(0)
     (input, out_func, evaluate_func, scope) = call_filter_func(filter_func_name)
+    # Forked before the tester starts any worker threads
+    lowering_server = LoweringServer(out_func, constraints, p.validate_lower_timeout) if p.validate and p.validate_lower_timeout else None
     if 'tune_in_images' in scope:
         p.in_images = scope['tune_in_images']
+    p.in_images = [os.path.abspath(x) for x in p.in_images]         # Before any threads start (see autotune_child())
     if 'tune_image_ext' in scope:
         p.image_ext = scope['tune_image_ext']
     if 'tune_runner' in scope:
         p.runner_file = scope['tune_runner']
     test_func = tester(input, out_func, p, filter_func_name)
-    
-    seed_scheduleL = list(seed_scheduleL)
-        
-    currentL = []
-    for (iseed, seed) in enumerate(seed_scheduleL):
-        currentL.append(constraints.constrain(Schedule.fromstring(out_func, seed, 'seed(%d)'%iseed, 0, iseed)))
-
-    if p.seed_reasonable:
-        chunk_cutoff = 0
-        for sample_fragments in [0, 1]:
-            for tile_prob in numpy.arange(0.0,1.01,0.1): #chunk_cutoff in range(1,5):
-                schedule_args = ('reasonable(%.1f,%d)'%(tile_prob,sample_fragments), 0, len(currentL))
-                currentL.append(reasonable_schedule(out_func, chunk_cutoff, tile_prob, sample_fragments, schedule_args))
-
-    if len(seed_scheduleL) == 0:
-        currentL.append(constraints.constrain(Schedule.fromstring(out_func, '', 'seed(0)', 0, 0)))
-
-    nref = 0
-    for (ref_name, ref_schedule_str) in scope.get('tune_ref_schedules', {}).items():
-        currentL.append(constraints.constrain(Schedule.fromstring(out_func, ref_schedule_str, 'ref_' + ref_name, 0, len(currentL))))
-        nref += 1
-
-        #print 'seed_schedule new_vars', seed_schedule.new_vars()
-#        currentL.append(seed_schedule)
-#        currentL.append(Schedule.fromstring(out_func, ''))
-#        currentL.
-    display_text = '\nTiming reference schedules and obtaining reference output image\n'
-    check_schedules(currentL[:len(currentL)-nref])
+    extents = output_extents(p, input, out_func, scope) if p.refine_rounds > 0 else {}
     
     def format_time(timev):
         current_s = '%17.6f'%timev
@@ -1201,47 +2326,141 @@ def autotune(filter_func_name, p, tester=default_tester, constraints=Constraints
             current_s = '%17s'%e
         return current_s
         
-    trials_override = [p.trials] * (len(currentL)-nref) + [p.trials*2]*nref     # Obtain more accurate times for reference schedules
-    # Time reference schedules and obtain reference output image for the first schedule
-    timeL = time_generation(currentL, p, test_func, timer, constraints, display_text, True, trials_override=trials_override)
-    #ref_output = ''
-    ref_log = '-'*40 + '\nReference Schedules\n' + '-'*40 + '\n'
-    compare_schedule = currentL[0]
-    for j in range(len(timeL)):
-        timev = timeL[j]['time']
-        current = currentL[j]
-        current_output = timeL[j]['output']
-        #if os.path.exists(current_output):
-        #    ref_output = current_output
-        line_out = '%s %12s %s'%(format_time(timev), current.genomelog, current.oneline())
-        print line_out
-        ref_log += line_out + '\n'
-    print
-    log_sched(p, None, ref_log, filename=p.summary_file)
-    
-    # Keep only the seed schedules for the genetic algorithm
-    assert len(currentL) == len(timeL)
-    nseed = len(currentL)-nref
-    currentL = currentL[:nseed]
-    timeL = timeL[:nseed]
-    #if ref_output == '':
-    #    raise ValueError('No reference output')
-#    timeL = time_generation(currentL, p, test_func, timer, constraints, display_text)
-#    print timeL
-#    sys.exit(1)
-    
-    for gen in range(1,p.generations+1):
-        if gen == 1:
-            display_text = '\nTiming generation %d'%gen
-
-        currentL = next_generation(currentL, p, out_func, constraints, gen, timeL)
-        # The (commented out) following line tests injecting a bad schedule for blur example (should fail with RUN_CHECK_FAIL).
-        #currentL.append(constraints.constrain(Schedule.fromstring(out_func, 'blur_x_blurUInt16.chunk(x_blurUInt16)\nblur_y_blurUInt16.root().vectorize(x_blurUInt16,16)', 'bad_schedule', gen, len(currentL))))
-        check_schedules(currentL)
-        
-        output_stats = []
-        timeL = time_generation(currentL, p, test_func, timer, constraints, display_text, compare_schedule=compare_schedule, output_stats=output_stats)
+    if resume is None:
+        seed_scheduleL = list(seed_scheduleL)
         
+        currentL = []
+        for (iseed, seed) in enumerate(seed_scheduleL):
+            currentL.append(constraints.constrain(Schedule.fromstring(out_func, seed, 'seed(%d)'%iseed, 0, iseed)))
+
+        if p.seed_reasonable:
+            chunk_cutoff = 0
+            for sample_fragments in [0, 1]:
+                for tile_prob in numpy.arange(0.0,1.01,0.1): #chunk_cutoff in range(1,5):
+                    schedule_args = ('reasonable(%.1f,%d)'%(tile_prob,sample_fragments), 0, len(currentL))
+                    currentL.append(reasonable_schedule(out_func, chunk_cutoff, tile_prob, sample_fragments, schedule_args))
+
+        if len(seed_scheduleL) == 0:
+            currentL.append(constraints.constrain(Schedule.fromstring(out_func, '', 'seed(0)', 0, 0)))
+
+        if p.schedule_library and p.library_seeds > 0:
+            # Best schedules of past runs on similar pipelines, remapped onto this one (skipped if no longer valid)
+            for (ilib, library_str) in enumerate(autotune_library.ScheduleLibrary(p.schedule_library).closest(out_func, p.library_seeds)):
+                try:
+                    schedule = constraints.constrain(Schedule.fromstring(out_func, library_str, 'library(%d)'%ilib, 0, len(currentL)))
+                except (BadScheduleError, ValueError, KeyError, IndexError):
+                    continue
+                if schedule.check():
+                    currentL.append(schedule)
+
+        nref = 0
+        for (ref_name, ref_schedule_str) in scope.get('tune_ref_schedules', {}).items():
+            currentL.append(constraints.constrain(Schedule.fromstring(out_func, ref_schedule_str, 'ref_' + ref_name, 0, len(currentL))))
+            nref += 1
+
+            #print 'seed_schedule new_vars', seed_schedule.new_vars()
+    #        currentL.append(seed_schedule)
+    #        currentL.append(Schedule.fromstring(out_func, ''))
+    #        currentL.
+        display_text = '\nTiming reference schedules and obtaining reference output image\n'
+        check_schedules(currentL[:len(currentL)-nref])
+    
+        trials_override = [p.trials] * (len(currentL)-nref) + [p.trials*2]*nref     # Obtain more accurate times for reference schedules
+        # Time reference schedules and obtain reference output image for the first schedule
+        timeL = time_generation(currentL, p, test_func, timer, constraints, display_text, True, trials_override=trials_override)
+        #ref_output = ''
+        ref_log = '-'*40 + '\nReference Schedules\n' + '-'*40 + '\n'
+        compare_schedule = currentL[0]
+        for j in range(len(timeL)):
+            timev = timeL[j]['time']
+            current = currentL[j]
+            current_output = timeL[j]['output']
+            #if os.path.exists(current_output):
+            #    ref_output = current_output
+            line_out = '%s %12s %s'%(format_time(timev), current.genomelog, current.oneline())
+            print line_out
+            ref_log += line_out + '\n'
+        print
+        log_sched(p, None, ref_log, filename=p.summary_file)
+    
+        # Keep only the seed schedules for the genetic algorithm
+        assert len(currentL) == len(timeL)
+        nseed = len(currentL)-nref
+        currentL = currentL[:nseed]
+        timeL = timeL[:nseed]
+        #if ref_output == '':
+        #    raise ValueError('No reference output')
+    #    timeL = time_generation(currentL, p, test_func, timer, constraints, display_text)
+    #    print timeL
+    #    sys.exit(1)
+        start_gen = 1
+    else:
+        def restore_schedule(state):
+            (schedule_str, genomelog, generation, index, identity_str) = state
+            schedule = Schedule.fromstring(out_func, schedule_str, genomelog, generation, index)
+            schedule.identity_str = identity_str
+            return schedule
+        currentL = [restore_schedule(x) for x in resume['population']]
+        timeL = resume['timeL']
+        compare_schedule = restore_schedule(resume['compare_schedule'])
+        start_gen = resume['generation']+1
+        (timer.compile_time, timer.run_time, elapsed) = resume['timer']
+        timer.start_time = time.time() - elapsed
+        if resume['tester'] is not None and hasattr(test_func, 'set_state'):
+            test_func.set_state(resume['tester'])
+    
+    cost_model = None
+    if p.cost_model:
+        cost_model = autotune_cost.CostModel()
+        for filename in glob.glob(os.path.expanduser(p.cost_model_logs)) if p.cost_model_logs else []:
+            print 'Cost model: %d schedules from %s' % (cost_model.load_log(out_func, filename), filename)
+        add_cost_samples(cost_model, currentL, timeL)
+    
+    operators = OperatorSelection(p) if p.adaptive_operators else None
+    
+    migration = None
+    if p.islands > 1:
+        if p.island_index < 0 or p.island_dir is None:
+            raise ValueError('island model needs -island_index and -island_dir (or use autotune_islands)')
+        migration = IslandMigration(p.island_dir, p.island_index)
+    
+    validator = None
+    if p.validate:
+        validator = lambda schedule: validate_schedule(schedule, lowering_server)
+    
+    display_text = '\nTiming generation %d' % start_gen
+    if resume is not None:
+        display_text = resume['display_text']
+        if resume['cost_model'] is not None and cost_model is not None:
+            cost_model = resume['cost_model']
+        if resume['operators'] is not None and operators is not None:
+            operators = resume['operators']
+        if resume['migration_received'] is not None and migration is not None:
+            migration.received = resume['migration_received']
+        random.setstate(resume['random_state'])
+    
+    def schedule_state(schedule):
+        return (str(schedule), schedule.genomelog, schedule.generation, schedule.index, schedule.identity_str)
+    
+    def save_checkpoint(gen, currentL, timeL, display_text):
+        "Save everything needed to resume tuning after generation gen, if p.checkpoint."
+        if not p.checkpoint:
+            return
+        write_checkpoint(os.path.join(p.tune_dir, p.checkpoint_file),
+            {'filter_func_name': filter_func_name, 'params': p.dumps(), 'exclude': sorted(constraints.exclude_names),
+             'generation': gen, 'population': [schedule_state(x) for x in currentL], 'timeL': timeL,
+             'compare_schedule': schedule_state(compare_schedule), 'display_text': display_text,
+             'timer': (timer.compile_time, timer.run_time, time.time()-timer.start_time),
+             'tester': test_func.get_state() if hasattr(test_func, 'get_state') else None,
+             'cost_model': cost_model, 'operators': operators,
+             'migration_received': migration.received if migration is not None else None,
+             'random_state': random.getstate()})
+    
+    def report_generation(gen, currentL, timeL, newL, output_stats, operators=None):
+        """
+        Display and log the best of currentL (with times timeL), the success rate of the new timing dicts newL,
+        and the learned weights of OperatorSelection operators if not None.
+        """
         bothL = sorted([(timeL[i]['time'], currentL[i], timeL[i]) for i in range(len(timeL))])
         display_text = '\n' + '-'*40 + '\n'
         display_text += 'Generation %d'%(gen) + '\n'
@@ -1251,12 +2470,14 @@ def autotune(filter_func_name, p, tester=default_tester, constraints=Constraints
         display_text += '\n'
 
         success_count = 0
-        for timev in timeL:
+        for timev in newL:
             e = get_error_str(timev['time'])
             if e is None:
                 success_count += 1
                 
-        display_text += ' '*16 + '%d/%d succeed (%.0f%%), %s\n' % (success_count, len(timeL), success_count*100.0/len(timeL), output_stats[0])
+        display_text += ' '*16 + '%d/%d succeed (%.0f%%), %s\n' % (success_count, len(newL), success_count*100.0/max(len(newL), 1), output_stats[0] if len(output_stats) else '')
+        if operators is not None:
+            display_text += '#' + ' '*15 + str(operators) + '\n'
         print display_text
         log_sched(p, None, display_text, filename=p.summary_file)
         sys.stdout.flush()
@@ -1264,6 +2485,296 @@ def autotune(filter_func_name, p, tester=default_tester, constraints=Constraints
         os.system('python autotune_plot.py "%s" "%s"' % (os.path.join(p.tune_dir, p.summary_file), os.path.join(p.tune_dir, p.plot_file)))
         os.system('python autotune.py time "%s" "%s"' % (p.tune_dir, os.path.join(p.tune_dir, p.unbiased_file)))
         os.system('python autotune.py html "%s"' % (p.tune_dir))
+        return display_text
+
+    def finish(currentL, timeL):
+        "Refine the constants of the best schedule with autotune_refine(), report it and add it to the schedule library."
+        close_lowering_server()
+        ans = autotune_refine(p, test_func, timer, constraints, compare_schedule, currentL, timeL, report_generation, extents)
+        if ans is not None:
+            msg = '# Refined best time %.6f (%s): %s' % (ans[0], ans[1].identity(), ans[1].oneline())
+            print msg
+            log_sched(p, None, msg, filename=p.summary_file)
+        else:
+            bothL = sorted([(timev['time'], schedule) for (timev, schedule) in zip(timeL, currentL) if get_error_str(timev['time']) is None], key=lambda x: x[0])
+            ans = bothL[0] if len(bothL) else None
+        if ans is not None and p.schedule_library:
+            autotune_library.ScheduleLibrary(p.schedule_library).add(filter_func_name, out_func, str(ans[1]), ans[0])
+
+    def close_lowering_server():
+        "Stop the lowering helper, logging how many schedules it rejected by timeout."
+        if lowering_server is not None:
+            if lowering_server.timeouts:
+                log_sched(p, None, '# %d schedules rejected by lowering timeout' % lowering_server.timeouts, filename=p.summary_file)
+            lowering_server.close()
+
+    if p.search:
+        (currentL, timeL) = autotune_search(p, out_func, test_func, timer, constraints, compare_schedule, report_generation, cost_model, validator)
+        finish(currentL, timeL)
+        return
+
+    if p.steady_state:
+        (currentL, timeL) = autotune_steady_state(p, out_func, test_func, timer, constraints, compare_schedule, currentL, timeL, report_generation, cost_model, validator, operators, migration, start_gen, display_text, save_checkpoint)
+        finish(currentL, timeL)
+        return
+
+    for gen in range(start_gen,p.generations+1):
+        cutoff = tournament_cutoff(p, timeL)
+        currentL = next_generation(currentL, operators.params(p) if operators is not None else p, out_func, constraints, gen, timeL, cost_model, validator)
+        if migration is not None:
+            # Migrants replace the last (random) children and are timed on this island
+            migrantL = receive_migrants(migration, out_func, constraints, gen, set(x.hash() for x in currentL))
+            migrantL = migrantL[:p.population_size-int(p.population_size*p.prob_pop['elitism'])]
+            if len(migrantL):
+                currentL[len(currentL)-len(migrantL):] = migrantL
+                for (i, schedule) in enumerate(currentL):
+                    schedule.index = i
+        # The (commented out) following line tests injecting a bad schedule for blur example (should fail with RUN_CHECK_FAIL).
+        #currentL.append(constraints.constrain(Schedule.fromstring(out_func, 'blur_x_blurUInt16.chunk(x_blurUInt16)\nblur_y_blurUInt16.root().vectorize(x_blurUInt16,16)', 'bad_schedule', gen, len(currentL))))
+        check_schedules(currentL)
+        
+        output_stats = []
+        timeL = time_generation(currentL, p, test_func, timer, constraints, display_text, compare_schedule=compare_schedule, output_stats=output_stats)
+        add_cost_samples(cost_model, currentL, timeL)
+        if operators is not None:
+            operators.decay()
+            operators.update(currentL, timeL, cutoff)
+        display_text = report_generation(gen, currentL, timeL, timeL, output_stats, operators)
+        if migration is not None and (gen % p.migrate_every == 0 or gen == p.generations):
+            migration.send(gen, currentL, timeL, p.migrants)
+        save_checkpoint(gen, currentL, timeL, display_text)
+    finish(currentL, timeL)
+
+def add_cost_samples(cost_model, scheduleL, timeL):
+    "Train cost_model (if not None) on the successfully timed schedules of scheduleL."
+    if cost_model is not None:
+        for (schedule, time_dict) in zip(scheduleL, timeL):
+            if get_error_str(time_dict['time']) is None:
+                cost_model.add(schedule, time_dict['time'])
+
+def autotune_search(p, out_func, test_func, timer, constraints, compare_schedule, report_generation, cost_model=None, validator=None):
+    """
+    Deterministic search, used by autotune() if p.search, for small pipelines.
+    
+    Funcs are decided one at a time in topological order of the call graph (callers before callees, from callers()
+    and toposort()), so that the chunk() candidates of a Func see the loops of its decided callers. Each partial
+    schedule (state) leaves the undecided Funcs at their defaults (inline, or root for the output and reductions).
+    For each of the p.search_beam fastest states, the schedules of the next Func up to p.search_depth fragments are
+    enumerated lazily with schedules_func(), at most p.search_max_candidates per state. Once the cost model has
+    p.cost_model_min_samples samples, only the p.search_measure candidates of each state it predicts fastest are kept
+    (scored as they are generated), so the enumeration is never held in memory. The fastest p.search_beam extended
+    states are kept for the next Func. Without limits and with a beam as large as the number of candidates, this is
+    an exhaustive search of the enumerated space.
+    
+    Returns (beam, timing dicts of the beam), for the fastest timed states.
+    """
+    funcs = halide.all_funcs(out_func)
+    order = [name for name in toposort(callers(out_func)) if name not in constraints.exclude_names]
+    beam = [constraints.constrain(Schedule.fromstring(out_func, '', 'search', 0, 0))]
+    beam_timeL = []
+    display_text = '\nTiming search step 1'
+    for (step, name) in enumerate(order):
+        hashes = set()
+        def extend(state):
+            "Generator of the unseen, checked schedules which extend state with a schedule of Func name."
+            for L in schedules_func(out_func, funcs[name], 0, p.search_depth, partial_schedule=state):
+                d = dict(state.d)
+                d[name] = L
+                schedule = constraints.constrain(Schedule(out_func, d, 'search(%s)' % name, step+1, 0))
+                if schedule.hash() not in hashes and schedule.check(schedule):
+                    hashes.add(schedule.hash())
+                    yield schedule
+        prune = cost_model is not None and len(cost_model) >= p.cost_model_min_samples and p.search_measure > 0
+        candidates = []
+        for state in beam:
+            gen = extend(state)
+            if p.search_max_candidates > 0:
+                gen = itertools.islice(gen, p.search_max_candidates)
+            if prune:
+                candidates.extend(heapq.nsmallest(p.search_measure, gen, key=cost_model.predict))
+            else:
+                candidates.extend(gen)
+        if prune and len(candidates) > p.search_measure:
+            candidates = heapq.nsmallest(p.search_measure, candidates, key=cost_model.predict)
+        if validator is not None:
+            candidates = [x for x in candidates if validator(x)]
+        for (i, schedule) in enumerate(candidates):
+            schedule.index = i
+        print 'Search step %d/%d: %s, %d candidates' % (step+1, len(order), name, len(candidates))
+        
+        output_stats = []
+        timeL = time_generation(candidates, p, test_func, timer, constraints, display_text, compare_schedule=compare_schedule, output_stats=output_stats)
+        add_cost_samples(cost_model, candidates, timeL)
+        display_text = report_generation(step+1, candidates, timeL, timeL, output_stats)
+        bothL = sorted([(timeL[i]['time'], i) for i in range(len(timeL)) if get_error_str(timeL[i]['time']) is None])
+        if len(bothL):
+            beam = [candidates[i] for (T, i) in bothL[:p.search_beam]]
+            beam_timeL = [timeL[i] for (T, i) in bothL[:p.search_beam]]
+    return (beam, beam_timeL) if len(beam_timeL) else ([], [])
+
+def output_extents(p, input, out_func, scope):
+    "Dict mapping each variable name of out_func to the output size (from tune_out_dims or the first input image)."
+    dims = list(scope.get('tune_out_dims', (-1, -1, -1)))
+    if min(dims) < 0:
+        A = numpy.asarray(halide.Image(input.type(), p.in_images[0]))
+        in_dims = [A.shape[1], A.shape[0], A.shape[2] if len(A.shape) >= 3 else 1]
+        dims = [in_dims[i] if dims[i] < 0 else dims[i] for i in range(len(in_dims))]
+    return dict(zip(halide.func_varlist(out_func), dims))
+
+def const_divisible(L, extents):
+    "Whether the tile, split, vectorize and unroll constants of FragmentList L divide the known extents (dict) of their variables."
+    extents = dict(extents)
+    for fragment in L:
+        if isinstance(fragment, FragmentSplit):
+            (sizes, inner) = ([(fragment.var, fragment.value)], [(fragment.newvar, fragment.value)])
+        elif isinstance(fragment, FragmentTile):
+            (sizes, inner) = ([(fragment.xvar, fragment.xsize), (fragment.yvar, fragment.ysize)], [(fragment.xnewvar, fragment.xsize), (fragment.ynewvar, fragment.ysize)])
+        elif isinstance(fragment, (FragmentVectorize, FragmentUnroll)):
+            (sizes, inner) = ([(fragment.var, fragment.value)], [])
+        else:
+            continue
+        for (var, size) in sizes:
+            extent = extents.get(var, 0)
+            if extent > 0:
+                if extent % size != 0:
+                    return False
+                extents[var] = extent // size
+        extents.update(inner)
+    return True
+
+def const_neighbors(schedule, extents={}):
+    """
+    Copies of schedule with one tile, split, vectorize or unroll constant moved to an adjacent value in the
+    blocksizes of its Fragment class.
+    
+    Here extents maps variables of the output Func to the output size. If the constants of the output Func divide
+    these sizes (see const_divisible()) then so do those of the neighbors.
+    """
+    ans = []
+    root_name = schedule.root_func.name()
+    for name in sorted(schedule.d.keys()):
+        L = schedule.d[name]
+        divisible = name == root_name and const_divisible(L, extents)
+        for (k, fragment) in enumerate(L):
+            if isinstance(fragment, (FragmentSplit, FragmentVectorize, FragmentUnroll)):
+                attrs = ['value']
+            elif isinstance(fragment, FragmentTile):
+                attrs = ['xsize', 'ysize']
+            else:
+                continue
+            for attr in attrs:
+                value = getattr(fragment, attr)
+                ladder = sorted(set(fragment.blocksizes + [value]))
+                i = ladder.index(value)
+                for new_value in ladder[max(i-1, 0):i] + ladder[i+1:i+2]:
+                    neighbor = copy.copy(schedule)
+                    new_fragment = copy.copy(fragment)
+                    setattr(new_fragment, attr, new_value)
+                    neighbor.d[name][k] = new_fragment
+                    if divisible and not const_divisible(neighbor.d[name], extents):
+                        continue
+                    neighbor.genomelog = 'refine(%s)' % schedule.identity()
+                    ans.append(neighbor)
+    return ans
+
+def autotune_refine(p, test_func, timer, constraints, compare_schedule, currentL, timeL, report_generation, extents={}):
+    """
+    Local search on the constants of the fastest schedule of currentL (with timing dicts timeL), used by autotune()
+    after the genetic algorithm.
+    
+    Each round times all const_neighbors() of the best schedule so far (compiled in parallel, like a generation)
+    and moves to the fastest if it is faster by more than the fraction p.refine_margin, for up to p.refine_rounds
+    rounds. Rounds are numbered as generations after p.generations. Returns the final (best time, best schedule),
+    or None if there was no successfully timed schedule to refine.
+    """
+    bothL = sorted([(timeL[i]['time'], i) for i in range(len(timeL)) if get_error_str(timeL[i]['time']) is None])
+    if p.refine_rounds <= 0 or len(bothL) == 0:
+        return None
+    (best_time, best) = (bothL[0][0], currentL[bothL[0][1]])
+    seen = set(x.hash() for x in currentL)
+    display_text = '\nRefining constants of %s' % best.identity()
+    for gen in range(p.generations+1, p.generations+p.refine_rounds+1):
+        neighborL = []
+        for neighbor in const_neighbors(best, extents):
+            neighbor = constraints.constrain(neighbor)
+            if neighbor.hash() not in seen and neighbor.check():
+                seen.add(neighbor.hash())
+                (neighbor.generation, neighbor.index) = (gen, len(neighborL))
+                neighborL.append(neighbor)
+        if len(neighborL) == 0:
+            break
+        output_stats = []
+        timeL = time_generation(neighborL, p, test_func, timer, constraints, display_text, compare_schedule=compare_schedule, output_stats=output_stats)
+        display_text = report_generation(gen, neighborL, timeL, timeL, output_stats)
+        bothL = sorted([(timeL[i]['time'], i) for i in range(len(timeL)) if get_error_str(timeL[i]['time']) is None])
+        if len(bothL) == 0 or bothL[0][0] >= best_time*(1-p.refine_margin):
+            break
+        (best_time, best) = (bothL[0][0], neighborL[bothL[0][1]])
+    return (best_time, best)
+
+def autotune_steady_state(p, out_func, test_func, timer, constraints, compare_schedule, currentL, timeL, report_generation, cost_model=None, validator=None, operators=None, migration=None,
+                          start_gen=1, display_text='\nTiming generation 1', save_checkpoint=None):
+    """
+    Steady-state genetic algorithm, used by autotune() if p.steady_state.
+    
+    Children are bred (with next_generation() at a batch size of compile_threads) only as compile slots free up, and
+    each timed child immediately replaces the worst member of the population. Compiling, timing and breeding therefore
+    overlap instead of waiting for whole generations. Every population_size children count as one generation for
+    identities, reporting and save_checkpoint(gen, population, times, display_text). Best used with p.measure_cpus,
+    so that timing is isolated from the compiles.
+    """
+    population = [(timeL[i]['time'], currentL[i], timeL[i]) for i in range(len(timeL)) if get_error_str(timeL[i]['time']) is None]
+    population.sort()
+    nevals = p.generations*p.population_size
+    batch_p = copy.deepcopy(p)
+    batch_p.population_size = max(p.compile_threads, 1)
+    state = {'display_text': display_text, 'newL': []}
+
+    def children():
+        seen = set(x.hash() for x in currentL)
+        n = (start_gen-1)*p.population_size
+        while n < nevals:
+            gen = 1 + n // p.population_size
+            gen_p = operators.params(batch_p) if operators is not None else batch_p
+            batch = next_generation([x[1] for x in population], gen_p, out_func, constraints, gen, [x[2] for x in population], cost_model, validator)
+            if migration is not None:
+                batch = receive_migrants(migration, out_func, constraints, gen, set(seen)) + batch
+            for child in batch:
+                s = child.hash()
+                if s in seen:
+                    continue
+                seen.add(s)
+                child.generation = gen
+                child.index = n % p.population_size
+                child.identity_str = None
+                check_schedules([child])
+                n += 1
+                yield child
+                if n >= nevals:
+                    return
+
+    output_stats = []
+    def on_result(schedule, ans):
+        add_cost_samples(cost_model, [schedule], [ans])
+        if operators is not None:
+            operators.update([schedule], [ans], tournament_cutoff(p, [x[2] for x in population]))
+        if get_error_str(ans['time']) is None:
+            population.append((ans['time'], schedule, ans))
+            population.sort()
+            del population[p.population_size:]
+        state['newL'].append(ans)
+        if len(state['newL']) == p.population_size:
+            if operators is not None:
+                operators.decay()
+            state['display_text'] = report_generation(schedule.generation, [x[1] for x in population], [x[2] for x in population], state['newL'], output_stats, operators)
+            state['newL'] = []
+            if migration is not None and (schedule.generation % p.migrate_every == 0 or schedule.generation == p.generations):
+                migration.send(schedule.generation, [x[1] for x in population], [x[2] for x in population], p.migrants)
+            if save_checkpoint is not None:
+                save_checkpoint(schedule.generation, [x[1] for x in population], [x[2] for x in population], state['display_text'])
+
+    time_generation(children(), p, test_func, timer, constraints, lambda: state['display_text'], compare_schedule=compare_schedule, output_stats=output_stats, on_result=on_result)
+    return ([x[1] for x in population], [x[2] for x in population])
 
 import inspect
 _scriptfile = inspect.getfile(inspect.currentframe()) # script filename (usually with path)
@@ -1286,7 +2797,44 @@ def _ctype_of_type(t):
             ty = 'uint'
         return ty + width + '_t'
 
-def autotune_child(args, timeout=None):
+_png_flags = None
+
+def get_png_flags():
+    "Compile and link flags for libpng (libpng-config is only run once per process)."
+    global _png_flags
+    if _png_flags is None:
+        _png_flags = subprocess.check_output('libpng-config --cflags --ldflags', shell=True).replace('\n', ' ')
+    return _png_flags
+
+def build_shared_runner(runner_exe, runner_file, in_t, out_t):
+    """
+    Build runner_file in shared library mode (TEST_DLOPEN) as runner_exe in the current directory, unless it exists.
+    
+    Compile children run concurrently, so the first one to arrive builds the runner while holding a lock.
+    """
+    if os.path.exists(runner_exe):
+        return
+    with open(runner_exe + '.lock', 'w') as lock_f:
+        fcntl.flock(lock_f, fcntl.LOCK_EX)
+        if os.path.exists(runner_exe):
+            return
+        support_include = os.path.join(_scriptpath, '../support')
+        png_flags = get_png_flags()
+        tmp_exe = runner_exe + '.%d' % os.getpid()
+        cmd = 'g++ -O3 -DTEST_DLOPEN -DTEST_IN_T=%(in_t)s -DTEST_OUT_T=%(out_t)s -I%(support_include)s %(runner_file)s -o %(tmp_exe)s -lpthread -ldl -lrt %(png_flags)s' % locals()
+        print cmd
+        subprocess.check_output(cmd, shell=True)
+        os.rename(tmp_exe, runner_exe)
+
+def autotune_child(args, timeout=None, timing_server=None, cpus=None, progress=None):
+    """
+    Compile and/or time the schedule given by argument list args (see subprocess_args() in default_tester()).
+    
+    Compiling writes its files to the current directory, which must be the directory of the binary file (see
+    child_working_dir()), so it only runs in child processes. Timing is also called from the tuner's run threads, so
+    it does not change the current directory (which is process-wide) or touch the pipeline's Funcs, and runs the
+    binaries built by the compile stage.
+    """
     rest = args[1:]
     if len(rest) == 11:
         p = AutotuneParams()
@@ -1309,17 +2857,18 @@ def autotune_child(args, timeout=None):
     #os.kill(parent_pid, signal.SIGCONT)
     
     (input, out_func, evaluate_func, scope) = call_filter_func(filter_func_name)
-    schedule = Schedule.fromstring(out_func, schedule_str.replace('\\n', '\n'))
-    constraints = Constraints()         # FIXME: Deal with Constraints() mess
-    schedule.apply(constraints)
 
-    llvm_path = os.path.abspath('../llvm/Release+Asserts/bin/')
+    llvm_path = os.path.abspath(os.path.join(_scriptpath, '../llvm/Release+Asserts/bin/'))
     if not llvm_path.endswith('/'):
         llvm_path += '/'
 
+    # binary_file: full path
+    func_name = os.path.basename(binary_file)
+    working = os.path.dirname(binary_file)
+
     def check_output(s):
         print s
-        return subprocess.check_output(s,shell=True)
+        return subprocess.check_output(s, shell=True, cwd=working)
 
     ###
     ### auto-initialize remote/cross compile info from HL_TARGET for now
@@ -1347,6 +2896,10 @@ def autotune_child(args, timeout=None):
     if target == 'ptx':
         ldflags = '-lcuda'
 
+    inprocess_codegen = p.inprocess_codegen and not march and hasattr(out_func, 'compileToObject')
+    codegen_cpu = mcpu
+    codegen_features = mattr
+
     march = march and '-march='+march or ''
     mattr = mattr and '-mattr='+mattr or ''
     mcpu  = mcpu  and '-mcpu=' +mcpu or ''
@@ -1354,17 +2907,28 @@ def autotune_child(args, timeout=None):
     ### end auto-initialize remote/cross compile
     ###
 
-    # binary_file: full path
-    orig = os.getcwd()
-    func_name = os.path.basename(binary_file)
-    working = os.path.dirname(binary_file)
-    os.chdir(working)
+    in_t  = _ctype_of_type(scope.get('tune_in_type', input.type()))
+    out_t = _ctype_of_type(scope.get('tune_out_type', out_func.returnType()))
+
+    # One dlopen()ing runner per tuning directory (and type signature) instead of a new executable per schedule
+    shared_runner = p.shared_runner and not remote_host and runner_file == 'default_runner.cpp'
+    runner_exe = 'runner_%s_%s.exe' % (in_t, out_t)
+
     if args[0] in ['autotune_compile_child', 'autotune_compile_run_child']:
         T0 = time.time()
         print "In %s, compiling %s" % (working, func_name)
-
-        # emit object file
-        out_func.compileToFile(func_name)
+        assert os.path.samefile(os.getcwd(), working), 'compiling in %s instead of %s' % (os.getcwd(), working)
+        schedule = Schedule.fromstring(out_func, schedule_str.replace('\\n', '\n'))
+        constraints = Constraints()         # FIXME: Deal with Constraints() mess
+        schedule.apply(constraints)
+
+        # emit object file (opt and llc are still used when cross compiling or if in-process codegen fails)
+        if not (inprocess_codegen and out_func.compileToObject(func_name, '', codegen_cpu, codegen_features, shared_runner)):
+            out_func.compileToFile(func_name)
+            reloc = '-relocation-model=pic' if shared_runner else ''
+            check_output(
+                'cat %(func_name)s.bc | %(llvm_path)sopt -O3 -always-inline | %(llvm_path)sllc -O3 %(reloc)s %(march)s %(mattr)s %(mcpu)s -filetype=obj -o %(func_name)s.o' % locals()
+            )
 
         # copy default_runner locally
         default_runner = os.path.join(_scriptpath, 'runner', runner_file)
@@ -1372,29 +2936,23 @@ def autotune_child(args, timeout=None):
         halide_include = os.path.join(_scriptpath, '../cpp_bindings')
         link_dir = os.path.abspath(os.path.join(_scriptpath, '../cpp_bindings'))
 
-        in_t  = _ctype_of_type(scope.get('tune_in_type', input.type()))
-        out_t = _ctype_of_type(scope.get('tune_out_type', out_func.returnType()))
-
-        # get PNG flags
-        png_flags = subprocess.check_output('libpng-config --cflags --ldflags', shell=True).replace('\n', ' ')
-        
-        # assemble bitcode
-        check_output(
-            'cat %(func_name)s.bc | %(llvm_path)sopt -O3 -always-inline | %(llvm_path)sllc -O3 %(march)s %(mattr)s %(mcpu)s -filetype=obj -o %(func_name)s.o' % locals()
-        )
-
         #save_output_str = '-DSAVE_OUTPUT ' if save_output else ''
         #shutil.copyfile(default_runner, working)
-        if not remote_host:
-            compile_command = 'g++ -DTEST_FUNC=%(func_name)s -DTEST_IN_T=%(in_t)s -DTEST_OUT_T=%(out_t)s -I. -I%(support_include)s %(default_runner)s %(func_name)s.o -o %(func_name)s.exe -lpthread %(png_flags)s %(ldflags)s'
+        if shared_runner:
+            compile_command = 'gcc -shared %(func_name)s.o -o %(func_name)s.so %(ldflags)s'
+        elif not remote_host:
+            png_flags = get_png_flags()
+            compile_command = 'g++ -DTEST_FUNC=%(func_name)s -DTEST_IN_T=%(in_t)s -DTEST_OUT_T=%(out_t)s -I. -I%(support_include)s %(default_runner)s %(func_name)s.o -o %(func_name)s.exe -lpthread -lrt %(png_flags)s %(ldflags)s'
         else:
             compile_command = ['rsync -a %(support_include)s/static_image.h %(support_include)s/image_io.h %(support_include)s/image_equal.h %(default_runner)s %(func_name)s.o %(func_name)s.h %(remote_host)s:%(remote_path)s/',
-                               'ssh %(remote_host)s \'cd %(remote_path)s; g++ -DTEST_FUNC=%(func_name)s -DTEST_IN_T=%(in_t)s -DTEST_OUT_T=%(out_t)s -I. default_runner.cpp "%(func_name)s.o" -o "%(func_name)s.exe" -lpthread -lpng %(ldflags)s\'']
+                               'ssh %(remote_host)s \'cd %(remote_path)s; g++ -DTEST_FUNC=%(func_name)s -DTEST_IN_T=%(in_t)s -DTEST_OUT_T=%(out_t)s -I. default_runner.cpp "%(func_name)s.o" -o "%(func_name)s.exe" -lpthread -lrt -lpng %(ldflags)s\'']
             compile_command = ';'.join(compile_command)
 
         compile_command = compile_command % locals()
         print compile_command
         try:
+            if shared_runner:
+                build_shared_runner(runner_exe, default_runner, in_t, out_t)
             out = check_output(compile_command)
         except:
             raise ValueError('Compile failed')
@@ -1404,7 +2962,12 @@ def autotune_child(args, timeout=None):
         #return
 
     if args[0] in ['autotune_run_child', 'autotune_compile_run_child']:
-        if not remote_host:
+        if shared_runner and timing_server is not None and timeout is not None:
+            return timing_server.run(os.path.join(working, runner_exe), os.path.join(working, func_name + '.so'), func_name, trials, in_image, ref_output,
+                                     out_w, out_h, out_channels, save_filename, timeout, progress)
+        if shared_runner:
+            run_command = 'HL_NUMTHREADS=%(hl_threads)s TEST_LIB=./%(func_name)s.so TEST_FUNC_NAME=%(func_name)s ./%(runner_exe)s %(trials)d %(in_image)s "%(ref_output)s" %(out_w)d %(out_h)d %(out_channels)d "%(save_filename)s"'
+        elif not remote_host:
             run_command = 'HL_NUMTHREADS=%(hl_threads)s ./%(func_name)s.exe %(trials)d %(in_image)s "%(ref_output)s" %(out_w)d %(out_h)d %(out_channels)d "%(save_filename)s"'
         else:
             in_image_file = in_image
@@ -1422,21 +2985,62 @@ def autotune_child(args, timeout=None):
             run_command = '; '.join(run_command)
         
         run_command = run_command % locals()
+        if not remote_host:
+            run_command = taskset(run_command, cpus if cpus is not None else p.measure_cpus, True)
         print 'Testing: %s' % run_command
 
         # Don't bother running with timeout, parent process will manage that for us
-        try:
-            if timeout is None:
-                out = check_output(run_command)
-                print out.strip()
-                return
-            else:
-                return run_limit(run_command, timeout, last_line=True, shell=True, remote_host=remote_host)
-        finally:
-            os.chdir(orig)
+        if timeout is None:
+            out = check_output(run_command)
+            print out.strip()
+            return
+        else:
+            return run_limit(run_command, timeout, last_line=True, shell=True, remote_host=remote_host, line_callback=progress, cwd=working)
     #else:
     #    raise ValueError(args[0])
 
+def child_working_dir(args):
+    "Directory of the binary file of autotune_child() argument list args, where its compile stage must run."
+    return os.path.dirname(os.path.abspath(args[5]))
+
+def autotune_compile_server():
+    """
+    Compile server loop (see CompileServerPool): each line of stdin is a JSON argument list for autotune_child() and
+    the reply is a JSON dict with the last line of output under 'out', and 'memlimit' set if the compile ran out of
+    memory (the server then exits).
+    
+    Output written to file descriptor 1 by the compiler is redirected to stderr so it cannot corrupt the replies.
+    """
+    reply_f = os.fdopen(os.dup(1), 'wt')
+    os.dup2(2, 1)
+    stdout = sys.stdout
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        args = [str(x) for x in json.loads(line)]
+        sys.stdout = cStringIO.StringIO()
+        memlimit = False
+        try:
+            os.chdir(child_working_dir(args))
+            autotune_child(args)
+        except MemoryError:
+            traceback.print_exc()
+            memlimit = True
+        except Exception:
+            traceback.print_exc()
+            print 'Compile failed'
+        finally:
+            out = sys.stdout.getvalue()
+            sys.stdout = stdout
+        reply = {'out': out.strip().split('\n')[-1].strip()}
+        if memlimit:
+            reply['memlimit'] = True
+        reply_f.write(json.dumps(reply) + '\n')
+        reply_f.flush()
+        if memlimit:
+            break
+
 def is_number(s):
     try:
         float(s)
@@ -1510,6 +3114,9 @@ def main():
         print '  Helper to tune one example (or all examples, or a whitespace separated list in a file with .txt extension).'
         print '  Supplies reasonable arguments for the example.'
         print
+        print 'autotune resume tune_dir [switches]'
+        print '  Resume an interrupted tuning run (started with -checkpoint 1) from its last checkpoint (switches override the saved ones).'
+        print
         print 'autotune time tune_dir [log_timefile.txt]'
         print '  Tuner timings are biased. Run this to get unbiased comparison of ref schedules against best tuned schedule.'
         print
@@ -1541,7 +3148,7 @@ def main():
             if os.path.exists(tune_dir):
                 existL.append(tune_dir)
         if len(existL):
-            print 'The following directories exist, remove them?'
+            print 'The following directories exist, remove them? (Use autotune.py resume tune_dir to continue an interrupted run.)'
             print
             print '\n'.join('  ' + x for x in existL)
             print 
@@ -1563,6 +3170,18 @@ def main():
             elif examplename in ['camera_pipe', 'bilateral_grid']:
                 rest = '-generations 150'.split() + rest
             system('python autotune.py autotune examples.%s.filter_func -tune_dir "%s" %s' % (examplename, tune_dir, ' '.join(rest)))
+    elif args[0] == 'resume':
+        if len(args) < 2:
+            print >> sys.stderr, 'Expected 2 arguments'
+            sys.exit(1)
+        tune_dir = os.path.abspath(args[1])
+        resume = load_checkpoint(os.path.join(tune_dir, argd.get('checkpoint_file', AutotuneParams.checkpoint_file)))
+        p = AutotuneParams.loads(resume['params'], argd)
+        p.tune_dir = tune_dir
+        (input, out_func, test_func, scope) = call_filter_func(resume['filter_func_name'])
+        d_func = halide.all_funcs(out_func)
+        constraints = Constraints([d_func[name] for name in resume['exclude']])
+        autotune(resume['filter_func_name'], p, constraints=constraints, resume=resume)
     elif args[0] == 'time':
         if len(args) < 2:
             print >> sys.stderr, 'Expected 2 arguments'
@@ -1776,7 +3395,10 @@ def main():
         #        exclude.append(scope[key])
         constraints = Constraints(exclude)
 
-        autotune(filter_func_name, p, constraints=constraints, seed_scheduleL=seed_scheduleL)
+        if p.islands > 1 and p.island_index < 0:
+            autotune_islands(filter_func_name, p, sys.argv[3:])
+        else:
+            autotune(filter_func_name, p, constraints=constraints, seed_scheduleL=seed_scheduleL)
     elif args[0] in ['test_sched']:
         #(input, out_func, test_func) = examples.blur()
         pass
@@ -1785,7 +3407,10 @@ def main():
         (input, out_func, test_func, scope) = getattr(examples, examplename)()
         s = Schedule.fromstring(out_func, 'blur_x_blur0.root().parallel(y)\nblur_y_blur0.root().parallel(y).vectorize(x,8)')
     elif args[0] in ['autotune_compile_child', 'autotune_run_child', 'autotune_compile_run_child']:           # Child process for autotuner
+        os.chdir(child_working_dir(args))
         autotune_child(args)
+    elif args[0] == 'autotune_compile_server':                                                               # Persistent compile child
+        autotune_compile_server()
     else:
         raise NotImplementedError('%s not implemented'%args[0])
 #    test_schedules()
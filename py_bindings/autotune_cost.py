@@ -0,0 +1,155 @@
+"""
+Learned cost model for autotuner schedules.
+
+Schedules are reduced to hashed features (fragment types per Func, log2 of vectorize/unroll/split/tile sizes,
+chunk depths and loop order) and a ridge regression predicts log run time. The genetic algorithm uses it to
+over-generate children and compile only those predicted to be fastest.
+"""
+
+import math
+import re
+import zlib
+import numpy
+from valid_schedules import *
+
+LOG_SEPARATOR = '-'*40
+
+def fragment_kind(fragment):
+    "Short name of a fragment type, e.g. 'vectorize' for FragmentVectorize."
+    return fragment.__class__.__name__[len('Fragment'):].lower()
+
+def log2(x):
+    return math.log(max(x, 1), 2)
+
+def schedule_features(schedule):
+    "Dict mapping feature name to value for a Schedule instance."
+    ans = {'bias': 1.0}
+    def add(name, value=1.0):
+        ans[name] = ans.get(name, 0.0) + value
+
+    for fname in sorted(schedule.d.keys()):
+        L = schedule.d[fname]
+        if len(L) == 0:
+            add('inline')
+            add(fname + ':inline')
+            continue
+        kind = fragment_kind(L[0])
+        add(kind)
+        add(fname + ':' + kind)
+        for fragment in L[1:]:
+            fkind = fragment_kind(fragment)
+            add(fname + ':' + fkind)
+            if isinstance(fragment, (FragmentVectorize, FragmentUnroll, FragmentSplit)):
+                add(fname + ':' + fkind + '_log2', log2(fragment.value))
+            elif isinstance(fragment, FragmentTileBase):
+                add(fname + ':' + fkind + '_log2x', log2(fragment.xsize))
+                add(fname + ':' + fkind + '_log2y', log2(fragment.ysize))
+
+        # Depth of compute and store levels within the loops of the callers
+        if isinstance(L[0], FragmentChunk):
+            try:
+                cvars = list(reversed(chunk_vars(schedule, L.func)))
+            except (BadScheduleError, ValueError):
+                cvars = []
+            if L[0].var in cvars:
+                add(fname + ':chunk_depth', cvars.index(L[0].var)+1)
+            if L[0].storevar in cvars:
+                add(fname + ':store_depth', cvars.index(L[0].storevar)+1)
+
+        # Loop order of the Func's own loops
+        try:
+            order = FragmentList(L.func, [FragmentRoot()] + list(L[1:])).var_order()
+        except (BadScheduleError, ValueError):
+            continue
+        if len(order):
+            add(fname + ':order=' + '_'.join(order))
+            add(fname + ':inner=' + order[-1])
+            for fragment in L[1:]:
+                if isinstance(fragment, FragmentVectorize) and fragment.var == order[-1]:
+                    add(fname + ':vectorize_inner')
+                elif isinstance(fragment, FragmentParallel) and fragment.var == order[0]:
+                    add(fname + ':parallel_outer')
+    return ans
+
+class CostModel:
+    """
+    Ridge regression from hashed schedule features to log run time.
+
+    Call add() with timed schedules (repeats of a schedule are ignored), then predict() for new schedules. The model
+    is refit lazily when predict() follows add().
+    """
+    def __init__(self, dim=1024, ridge=1.0):
+        self.dim = dim
+        self.ridge = ridge
+        self.X = []
+        self.y = []
+        self.w = None
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.y)
+
+    def vector(self, schedule):
+        "Hashed feature vector of a schedule."
+        ans = numpy.zeros(self.dim)
+        for (name, value) in schedule_features(schedule).items():
+            ans[zlib.crc32(name) % self.dim] += value
+        return ans
+
+    def add(self, schedule, T):
+        "Add a schedule with best run time T in seconds."
+        s = schedule.hash()
+        if T <= 0 or s in self.seen:
+            return
+        try:
+            x = self.vector(schedule)
+        except (BadScheduleError, ValueError, KeyError):
+            return
+        self.seen.add(s)
+        self.X.append(x)
+        self.y.append(math.log(T))
+        self.w = None
+
+    def fit(self):
+        X = numpy.array(self.X)
+        y = numpy.array(self.y)
+        self.y_mean = y.mean()
+        y = y - self.y_mean
+        (n, d) = X.shape
+        if n < d:
+            self.w = numpy.dot(X.T, numpy.linalg.solve(numpy.dot(X, X.T) + self.ridge*numpy.eye(n), y))
+        else:
+            self.w = numpy.linalg.solve(numpy.dot(X.T, X) + self.ridge*numpy.eye(d), numpy.dot(X.T, y))
+
+    def predict(self, schedule):
+        "Predicted log run time of a schedule."
+        if len(self.y) == 0:
+            return 0.0
+        if self.w is None:
+            self.fit()
+        return float(numpy.dot(self.vector(schedule), self.w)) + self.y_mean
+
+    def load_log(self, root_func, filename):
+        """
+        Add the successfully timed schedules in an autotuner log_schedule.txt file, returning the number added.
+
+        Schedules which do not parse for root_func (e.g. from another filter) are skipped.
+        """
+        count = 0
+        for block in open(filename, 'rt').read().split(LOG_SEPARATOR + '\n'):
+            L = block.strip('\n').split('\n')
+            if len(L) < 2 or not L[0].startswith('Schedule '):
+                continue
+            status = [i for i in range(1, len(L)) if L[i].startswith('Best time ') or L[i].startswith('Error ')]
+            if len(status) == 0:
+                continue
+            m = re.match(r'Best time ([0-9.eE+-]+)', L[status[0]])
+            if m is None:
+                continue
+            try:
+                schedule = Schedule.fromstring(root_func, '\n'.join(L[1:status[0]]))
+            except (BadScheduleError, ValueError, KeyError, IndexError):
+                continue
+            self.add(schedule, float(m.group(1)))
+            count += 1
+        return count
@@ -0,0 +1,114 @@
+"""
+Library of the winning schedules of past autotuner runs, used to seed new runs (transfer tuning).
+
+Each schedule is stored with a signature of its pipeline: the Funcs in topological order (callers first), their
+dimensions, whether they are reductions and the stencil footprints (Func.footprint) of their calls. A new run is
+seeded with the schedules of the closest signatures, with Func and variable names remapped onto the new pipeline.
+"""
+
+import json
+import math
+import os
+import re
+import halide
+from valid_schedules import *
+
+def pipeline_signature(root_func):
+    """
+    Signature of the pipeline computing root_func: list with a dict per Func in toposort() order, with keys 'name',
+    'vars' (variable names), 'reduction' and 'calls' (sorted list of [caller index, footprint of the call]).
+    """
+    funcs = halide.all_funcs(root_func)
+    d = callers(root_func)
+    order = toposort(d)
+    ans = []
+    for name in order:
+        f = funcs[name]
+        calls = sorted([[order.index(caller), [int(x) for x in funcs[caller].footprint(f)]] for caller in set(d[name])])
+        ans.append({'name': name, 'vars': list(halide.func_varlist(f)), 'reduction': bool(f.isReduction()), 'calls': calls})
+    return ans
+
+def footprint_distance(a, b):
+    "Mean absolute difference of log2 extents between two footprints (non-positive extents count as 1)."
+    if len(a) != len(b):
+        return 1.0
+    if len(a) == 0:
+        return 0.0
+    return sum([abs(math.log(max(x, 1), 2) - math.log(max(y, 1), 2)) for (x, y) in zip(a, b)]) / len(a)
+
+def signature_distance(a, b):
+    """
+    Distance between pipeline signatures a and b, or None if schedules cannot be remapped between them (the number
+    of Funcs or the dimensions of a Func differ).
+    """
+    if len(a) != len(b):
+        return None
+    ans = 0.0
+    for (fa, fb) in zip(a, b):
+        if len(fa['vars']) != len(fb['vars']):
+            return None
+        ans += fa['reduction'] != fb['reduction']
+        calls_a = dict((caller, footprint) for (caller, footprint) in fa['calls'])
+        calls_b = dict((caller, footprint) for (caller, footprint) in fb['calls'])
+        for caller in set(calls_a) | set(calls_b):
+            if caller in calls_a and caller in calls_b:
+                ans += footprint_distance(calls_a[caller], calls_b[caller])
+            else:
+                ans += 1
+    return ans
+
+def remap_schedule(schedule_str, old_signature, new_signature):
+    """
+    Rename the Funcs and variables in schedule_str from the pipeline of old_signature to the corresponding (same
+    position) Funcs and variables of new_signature. Variables created by the schedule (e.g. _c0) are unchanged.
+    """
+    names = {}
+    for (fa, fb) in zip(old_signature, new_signature):
+        names.setdefault(fa['name'], fb['name'])
+        for (va, vb) in zip(fa['vars'], fb['vars']):
+            names.setdefault(va, vb)
+    return re.sub(r'[A-Za-z_][A-Za-z0-9_]*', lambda m: names.get(m.group(0), m.group(0)), schedule_str)
+
+class ScheduleLibrary:
+    """
+    Winning schedules of past runs, stored as one JSON record per line (appended as runs finish) with keys
+    'filter_func', 'signature', 'schedule' and 'time'.
+    """
+    def __init__(self, filename):
+        self.filename = os.path.abspath(os.path.expanduser(filename))
+        self.records = []
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rt') as f:
+                for line in f:
+                    try:
+                        self.records.append(json.loads(line))
+                    except ValueError:
+                        pass            # Ignore partially written records (e.g. from a killed run)
+
+    def add(self, filter_func_name, root_func, schedule_str, T):
+        "Store schedule_str of the pipeline computing root_func with best run time T."
+        record = {'filter_func': filter_func_name, 'signature': pipeline_signature(root_func), 'schedule': schedule_str.strip(), 'time': T}
+        self.records.append(record)
+        with open(self.filename, 'at') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def closest(self, root_func, n):
+        """
+        Up to n distinct schedule strings for the pipeline computing root_func, remapped from the records with the
+        closest signatures (the fastest first among equally close records).
+        """
+        signature = pipeline_signature(root_func)
+        L = []
+        for record in self.records:
+            distance = signature_distance(record['signature'], signature)
+            if distance is not None:
+                L.append((distance, record['time'], record))
+        L.sort(key=lambda x: x[:2])
+        ans = []
+        for (distance, T, record) in L:
+            s = str(remap_schedule(record['schedule'], record['signature'], signature))
+            if s not in ans:
+                ans.append(s)
+            if len(ans) >= n:
+                break
+        return ans
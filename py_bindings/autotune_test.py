@@ -352,9 +352,405 @@ def test_params():
     p = AutotuneParams()
     print 'autotune.AutotuneParams:             OK'
 
+def test_result_db():
+    filename = tempfile.mktemp('.txt', 'autotune_db_')
+    try:
+        db = ResultDatabase(filename)
+        args = ('examples.blur.filter_func', 'blur_y.root()', ['a.png'], 4, (-1, -1, -1), build_fingerprint('default_runner.cpp'))
+        key = ResultDatabase.key(*args)
+        assert key == ResultDatabase.key(args[0], 'blur_y.root()\n', *args[2:])
+        for (i, value) in [(3, 8), (4, (64, 64, 3)), (5, 'other build')]:
+            assert key != ResultDatabase.key(*(args[:i] + (value,) + args[i+1:]))
+        assert db.get(key) is None
+        db.put(key, {'time': 0.5, 'compile': 1.0, 'run': 0.6, 'output': '', 'compile_out': 'Success', 'trials': 2})
+        assert db.get(key, 2)['time'] == 0.5 and db.get(key, 5) is None
+        db.put(key, {'time': 0.25, 'compile': 1.0, 'run': 0.3, 'output': '', 'compile_out': 'Success', 'trials': 5})
+        db.put(key, {'time': 0.75, 'compile': 1.0, 'run': 0.8, 'output': '', 'compile_out': 'Success', 'trials': 3})
+        assert db.get(key, 5)['time'] == 0.25
+        with open(filename, 'at') as f:
+            f.write('{"key": "truncated')
+        db2 = ResultDatabase(filename)
+        assert db2.get(key, 5)['time'] == 0.25
+        db2.get(key)['time'] = 1.0
+        assert db2.get(key, 5)['time'] == 0.25
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    print 'autotune.ResultDatabase:             OK'
+
+def test_run_output():
+    assert parse_run_output('Success 0.5') == (0.5, None, [0.5])
+    (best, median, samples) = parse_run_output('Success 0.25 0.5 0.5 0.25 0.75')
+    assert (best, median, samples) == (0.25, 0.5, [0.5, 0.25, 0.75])
+    (lo, hi) = confidence_interval(samples)
+    assert lo < 0.5 < hi and abs((lo+hi)/2-0.5) < 1e-9
+    assert confidence_interval([0.25]) == [0.25, 0.25]
+    assert parse_trial_line('Trial 0.125000000\n') == 0.125
+    for line in ['RUN_CHECK_FAIL', '', 'Trial', 'Trial nan?', 'rsync: connection closed', 'Success 0.5 0.5']:
+        assert parse_trial_line(line) is None
+    print 'autotune.parse_run_output:           OK'
+
+def test_cost_model():
+    (f, g, locals_d) = test_funcs()
+    def synthetic_time(schedule):
+        s = str(schedule)
+        return 0.01*2**(s.count('.root()') + 0.5*s.count('.parallel(') - 0.25*s.count('.vectorize('))
+    
+    model = autotune_cost.CostModel()
+    trainL = [random_schedule(g, 0, DEFAULT_MAX_DEPTH) for i in range(200)]
+    for schedule in trainL:
+        model.add(schedule, synthetic_time(schedule))
+    testL = [random_schedule(g, 0, DEFAULT_MAX_DEPTH) for i in range(50)]
+    predicted = numpy.argsort(numpy.argsort([model.predict(x) for x in testL]))
+    actual = numpy.argsort(numpy.argsort([synthetic_time(x) for x in testL]))
+    assert numpy.corrcoef(predicted, actual)[0,1] > 0.8
+    
+    filename = tempfile.mktemp('.txt', 'autotune_log_')
+    try:
+        with open(filename, 'wt') as f_log:
+            for (i, schedule) in enumerate(trainL[:10]):
+                f_log.write('-'*40 + '\n' + 'Schedule 001_%03d: random' % i + '\n' + str(schedule) + '\n' +
+                            'Best time %.6f, compile=1.0, run=1.0, compile_out=Success' % synthetic_time(schedule) + '\n')
+            f_log.write('-'*40 + '\n' + 'Schedule 001_010: random\n' + str(testL[0]) + '\nError COMPILE_FAIL, compile=1.0, run=0.0, compile_out=\n')
+        model2 = autotune_cost.CostModel()
+        assert model2.load_log(g, filename) == 10
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    
+    p = AutotuneParams(population_size=16, cost_model_min_samples=10)
+    timeL = [{'time': synthetic_time(x)} for x in trainL[:16]]
+    L = next_generation(trainL[:16], p, g, Constraints(), 1, timeL, model)
+    assert len(L) == p.population_size and [x.index for x in L] == range(len(L))
+    print 'autotune_cost.CostModel:             OK'
+
+def test_validate_schedule():
+    (f, g, locals_d) = test_funcs()
+    constraints = Constraints()
+    lowering_server = LoweringServer(g, constraints, 10.0)
+    assert validate_schedule(Schedule.fromstring(g, 'f.chunk(x)\ng.root()'), lowering_server)
+    assert validate_schedule(Schedule.fromstring(g, 'f.chunk(y)\ng.root().tile(x,y,_c0,_c1,8,8)'), lowering_server)
+    assert not validate_schedule(Schedule.fromstring(g, 'f.chunk(_c0)\ng.root()'))
+    assert not validate_schedule(Schedule.fromstring(g, 'f.chunk(x,y)\ng.root()'))
+    for i in range(20):
+        assert validate_schedule(random_schedule(g, 0, DEFAULT_MAX_DEPTH))
+    lowering_server.close()
+    print 'autotune.validate_schedule:          OK'
+
+def test_operator_selection():
+    assert genome_operators('mutate_add(001_002)') == ('mutated', 'add')
+    assert genome_operators('crossover(001_002, 001_003)+mutate_edit()') == ('crossover', 'edit')
+    assert genome_operators('crossover(001_002, 001_003)') == ('crossover', None)
+    assert genome_operators('') == ('random', None)
+    assert genome_operators('mutate_add(001_002) (elite copy of 002_000)') is None
+    
+    (f, g, locals_d) = test_funcs()
+    p = AutotuneParams()
+    operators = OperatorSelection(p)
+    def child(genomelog):
+        return Schedule.fromstring(g, '', genomelog)
+    for i in range(10):
+        operators.decay()
+        operators.update([child('mutate_template(001_000)'), child('mutate_add(001_001)'), child('')],
+                         [{'time': 0.1}, {'time': 0.5}, {'time': COMPILE_FAIL}], 0.2)
+    q = operators.params(p)
+    assert q.prob_mutate_template/p.prob_mutate_template > q.prob_mutate_add/p.prob_mutate_add
+    assert q.prob_mutate_group == 0.0
+    assert q.prob_pop['elitism'] == p.prob_pop['elitism']
+    assert q.prob_pop['mutated']/p.prob_pop['mutated'] > q.prob_pop['random']/p.prob_pop['random']
+    assert tournament_cutoff(p, [{'time': x} for x in [0.5, 0.4, 0.3, 0.2, 0.1, COMPILE_FAIL]]) == 0.5
+    print 'autotune.OperatorSelection:          OK'
+
+def test_island_migration():
+    (f, g, locals_d) = test_funcs()
+    island_dir = tempfile.mkdtemp('', 'autotune_islands_')
+    try:
+        a = IslandMigration(island_dir, 0)
+        b = IslandMigration(island_dir, 1)
+        scheduleL = [Schedule.fromstring(g, s, '', 1, i) for (i, s) in enumerate(['f.root()\ng.root()', 'f.chunk(x)\ng.root()', 'g.root()'])]
+        a.send(1, scheduleL, [{'time': 0.5}, {'time': 0.25}, {'time': RUN_FAIL}], 2)
+        assert a.receive() == []
+        migrantL = receive_migrants(b, g, Constraints(), 2, set([scheduleL[0].hash()]))
+        assert [str(x) for x in migrantL] == [str(scheduleL[1])]
+        assert migrantL[0].genomelog == 'migrant(island 0, 001_001)' and genome_operators(migrantL[0].genomelog) is None
+        assert b.receive() == []
+    finally:
+        shutil.rmtree(island_dir)
+    print 'autotune.IslandMigration:            OK'
+
+def test_checkpoint():
+    p = AutotuneParams({'generations': '7'})
+    q = AutotuneParams.loads(p.dumps(), {'generations': '300'})
+    assert q.generations == 300 and q.population_size == p.population_size
+    
+    filename = tempfile.mktemp('.pkl', 'autotune_checkpoint_')
+    try:
+        random_state = random.getstate()
+        write_checkpoint(filename, {'generation': 3, 'timeL': [{'time': 0.5, 'samples': [0.5]}], 'random_state': random_state,
+                                    'operators': OperatorSelection(p)})
+        state = load_checkpoint(filename)
+        assert state['generation'] == 3 and state['timeL'] == [{'time': 0.5, 'samples': [0.5]}]
+        x = random.random()
+        random.setstate(state['random_state'])
+        assert random.random() == x
+        assert str(state['operators']) == str(OperatorSelection(p))
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    print 'autotune.checkpoint:                 OK'
+
+def test_search():
+    (f, g, locals_d) = test_funcs()
+    partial_schedule = Schedule.fromstring(g, '')
+    L = [str(x) for x in schedules_func(g, f, 0, 2, partial_schedule=partial_schedule)]
+    assert L == [str(x) for x in schedules_func(g, f, 0, 2, partial_schedule=partial_schedule)]
+    assert '' in L and 'f.root()' in L and 'f.root().vectorize(x,4)' in L and 'f.root().parallel(y)' in L
+    assert len([x for x in L if x.startswith('f.chunk(')]) > 0
+    
+    def test_func(scheduleL, constraints, status_callback, timer, save_output=False, compare_schedule=None, trials_override=None):
+        return [{'time': 0.01*(1+str(x).count('.root()')+0.1*str(x).count('.')), 'output': ''} for x in scheduleL]
+    reports = []
+    def report_generation(gen, currentL, timeL, newL, output_stats, operators=None):
+        reports.append(min([(timeL[i]['time'], str(currentL[i])) for i in range(len(timeL))]))
+        return ''
+    p = AutotuneParams(search_depth=1, search_beam=2, cost_model=False, validate=False)
+    (beam, timeL) = autotune_search(p, g, test_func, AutotuneTimer(), Constraints(), None, report_generation)
+    assert len(reports) == 2 and reports[-1][1].strip() == 'g.root()'
+    assert len(beam) == 2 and str(beam[0]).strip() == 'g.root()' and timeL[0]['time'] == reports[-1][0]
+    counts = []
+    def report_count(gen, currentL, timeL, newL, output_stats, operators=None):
+        counts.append(len(currentL))
+        return ''
+    p = AutotuneParams(search_depth=2, search_beam=2, search_max_candidates=3, cost_model=False, validate=False)
+    autotune_search(p, g, test_func, AutotuneTimer(), Constraints(), None, report_count)
+    assert max(counts) <= 2*3
+    print 'autotune.autotune_search:            OK'
+
+def test_refine():
+    (f, g, locals_d) = test_funcs()
+    schedule = Schedule.fromstring(g, 'g.root().tile(x,y,_c0,_c1,8,8).vectorize(_c0,4)', 'seed', 1, 0)
+    neighborL = [str(x.d['g']) for x in const_neighbors(schedule, {'x': 64, 'y': 48, 'c': 3})]
+    assert sorted(neighborL) == sorted(['g.root().tile(x,y,_c0,_c1,%d,%d).vectorize(_c0,%d)' % sizes for sizes in
+                                        [(4,8,4), (16,8,4), (8,4,4), (8,16,4), (8,8,2), (8,8,8)]])
+    assert 'g.root().tile(x,y,_c0,_c1,16,8).vectorize(_c0,4)' not in [str(x.d['g']) for x in const_neighbors(schedule, {'x': 40, 'y': 48})]
+    assert str(schedule.d['g']) == 'g.root().tile(x,y,_c0,_c1,8,8).vectorize(_c0,4)'
+    
+    def test_func(scheduleL, constraints, status_callback, timer, save_output=False, compare_schedule=None, trials_override=None):
+        return [{'time': 1.0/min(x.d['g'][1].xsize, 16) + 1.0/min(x.d['g'][1].ysize, 32), 'output': ''} for x in scheduleL]
+    p = AutotuneParams(generations=2, refine_rounds=5)
+    (T, best) = autotune_refine(p, test_func, AutotuneTimer(), Constraints(), None, [schedule], test_func([schedule], None, None, None),
+                                lambda gen, currentL, timeL, newL, output_stats: '', {'x': 64, 'y': 48, 'c': 3})
+    assert T == 0.125 and str(best.d['g']) == 'g.root().tile(x,y,_c0,_c1,16,16).vectorize(_c0,4)'
+    print 'autotune.autotune_refine:            OK'
+
+def test_schedule_library():
+    (f, g, locals_d) = test_funcs()
+    signature = autotune_library.pipeline_signature(g)
+    assert [x['name'] for x in signature] == ['g', 'f'] and signature[0]['calls'] == [] and signature[1]['calls'][0][0] == 0
+    assert autotune_library.signature_distance(signature, signature) == 0.0
+    assert autotune_library.signature_distance(signature, signature[:1]) is None
+
+    # Same pipeline structure under other names
+    other = copy.deepcopy(signature)
+    for (d, name) in zip(other, ['blur_y', 'blur_x']):
+        d['name'] = name
+        d['vars'] = [v + '_blur' for v in d['vars']]
+    other_str = 'blur_x.chunk(x_blur)\nblur_y.root().tile(x_blur,y_blur,_c0,_c1,8,8).vectorize(_c0,8)'
+    assert autotune_library.remap_schedule(other_str, other, signature) == 'f.chunk(x)\ng.root().tile(x,y,_c0,_c1,8,8).vectorize(_c0,8)'
+
+    filename = tempfile.mktemp('.txt', 'autotune_library_')
+    try:
+        library = autotune_library.ScheduleLibrary(filename)
+        assert library.closest(g, 4) == []
+        library.add('test_funcs', g, 'g.root()\n', 0.5)
+        with open(filename, 'at') as fout:
+            fout.write(json.dumps({'filter_func': 'blur', 'signature': other, 'schedule': other_str, 'time': 0.25}) + '\n')
+            fout.write('{"filter_func": "truncated')
+        L = autotune_library.ScheduleLibrary(filename).closest(g, 4)
+        assert L == ['f.chunk(x)\ng.root().tile(x,y,_c0,_c1,8,8).vectorize(_c0,8)', 'g.root()']
+        for s in L:
+            assert Schedule.fromstring(g, s).check()
+    finally:
+        if os.path.exists(filename):
+            os.remove(filename)
+    print 'autotune_library.ScheduleLibrary:    OK'
+
+def test_run_limit():
+    assert run_limit([sys.executable, '-c', 'print "a"; print "b"'], 10.0, last_line=True) == (0, 'b')
+    T0 = time.time()
+    assert run_limit([sys.executable, '-c', 'import time; time.sleep(30)'], 0.5)[0] == RUN_LIMIT_TIMEOUT
+    assert time.time()-T0 < 10.0
+    lines = []
+    (status, out) = run_limit([sys.executable, '-c', 'import sys, time\nprint "Trial 0.5"\nsys.stdout.flush()\ntime.sleep(30)'], 10.0,
+                              line_callback=lambda line: lines.append(line) or True)
+    assert status == RUN_LIMIT_ABORTED and lines == ['Trial 0.5']
+    assert run_limit([sys.executable, '-c', 'x = " "*(200*1000**2)'], 10.0, memory_limit=100*1000**2)[0] == RUN_LIMIT_MEMLIMIT
+    
+    # A normal compile (lowering and LLVM codegen) is not killed by the default compile memory limit
+    tune_dir = tempfile.mkdtemp('', 'autotune_memlimit_')
+    try:
+        memory_limit = AutotuneParams().compile_memory_limit*(1000**2)
+        assert run_limit([sys.executable, '-c', MEMLIMIT_COMPILE % os.path.dirname(os.path.abspath(__file__))], 120.0, last_line=True,
+                         memory_limit=memory_limit, cwd=tune_dir) == (0, 'Success')
+    finally:
+        shutil.rmtree(tune_dir)
+    print 'autotune.run_limit:                  OK'
+
+MEMLIMIT_COMPILE = r"""
+import sys; sys.path.insert(0, %r)
+import examples.blur
+(input, out_func, evaluate, scope) = examples.blur.filter_func()
+out_func.compileToFile('blur_memlimit')
+print 'Success'
+"""
+
+ECHO_SERVER = r"""
+import sys, json, time
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    request = json.loads(line)
+    if request == 'sleep':
+        time.sleep(30)
+    if request == 'exit':
+        break
+    print json.dumps({'out': 'Success %s' % request})
+    sys.stdout.flush()
+"""
+
+def test_compile_server():
+    server = ChildServer([sys.executable, '-c', ECHO_SERVER])
+    assert server.request('a', 10.0) == (0, {'out': 'Success a'})
+    pid = server.proc.pid
+    assert server.request('b', 10.0) == (0, {'out': 'Success b'}) and server.proc.pid == pid
+    assert server.request('sleep', 0.5) == (RUN_LIMIT_TIMEOUT, None) and server.proc is None
+    assert server.request('exit', 10.0) == (RUN_LIMIT_EXITED, None)
+    assert server.request('c', 10.0) == (0, {'out': 'Success c'})
+    server.kill()
+    
+    pool = CompileServerPool(1, 1)
+    server = pool.free.get()
+    server.args = [sys.executable, '-c', ECHO_SERVER]
+    pool.free.put(server)
+    assert pool.compile('x', 10.0) == (0, 'Success x')
+    assert pool.compile('exit', 10.0) == (1, 'Compile server exited')
+    print 'autotune.CompileServerPool:          OK'
+
+RUNNER_SERVER = r"""
+import sys
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    fields = line.rstrip('\n').split('\t')
+    for i in range(int(fields[2])):
+        print 'Trial 0.5'
+    print 'Success 0.5'
+    sys.stdout.flush()
+"""
+
+def test_timing_server():
+    tmp_dir = tempfile.mkdtemp('', 'autotune_timing_server_')
+    try:
+        runner_exe = os.path.join(tmp_dir, 'runner.exe')
+        with open(runner_exe, 'wt') as f:
+            f.write('#!' + sys.executable + '\n' + RUNNER_SERVER)
+        os.chmod(runner_exe, 0755)
+        timing_server = TimingServer(1, 2)
+        trial_times = []
+        def progress(line):
+            trial_times.append(parse_trial_line(line))
+            return False
+        assert timing_server.run(runner_exe, 'a.so', 'a', 3, 'in.png', '', 8, 8, 3, '', 10.0, progress) == (0, 'Success 0.5')
+        assert trial_times == [0.5]*3
+        server = timing_server.servers[runner_exe]
+        pid = server.proc.pid
+        assert timing_server.run(runner_exe, 'b.so', 'b', 1, 'in.png', '', 8, 8, 3, '', 10.0) == (0, 'Success 0.5')
+        assert server.proc.pid == pid
+        assert timing_server.run(runner_exe, 'c.so', 'c', 1, 'in.png', '', 8, 8, 3, '', 10.0) == (0, 'Success 0.5')
+        assert server.proc.pid != pid                   # Restarted after loading timing_server_libs libraries
+        assert timing_server.run(runner_exe, 'c.so', 'c', 3, 'in.png', '', 8, 8, 3, '', 10.0, lambda line: True) == (RUN_LIMIT_ABORTED, '')
+        server.kill()
+    finally:
+        shutil.rmtree(tmp_dir)
+    print 'autotune.TimingServer:               OK'
+
+def test_work_queue():
+    done = Queue.Queue()
+    square_queue = WorkQueue(lambda i, x: x*x, 2, done, 'square')
+    inverse_queue = WorkQueue(lambda i, x: 1/x, 1, done, 'inverse')
+    queues = {'square': square_queue, 'inverse': inverse_queue}
+    for i in range(5):
+        square_queue.put(i, i)
+    inverse_queue.put(5, 0)
+    results = {}
+    error = False
+    while square_queue.pending or inverse_queue.pending:
+        try:
+            (tag, i, item, ans) = next_result(done, queues)
+            results[i] = ans
+        except ZeroDivisionError:
+            error = True
+    assert results == dict((i, i*i) for i in range(5)) and error
+    square_queue.close()
+    inverse_queue.close()
+    print 'autotune.WorkQueue:                  OK'
+
+def test_timing_partitions():
+    assert parse_cpu_list('0-3,8') == set([0, 1, 2, 3, 8])
+    assert timing_partition_list(AutotuneParams(measure_cpus='4-7')) == ['4-7']
+    assert timing_partition_list(AutotuneParams(measure_cpus='4-7', timing_partitions=2)) == ['4,5', '6,7']
+    if multiprocessing.cpu_count() >= 2:
+        assert len(timing_partition_list(AutotuneParams(timing_partitions=2))) == 2
+    try:
+        timing_partition_list(AutotuneParams(measure_cpus='0-1', timing_partitions=3))
+        assert False
+    except ValueError:
+        pass
+    assert compile_cpu_list(AutotuneParams()) is None
+    if multiprocessing.cpu_count() >= 2:
+        assert parse_cpu_list(compile_cpu_list(AutotuneParams(measure_cpus='0'))) == set(range(1, multiprocessing.cpu_count()))
+    assert taskset(['a', 'b'], None) == ['a', 'b']
+    assert taskset(['a', 'b'], '0,1') == ['taskset', '-c', '0,1', 'a', 'b']
+    assert taskset('echo "x"', '0', True) == 'taskset -c 0 sh -c \'echo "x"\''
+    print 'autotune.timing_partition_list:      OK'
+
+def test_fidelity():
+    tune_dir = tempfile.mkdtemp('', 'autotune_fidelity_')
+    try:
+        p = AutotuneParams(fidelity_levels=2, fidelity_crop=0.5, tune_dir=tune_dir)
+        input = halide.UniformImage(halide.UInt(8), 3)
+        in_image = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lena_crop.png')      # 400x480
+        crops = fidelity_crops(p, input, in_image, (-1, -1, -1))
+        assert [x[1] for x in crops] == [(64, 64, -1), (192, 192, -1)]
+        assert [x[2] for x in crops] == [64*64/(400*480.0), 192*192/(400*480.0)]
+        for (filename, (w, h, channels), fraction) in crops:
+            assert numpy.asarray(halide.Image(halide.UInt(8), filename)).shape[:2] == (h, w)
+        assert fidelity_crops(AutotuneParams(fidelity_levels=3, fidelity_crop=0.5, tune_dir=tune_dir), input, in_image, (64, 64, 3)) == []
+    finally:
+        shutil.rmtree(tune_dir)
+    print 'autotune.fidelity_crops:             OK'
+
 def test():
     random.seed(0)
     test_params()
+    test_result_db()
+    test_run_output()
+    test_cost_model()
+    test_validate_schedule()
+    test_operator_selection()
+    test_island_migration()
+    test_checkpoint()
+    test_run_limit()
+    test_compile_server()
+    test_timing_server()
+    test_work_queue()
+    test_timing_partitions()
+    test_fidelity()
+    test_search()
+    test_refine()
+    test_schedule_library()
     test_sample_prob()
     test_all()
     test_cuda()
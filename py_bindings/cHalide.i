@@ -1,4 +1,4 @@
-%module(naturalvar=1) cHalide
+%module(naturalvar=1, threads="1") cHalide
 %{
 /*
 #include "Func.h"
@@ -18,6 +18,11 @@ using namespace Halide;
 %include "std_string.i"
 %include "std_vector.i"
 
+// Keep the GIL in calls into Halide (the compiler is not thread-safe), except while decoding images so that
+// a thread (see halide.filter_image_stream()) can decode the next image while a pipeline runs.
+%nothread;
+%thread load_png;
+
 %naturalvar;
 %naturalvar Func;
 %naturalvar Expr;
@@ -9,6 +9,8 @@ import Image as PIL
 import os
 import sys
 import signal
+import threading
+import Queue
 from ForkedWatchdog import Watchdog
 root = cvar.root
 
@@ -152,6 +154,7 @@ Func.__setitem__ = lambda x, key, value: assign(call(x, *[wrap(y) for y in key])
 Func.__getitem__ = _generic_getitem
 Func.assign = _generic_assign
 Func.realize = lambda x, *a: _realize(x,*a) if not (len(a)==1 and isinstance(a[0], ImageTypes)) else _realize(x,to_dynimage(a[0]))
+Func.realize_into = lambda self, out: _realize_into(self, out)
 Func.split = lambda self, a, b, c, d: _split0(self, a, b, c, wrap(d))
 Func.tile = lambda self, *a: _tile0(self, *[a[i] if i < len(a)-2 else wrap(a[i]) for i in range(len(a))])
 Func.reorder = lambda self, *a: _reorder0(self, ListVar(a))
@@ -173,10 +176,7 @@ flip_xy = True
 
 def image_getattr(self, name):
     if name == '__array_interface__':
-       # print 'get_array'
-        #print 'get array'
-        #return {'shape': (1,1), 'typestr': '>i4', 'data': '\x00'*3+'\x02'}
-        D = DynImage(self)
+        D = DynImage(self) if isinstance(self, ImageTypes) else self
         t = D.type()
         if t.isInt():
             typestr = '|i%d'%(t.bits/8)
@@ -191,12 +191,13 @@ def image_getattr(self, name):
         if flip_xy and len(strides) >= 2:
             strides = (strides[1], strides[0]) + strides[2:]
             shape = (shape[1], shape[0]) + shape[2:]
-        data = image_to_string(self)
-     #   print 'size', len(data)
+        # The array aliases the image data (no copy). Numpy keeps self, which shares ownership of the data, as the
+        # array base, so the data outlives every view.
         return {'shape': shape,
                 'typestr': typestr,
-                'data': data,
-                'strides': strides}
+                'data': (image_data_ptr(D), False),
+                'strides': strides,
+                'version': 3}
     raise AttributeError(name)
 
 for _ImageT in ImageTypes:
@@ -228,8 +229,11 @@ for _ImageT in ImageTypes:
     _ImageT.__getattr__ = image_getattr
     _ImageT.show = lambda x: show_image(x)
 
-def _image_from_numpy(a):
+def _image_from_numpy(a, ans=None):
+    "Image copied from numpy array a, into existing Image ans (of the same size and type) if given."
     a = numpy.asarray(a)
+    if any(stride < 0 for stride in a.strides):
+        a = numpy.ascontiguousarray(a)
     shape = a.shape
     strides = a.strides
     if flip_xy and len(shape) >= 2:
@@ -250,10 +254,55 @@ def _image_from_numpy(a):
     else:
         raise TypeError('No Image constructor for numpy.%r'%a.dtype)
     
-    ans = C(*shape)
+    if ans is None:
+        ans = C(*shape)
     assign_array(ans, a.__array_interface__['data'][0], *strides)
     return ans
     
+def _realize_into(f, out):
+    """
+    Realize Func f into an existing Image, DynImage or numpy array out, returning out.
+
+    A numpy array is written in place if Halide can address it: x (axis 1 with flip_xy) contiguous, non-negative
+    strides and 32 byte aligned data, as for numpy.asarray() of an Image. Other arrays are realized into a temporary
+    Image which is then copied.
+    """
+    if isinstance(out, ImageTypes + (DynImageType,)):
+        f.realize(out)
+        return out
+    if not isinstance(out, numpy.ndarray):
+        raise TypeError('realize_into() expects an Image, DynImage or numpy array, not %r' % type(out))
+    d = {numpy.dtype('int8'): Int(8),
+         numpy.dtype('int16'): Int(16),
+         numpy.dtype('int32'): Int(32),
+         numpy.dtype('uint8'): UInt(8),
+         numpy.dtype('uint16'): UInt(16),
+         numpy.dtype('uint32'): UInt(32),
+         numpy.dtype('float32'): Float(32),
+         numpy.dtype('float64'): Float(64)}
+    if out.dtype not in d:
+        raise TypeError('No Image type for numpy.%r' % out.dtype)
+    if not 1 <= len(out.shape) <= 4:
+        raise ValueError('realize_into() expects 1 to 4 dimensions, not %d' % len(out.shape))
+    shape = out.shape
+    strides = out.strides
+    if flip_xy and len(shape) >= 2:
+        shape = (shape[1], shape[0]) + shape[2:]
+        strides = (strides[1], strides[0]) + strides[2:]
+
+    itemsize = out.dtype.itemsize
+    base = out.__array_interface__['data'][0]
+    if (out.flags.writeable and strides[0] == itemsize and base % 32 == 0 and
+        all(stride >= 0 and stride % itemsize == 0 for stride in strides)):
+        D = image_from_pointer(d[out.dtype], base, *sum([[size, stride/itemsize] for (size, stride) in zip(shape, strides)], []))
+        _realize(f, D)
+        D.copyToHost()
+    else:
+        realized = Image(d[out.dtype], *shape)
+        f.realize(realized)
+        out[...] = numpy.asarray(realized)
+    return out
+
 def Image(typeval, *args):
     """
     Constructors:
@@ -373,6 +422,7 @@ def DynUniform(*args):
 for _ImageT in [DynImageType, UniformImage]:
     _ImageT.__getitem__ = _generic_getitem
     _ImageT.assign = lambda x, y: assign(x, Image(y) if isinstance(y,numpy.ndarray) else y)
+DynImageType.__getattr__ = image_getattr
     #_ImageT.save = lambda x, y: save_png(x, y)
 
 # ----------------------------------------------------
@@ -675,11 +725,12 @@ def filter_image(input, out_func, in_image, disp_time=False, compile=True, eval_
                 realized = eval_func(input_png)
             else:
                 #print 'a', w, h, nchan, out.type()
-                realized = out_func.realize(w, h, nchan)
+                realized = out_func.realize_into(out)
                 #print 'b'
                 #print 'c'
             T.append(time.time()-T0)
-        out.assign(realized)
+        if realized is not out:
+            out.assign(realized)
 
         assert out.width() == w and out.height() == h and out.channels() == nchan
         #print out.width(), out.height(), out.channels(), w, h, nchan
@@ -692,6 +743,77 @@ def filter_image(input, out_func, in_image, disp_time=False, compile=True, eval_
         return out
     return evaluate
 
+def _prefetch(iterable, func, n):
+    """
+    Iterate over func(x) for x in iterable, with a thread computing up to n results ahead.
+
+    Exceptions are re-raised in the caller. If the caller stops early, the (daemon) thread stays blocked.
+    """
+    q = Queue.Queue(n)
+    def worker():
+        try:
+            for x in iterable:
+                q.put((True, func(x)))
+        except:
+            q.put((False, sys.exc_info()))
+        q.put(None)
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = q.get()
+        if item is None:
+            return
+        (success, value) = item
+        if not success:
+            raise value[0], value[1], value[2]
+        yield value
+
+def filter_image_stream(input, out_func, in_images, compile=True, out_dims=None, prefetch=2):
+    """
+    Filter a stream of images (iterable of filenames or numpy arrays) with a Halide Func, yielding an output Image per image.
+
+    Unlike calling filter_image() per image, buffers are reused while the image size is unchanged: numpy arrays are
+    copied into one input Image, and the output is realized directly into one output Image (no copy). The yielded
+    Image is thus overwritten by the next iteration, so copy it (e.g. numpy.array(out)) to keep it.
+
+    With prefetch > 0 a thread decodes up to prefetch filenames ahead. The load_png() binding releases the GIL (see
+    cHalide.i), so decoding overlaps with realizing the current image. Other calls into Halide hold the GIL.
+    """
+    if not isinstance(input, UniformImageType):
+        raise TypeError('filter_image_stream() input should be a UniformImage')
+    dtype = input.type()
+    decode = lambda in_image: Image(dtype, in_image) if isinstance(in_image, str) else in_image
+    if prefetch > 0:
+        in_images = _prefetch(in_images, decode, prefetch)
+    else:
+        in_images = (decode(in_image) for in_image in in_images)
+
+    in_buffer = None
+    out = None
+    for in_image in in_images:
+        if isinstance(in_image, ImageTypes):
+            input_png = in_image
+        else:
+            a = numpy.asarray(in_image)
+            if in_buffer is None or numpy.asarray(in_buffer).shape != a.shape or numpy.asarray(in_buffer).dtype != a.dtype:
+                in_buffer = Image(a)
+            else:
+                _image_from_numpy(a, in_buffer)
+            input_png = in_buffer
+        input.assign(input_png)
+
+        w = input_png.width() if out_dims is None else out_dims[0]
+        h = input_png.height() if out_dims is None else out_dims[1]
+        nchan = input_png.channels() if out_dims is None else (out_dims[2] if len(out_dims) >= 3 else 1)
+        if out is None or (out.width(), out.height(), out.channels()) != (w, h, nchan):
+            out = Image(out_func.rhs().type(), w, h, nchan)
+        if compile:
+            out_func.compileJIT()
+            compile = False
+        out_func.realize(out)
+        yield out
+
 def example_out():
     (input, x, y, c, blur_x, blur_y, input_clamped) = get_blur()
 
@@ -749,6 +871,30 @@ def test_blur():
     
     print 'halide.filter_image:                 OK'
 
+def test_realize_into():
+    (input, x, y, c, blur_x, blur_y, input_clamped) = get_blur()
+    blur_y.reset()
+    expected = numpy.array(filter_image(input, blur_y, in_filename)())
+    (h, w, nchan) = expected.shape
+    aligned = numpy.asarray(Image(UInt(16), w, h, nchan))
+    interleaved = numpy.zeros((h, w, nchan), 'uint16')
+    for out in [aligned, interleaved, Image(UInt(16), w, h, nchan)]:
+        assert blur_y.realize_into(out) is out
+        assert numpy.all(numpy.asarray(out) == expected)
+    print 'halide.Func.realize_into:            OK'
+
+def test_filter_image_stream():
+    (input, x, y, c, blur_x, blur_y, input_clamped) = get_blur()
+    blur_y.reset()
+    a = numpy.asarray(Image(UInt(16), in_filename))
+    expected = numpy.array(filter_image(input, blur_y, in_filename)())
+    for prefetch in [0, 2]:
+        outL = [numpy.array(out) for out in filter_image_stream(input, blur_y, [in_filename, a, a[::-1]], prefetch=prefetch)]
+        assert len(outL) == 3
+        assert numpy.all(outL[0] == expected) and numpy.all(outL[1] == expected)
+        assert numpy.all(outL[2] == numpy.array(filter_image(input, blur_y, a[::-1])()))
+    print 'halide.filter_image_stream:          OK'
+
 def test_func(compile=True, in_image=in_filename):
     (input, x, y, c, blur_x, blur_y, input_clamped) = get_blur()
 
@@ -890,6 +1036,12 @@ def test_numpy():
             assert a.dtype == c.dtype
             assert dist(a,c) < 1e-8
 
+            # Views alias the image data, and keep it alive after the image is deleted
+            c.flat[0] = 1
+            assert numpy.asarray(b).flat[0] == 1 and numpy.asarray(DynImage(b)).flat[0] == 1
+            del b
+            assert c.flat[0] == 1
+
             if dtype == UInt(16):
                 locals_d = test_func(in_image=a)
                 test = locals_d['test']
@@ -914,6 +1066,8 @@ def test():
 
     test_numpy()
     test_blur()
+    test_realize_into()
+    test_filter_image_stream()
     test_all_funcs()
     test_core()
     #test_segfault()
@@ -3,6 +3,8 @@
 #include "../support/image_io.h"
 #include <signal.h>
 #include <string>
+#include <string.h>
+#include <algorithm>
 #include "Python.h"
 #include "frameobject.h"
 
@@ -136,6 +138,21 @@ DEFINE_TYPE(float)
 DEFINE_TYPE(double)
 #undef DEFINE_TYPE
 
+size_t image_data_ptr(const DynImage &a) { return (size_t) a.data(); }
+
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride) {
+    return DynImage(t, vec(xsize), vec(xstride), (unsigned char *) base);
+}
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride, int ysize, int ystride) {
+    return DynImage(t, vec(xsize, ysize), vec(xstride, ystride), (unsigned char *) base);
+}
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride, int ysize, int ystride, int zsize, int zstride) {
+    return DynImage(t, vec(xsize, ysize, zsize), vec(xstride, ystride, zstride), (unsigned char *) base);
+}
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride, int ysize, int ystride, int zsize, int zstride, int wsize, int wstride) {
+    return DynImage(t, vec(xsize, ysize, zsize, wsize), vec(xstride, ystride, zstride, wstride), (unsigned char *) base);
+}
+
 #define DEFINE_TYPE(T) DynImage to_dynimage(const Image<T> &a) { return DynImage(a); }
 DEFINE_TYPE(uint8_t)
 DEFINE_TYPE(uint16_t)
@@ -183,38 +200,70 @@ void imul(FuncRef &f, const Expr &e) { f *= e; }
 
 //void assign(UniformImage &a, Image<uint8_t> b) { a = DynImage(b); }
 
+// Copy the array at base with the given byte strides into a. Loops are ordered by decreasing source stride so
+// reads are sequential (e.g. an interleaved numpy image is read pixel by pixel into the planar Image), and
+// contiguous rows or whole matching layouts are copied with memcpy.
+template<typename T>
+static void copy_array(Image<T> &a, size_t base, int dims, const size_t *strides) {
+    DynImage d(a);
+    int size[4] = {1, 1, 1, 1}, order[4] = {0, 1, 2, 3};
+    size_t src[4] = {0, 0, 0, 0}, dst[4] = {0, 0, 0, 0};
+    bool same_layout = true;
+    for (int i = 0; i < dims; i++) {
+        size[i] = a.size(i);
+        src[i] = strides[i];
+        dst[i] = d.stride(i)*sizeof(T);
+        if (size[i] > 1 && src[i] != dst[i]) same_layout = false;
+    }
+    const uint8_t *in = (const uint8_t *) base;
+    uint8_t *out = (uint8_t *) a.data();
+    if (same_layout) {
+        memcpy(out, in, dst[dims-1]*size[dims-1]);
+        return;
+    }
+    // Insertion sort of the loops, outermost first. Dimensions of size 1 go outside, their strides are arbitrary.
+    size_t key[4];
+    for (int i = 0; i < 4; i++) {
+        key[i] = size[i] > 1 ? src[i] : (size_t) -1;
+        for (int j = i; j > 0 && key[order[j]] > key[order[j-1]]; j--) {
+            std::swap(order[j], order[j-1]);
+        }
+    }
+    int o0 = order[0], o1 = order[1], o2 = order[2], o3 = order[3];
+    bool contiguous_rows = src[o3] == sizeof(T) && dst[o3] == sizeof(T);
+    for (int i = 0; i < size[o0]; i++) {
+    for (int j = 0; j < size[o1]; j++) {
+    for (int k = 0; k < size[o2]; k++) {
+        const uint8_t *s = in + i*src[o0] + j*src[o1] + k*src[o2];
+        uint8_t *t = out + i*dst[o0] + j*dst[o1] + k*dst[o2];
+        if (contiguous_rows) {
+            memcpy(t, s, size[o3]*sizeof(T));
+        } else {
+            for (int l = 0; l < size[o3]; l++) {
+                *(T*)(t + l*dst[o3]) = *(const T*)(s + l*src[o3]);
+            }
+        }
+    }
+    }
+    }
+}
+
 #define DEFINE_TYPE(T) \
 void assign_array(Image<T> &a, size_t base, size_t xstride) { \
-    for (int x = 0; x < a.size(0); x++) { \
-        a(x) = *(T*)(((uint8_t *) base) + (xstride*x)); \
-    } \
+    size_t strides[] = {xstride}; \
+    copy_array(a, base, 1, strides); \
 } \
 void assign_array(Image<T> &a, size_t base, size_t xstride, size_t ystride) { \
-    for (int x = 0; x < a.size(0); x++) { \
-    for (int y = 0; y < a.size(1); y++) { \
-        a(x,y) = *(T*)(((uint8_t *) base) + (xstride*x) + (ystride*y)); \
-    } \
-    } \
+    size_t strides[] = {xstride, ystride}; \
+    copy_array(a, base, 2, strides); \
 } \
 void assign_array(Image<T> &a, size_t base, size_t xstride, size_t ystride, size_t zstride) { \
-    for (int x = 0; x < a.size(0); x++) { \
-    for (int y = 0; y < a.size(1); y++) { \
-    for (int z = 0; z < a.size(2); z++) { \
-        a(x,y,z) = *(T*)(((uint8_t *) base) + (xstride*x) + (ystride*y) + (zstride*z)); \
-    } \
-    } \
-    } \
+    size_t strides[] = {xstride, ystride, zstride}; \
+    copy_array(a, base, 3, strides); \
 } \
 void assign_array(Image<T> &a, size_t base, size_t xstride, size_t ystride, size_t zstride, size_t wstride) { \
-    for (int x = 0; x < a.size(0); x++) { \
-    for (int y = 0; y < a.size(1); y++) { \
-    for (int z = 0; z < a.size(2); z++) { \
-    for (int w = 0; w < a.size(3); w++) { \
-        a(x,y,z,w) = *(T*)(((uint8_t *) base) + (xstride*x) + (ystride*y) + (zstride*z) + (wstride*w)); \
-    } \
-    } \
-    } \
-    } \
+    size_t strides[] = {xstride, ystride, zstride, wstride}; \
+    copy_array(a, base, 4, strides); \
 }
 DEFINE_TYPE(uint8_t)
 DEFINE_TYPE(uint16_t)
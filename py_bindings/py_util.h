@@ -140,6 +140,13 @@ DEFINE_TYPE(float)
 DEFINE_TYPE(double)
 #undef DEFINE_TYPE
 
+size_t image_data_ptr(const DynImage &a);
+
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride);
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride, int ysize, int ystride);
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride, int ysize, int ystride, int zsize, int zstride);
+DynImage image_from_pointer(const Type &t, size_t base, int xsize, int xstride, int ysize, int ystride, int zsize, int zstride, int wsize, int wstride);
+
 #define DEFINE_TYPE(T) DynImage to_dynimage(const Image<T> &a);
 DEFINE_TYPE(uint8_t)
 DEFINE_TYPE(uint16_t)
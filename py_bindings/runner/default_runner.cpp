@@ -8,10 +8,32 @@ The default runner expects:
     e.g. `$(libpng-config --cflags --ldflags)`
 - to be compiled in the same directory with <TEST_FUNC>.h
 - to have the Halide/support directory in its include path, for static_image.h/image_io.h
+
+Alternatively, with TEST_DLOPEN defined instead of TEST_FUNC, the pipeline is loaded at run time
+from the shared object named by the TEST_LIB environment variable, with entry point TEST_FUNC_NAME.
+One such runner (also linked with -ldl) serves every schedule of a given input/output type.
 */
 
+#ifdef TEST_DLOPEN
+
+#include <string.h>
+#include <static_image.h>
+#include <dlfcn.h>
+
+typedef void (*test_func_t)(buffer_t *, buffer_t *);
+static test_func_t test_func = NULL;
+#define TEST_FUNC test_func
+
+// Forward to the copy of the Halide runtime inside the loaded pipeline
+static void (*lib_copy_to_host)(buffer_t *) = NULL;
+extern "C" void __copy_to_host(buffer_t *buf) {
+    if (lib_copy_to_host) lib_copy_to_host(buf);
+}
+
+#else
+
 #ifndef TEST_FUNC
-#error default_runner must be compiled with TEST_FUNC defined
+#error default_runner must be compiled with TEST_FUNC or TEST_DLOPEN defined
 #endif
 #define TEST_HEADER TEST_FUNC.h
 
@@ -24,70 +46,205 @@ extern "C" {
 #include str(TEST_HEADER)
 }
 #include <static_image.h>
+
+#endif
+
 #include <image_io.h>
 #include <image_equal.h>
 
-#include <sys/time.h>
+#include <time.h>
 
 #include <string>
+#include <vector>
+#include <algorithm>
 using std::string;
+using std::vector;
 
 static const string usage = "Usage:\n\
 \trunner <test iterations> <input_image.png> [reference_output.png] [w|-1] [h|-1] [channels|-1] [save_output.png]";
 
-int main(int argc, char const *argv[])
+// Time test_iterations calls of TEST_FUNC, then save and check the output. Prints a "Trial <time>" line
+// as each call completes, then the result line ("Success <best> <median> <time 1> ... <time n>" in seconds,
+// or RUN_CHECK_FAIL), and returns the exit status.
+static int run_test(int test_iterations, Image<TEST_IN_T> input, Image<TEST_OUT_T> *ref_output,
+                    int w, int h, int channels, char const *save_output)
 {
-    if (argc < 3) {
-        fprintf(stderr, "%s\n", usage.c_str());
-        return -1;
-    }
+    timespec t1, t2;
+    double t;
 
-    int test_iterations = atoi(argv[1]);
-    
-    timeval t1, t2;
-    unsigned int t;
-    
-    Image<TEST_IN_T> input = load<TEST_IN_T>(argv[2]);
-        
-    int w        = argc > 4 ? atoi(argv[4]): -1;
-    int h        = argc > 5 ? atoi(argv[5]): -1;
-    int channels = argc > 6 ? atoi(argv[6]): -1;
-    char const *save_output = argc > 7 ? argv[7]: NULL;
-    
     if (w < 0) { w = input.width(); }
     if (h < 0) { h = input.height(); }
     if (channels < 0) { channels = input.channels(); }
     
     Image<TEST_OUT_T> output(w, h, channels);
-    Image<TEST_OUT_T> ref_output(1,1,1);
-    bool has_ref = false;
-    if (argc > 3 && strcmp(argv[3], "") != 0) {
-        ref_output = load<TEST_OUT_T>(argv[3]);
-        has_ref = true;
-    }
 
     // Timing code
-    unsigned int bestT = 0xffffffff;
+    double bestT = 1e30;
+    vector<double> times;
     for (int i = 0; i < test_iterations; i++) {
-        gettimeofday(&t1, NULL);
+        clock_gettime(CLOCK_MONOTONIC, &t1);
         TEST_FUNC(input, output);
-        gettimeofday(&t2, NULL);
-        t = (t2.tv_sec - t1.tv_sec) * 1000000 + (t2.tv_usec - t1.tv_usec);
+        clock_gettime(CLOCK_MONOTONIC, &t2);
+        t = (t2.tv_sec - t1.tv_sec) + (t2.tv_nsec - t1.tv_nsec) * 1e-9;
         if (t < bestT) bestT = t;
+        times.push_back(t);
+        printf("Trial %.9f\n", t);
+        fflush(stdout);
     }
+    vector<double> sorted_times(times);
+    std::sort(sorted_times.begin(), sorted_times.end());
+    double medianT = sorted_times.empty() ? bestT : sorted_times[sorted_times.size()/2];
 
     // Saving large PNGs is expensive. Only do it if enabled.
     if (save_output != NULL && strcmp(save_output, "") != 0) {
         save(output, save_output);
     }
 
-    if (has_ref) {
-        if (!images_equal<TEST_OUT_T>(ref_output, output, 0.01)) {
+    if (ref_output) {
+        if (!images_equal<TEST_OUT_T>(*ref_output, output, 0.01)) {
             printf("RUN_CHECK_FAIL\n");
-            exit(1);
+            fflush(stdout);
+            return 1;
         }
     }
-    printf("Success %f\n", bestT/1000000.0);
+    printf("Success %.9f %.9f", bestT, medianT);
+    for (size_t i = 0; i < times.size(); i++) {
+        printf(" %.9f", times[i]);
+    }
+    printf("\n");
+    fflush(stdout);
 
     return 0;
 }
+
+#ifdef TEST_DLOPEN
+
+#include <map>
+
+struct TestLib {
+    test_func_t func;
+    void (*copy_to_host)(buffer_t *);
+};
+
+// Load func_name from the shared object lib_name into test_func. Returns false (after printing the error) on failure.
+static bool load_test_func(const char *lib_name, const char *func_name) {
+    void *handle = dlopen(lib_name, RTLD_NOW);
+    if (!handle) {
+        printf("RUN_FAIL dlopen(%s): %s\n", lib_name, dlerror());
+        return false;
+    }
+    test_func = (test_func_t)dlsym(handle, func_name);
+    if (!test_func) {
+        printf("RUN_FAIL dlsym(%s): %s\n", func_name, dlerror());
+        return false;
+    }
+    lib_copy_to_host = (void (*)(buffer_t *))dlsym(handle, "__copy_to_host");
+    return true;
+}
+
+/*
+Server mode ("runner --server"): each line of stdin is a tab separated request
+
+    <library.so> <function name> <test iterations> <input_image> <reference_output> <w> <h> <channels> <save_output>
+
+answered on stdout in the same format as a single run ("Trial" lines, then the result line). Decoded input and reference images
+and loaded libraries are kept for the lifetime of the server. Libraries are never unloaded (their Halide
+thread pools may still be running), so the caller should restart the server after a number of libraries.
+*/
+static int serve() {
+    std::map<string, Image<TEST_IN_T> > inputs;
+    std::map<string, Image<TEST_OUT_T> > refs;
+    std::map<string, TestLib> libs;
+
+    char line[16384];
+    while (fgets(line, sizeof(line), stdin)) {
+        vector<string> fields;
+        string field;
+        for (char *c = line; *c && *c != '\n'; c++) {
+            if (*c == '\t') {
+                fields.push_back(field);
+                field.clear();
+            } else {
+                field += *c;
+            }
+        }
+        fields.push_back(field);
+        if (fields.size() != 9) {
+            printf("RUN_FAIL bad request\n");
+            fflush(stdout);
+            continue;
+        }
+
+        string key = fields[0] + "\t" + fields[1];
+        if (libs.find(key) == libs.end()) {
+            if (!load_test_func(fields[0].c_str(), fields[1].c_str())) {
+                fflush(stdout);
+                continue;
+            }
+            TestLib lib = {test_func, lib_copy_to_host};
+            libs[key] = lib;
+        }
+        test_func = libs[key].func;
+        lib_copy_to_host = libs[key].copy_to_host;
+
+        if (inputs.find(fields[3]) == inputs.end()) {
+            inputs[fields[3]] = load<TEST_IN_T>(fields[3]);
+        }
+        Image<TEST_OUT_T> *ref_output = NULL;
+        if (fields[4] != "") {
+            if (refs.find(fields[4]) == refs.end()) {
+                refs[fields[4]] = load<TEST_OUT_T>(fields[4]);
+            }
+            ref_output = &refs[fields[4]];
+        }
+
+        run_test(atoi(fields[2].c_str()), inputs[fields[3]], ref_output,
+                 atoi(fields[5].c_str()), atoi(fields[6].c_str()), atoi(fields[7].c_str()), fields[8].c_str());
+    }
+    return 0;
+}
+
+#endif
+
+int main(int argc, char const *argv[])
+{
+#ifdef TEST_DLOPEN
+    if (argc == 2 && strcmp(argv[1], "--server") == 0) {
+        return serve();
+    }
+#endif
+
+    if (argc < 3) {
+        fprintf(stderr, "%s\n", usage.c_str());
+        return -1;
+    }
+
+#ifdef TEST_DLOPEN
+    const char *lib_name = getenv("TEST_LIB"), *func_name = getenv("TEST_FUNC_NAME");
+    if (!lib_name || !func_name) {
+        fprintf(stderr, "TEST_LIB and TEST_FUNC_NAME must be set\n");
+        return -1;
+    }
+    if (!load_test_func(lib_name, func_name)) {
+        return -1;
+    }
+#endif
+
+    int test_iterations = atoi(argv[1]);
+    
+    Image<TEST_IN_T> input = load<TEST_IN_T>(argv[2]);
+        
+    int w        = argc > 4 ? atoi(argv[4]): -1;
+    int h        = argc > 5 ? atoi(argv[5]): -1;
+    int channels = argc > 6 ? atoi(argv[6]): -1;
+    char const *save_output = argc > 7 ? argv[7]: NULL;
+    
+    Image<TEST_OUT_T> ref_output(1,1,1);
+    bool has_ref = false;
+    if (argc > 3 && strcmp(argv[3], "") != 0) {
+        ref_output = load<TEST_OUT_T>(argv[3]);
+        has_ref = true;
+    }
+
+    return run_test(test_iterations, input, has_ref ? &ref_output : NULL, w, h, channels, save_output);
+}
@@ -11,6 +11,8 @@ import numpy
 import itertools
 import sys
 import os
+import re
+import md5
 random_module = random
 
 DEFAULT_MAX_DEPTH = 4
@@ -84,6 +86,11 @@ class Fragment:
 #        print 'fragments base', cls
         return cls()
         
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        "Given class and variable list (of strings) returns the list of all fragments possible at this point."
+        return [cls()]
+        
     def ___str__(self):
         "Returns schedule_str, e.g. '.parallel(y)'."
     
@@ -112,6 +119,10 @@ class FragmentVarMixin:
 #        print 'fragments', cls
         return cls(random.choice(vars)) if len(vars) else None #[cls(x) for x in vars]
 
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        return [cls(x) for x in vars]
+
     def check(self, L, partial_schedule=None, func=None, vars=None):
         if vars is not None and self.var not in vars:
             if CHECK_VERBOSE:
@@ -127,6 +138,8 @@ def blocksize_random(L=None, force_random=False):
     return random.choice(L) #if (use_random_blocksize and not force_random) else 3
 
 class FragmentBlocksizeMixin(FragmentVarMixin):
+    blocksizes = [2,4,8,16,32,64]       # Constants chosen by randomize_const() and enumerated by fragments()
+    
     def __init__(self, var=None, value=None):
 #        print '__init__', self.__class__
         self.var = var
@@ -135,9 +148,13 @@ class FragmentBlocksizeMixin(FragmentVarMixin):
             self.randomize_const()
 
     def randomize_const(self):
-        self.value = blocksize_random()
+        self.value = blocksize_random(self.blocksizes)
         #print 'randomize_const, value=%d'% self.value
 
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        return [cls(x, value) for x in vars for value in cls.blocksizes]
+
     def check(self, L, partial_schedule=None, func=None, vars=None):
         if vars is not None and self.var not in vars:
             if CHECK_VERBOSE:
@@ -173,8 +190,7 @@ class FragmentRoot(Fragment):
         raise ValueError('var_order called on FragmentRoot()')
         
 class FragmentVectorize(FragmentBlocksizeMixin,Fragment):
-    def randomize_const(self):
-        self.value = blocksize_random([2,4,8,16])
+    blocksizes = [2,4,8,16]
 
     def __str__(self):
         return '.vectorize(%s,%d)'%(self.var, self.value) #self.value) # FIXMEFIXME Generate random platform valid blocksize
@@ -184,8 +200,7 @@ class FragmentParallel(FragmentVarMixin,Fragment):
         return '.parallel(%s)'%(self.var)
 
 class FragmentUnroll(FragmentBlocksizeMixin,Fragment):
-    def randomize_const(self):
-        self.value = blocksize_random([2,3,4])
+    blocksizes = [2,3,4]
 
     def __str__(self):
         return '.unroll(%s,%d)'%(self.var,self.value)
@@ -224,6 +239,21 @@ class FragmentChunk(Fragment):
             return cls(random.choice(allV), func=func)
         #return [cls(x) for x in ]
         
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        allV = list(reversed(chunk_vars(partial_schedule, func)))           # In loop order
+        if not SPLIT_STORE_COMPUTE:
+            return [cls(x, func=func) for x in allV]
+        if is_cuda() and CUDA_CHUNK_VAR in allV:
+            allV = allV[:allV.index(CUDA_CHUNK_VAR)+1]
+        ans = []
+        for j in range(len(allV)):                          # Compute
+            if allV[j] == CUDA_CHUNK_VAR and len(halide.func_varlist(func)) < 2:
+                continue
+            for i in range(-1, j+1):                        # Store
+                ans.append(cls(allV[j], allV[i] if i >= 0 else root_var, func))
+        return ans
+        
     def check(self, L, partial_schedule=None, func=None, vars=None):
         if partial_schedule is not None:
             cvars = list(reversed(chunk_vars(partial_schedule, func)))          # In loop ordering
@@ -345,6 +375,10 @@ class FragmentSplit(FragmentBlocksizeMixin,Fragment):
         #([cls(x,reuse_outer=False,vars=vars) for x in vars] +
         #        [cls(x,reuse_outer=True,vars=vars)  for x in vars])
 
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        return [cls(x, value, vars=vars) for x in vars for value in cls.blocksizes]
+
     def new_vars(self):
         return [self.newvar]
     
@@ -372,10 +406,10 @@ class FragmentTileBase(FragmentBlocksizeMixin,Fragment):
 
     def randomize_const(self):
         if random.random() < TILE_PROB_SQUARE:
-            self.xsize = self.ysize = blocksize_random()
+            self.xsize = self.ysize = blocksize_random(self.blocksizes)
         else:
-            self.xsize = blocksize_random()
-            self.ysize = blocksize_random()
+            self.xsize = blocksize_random(self.blocksizes)
+            self.ysize = blocksize_random(self.blocksizes)
         #print 'randomize_const, tile, size=%d,%d' % (self.xsize, self.ysize)
 
 class FragmentTile(FragmentTileBase):
@@ -407,6 +441,11 @@ class FragmentTile(FragmentTileBase):
         #return ans
 #        return [cls(x,y,vars=vars) for x in vars for y in vars if x != y]
     
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        return [cls(vars[i+1], vars[i], vars=vars, xsize=xsize, ysize=ysize)
+                for i in range(len(vars)-1) for xsize in cls.blocksizes for ysize in cls.blocksizes]
+    
     def __str__(self):
         return '.tile(%s,%s,%s,%s,%d,%d)'%(self.xvar,self.yvar,self.xnewvar,self.ynewvar,self.xsize,self.ysize)
 
@@ -484,6 +523,11 @@ class FragmentCudaTile(FragmentTileBase):
         i = random.randrange(len(vars)-1)
         return cls(vars[i+1],vars[i])
     
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        return [cls(vars[i+1], vars[i], xsize, ysize)
+                for i in range(len(vars)-1) for xsize in cls.blocksizes for ysize in cls.blocksizes]
+    
     def __str__(self):
         return '.cudaTile(%s,%s,%d,%d)'%(self.xvar,self.yvar,self.xsize,self.ysize)
 
@@ -535,6 +579,10 @@ class FragmentReorder(Fragment):
         return cls(vars=vars, idx=i)
         #return [cls(vars=vars, idx=i) for i in range(1,permutation.factorial(len(vars)))]     # TODO: Allow random generation so as to not loop over n!
     
+    @staticmethod
+    def fragments(root_func, func, cls, vars, extra_caller_vars, partial_schedule):
+        return [cls(vars=vars, idx=i) for i in range(1,permutation.factorial(len(vars)))]
+    
     def check(self, L, partial_schedule=None, func=None, vars=None):
         if vars is not None:
             for var in self.permutation:
@@ -670,6 +718,31 @@ class FragmentList(list):
             ans.extend(x.new_vars())
         return list(sorted(set(ans)))
     
+    def without_noops(self):
+        """
+        Copy with fragments that have no effect removed: reorders which keep the existing loop order, vectorize or
+        unroll by 1, and parallel of an already parallel variable.
+        """
+        ans = FragmentList(self.func, self[:1])
+        order = list(reversed(halide.func_varlist(self.func)))
+        parallel = set()
+        for x in self[1:]:
+            try:
+                new_order = x.var_order(order)
+            except (BadScheduleError, ValueError):
+                return FragmentList(self.func, list(self))
+            if isinstance(x, FragmentReorder) and [v for v in order if v in x.permutation] == list(reversed(x.permutation)):
+                continue
+            if isinstance(x, (FragmentVectorize, FragmentUnroll)) and x.value == 1:
+                continue
+            if isinstance(x, FragmentParallel):
+                if x.var in parallel:
+                    continue
+                parallel.add(x.var)
+            ans.append(x)
+            order = new_order
+        return ans
+
     def all_vars(self):
         return list(sorted(set(halide.func_varlist(self.func)) | set(self.new_vars())))
         
@@ -763,7 +836,6 @@ def schedules_depth(root_func, func, vars, depth=0, random=False, extra_caller_v
 #    print func
 #    print vars
     if not random:
-        raise NotImplementedError('schedules must be sampled randomly')
         randomized = lambda x: x
     else:
         def randomized(La):
@@ -788,6 +860,10 @@ def schedules_depth(root_func, func, vars, depth=0, random=False, extra_caller_v
             all_vars = FragmentList(func, L).var_order()
             for cls in randomized(get_fragment_classes()):
                 #print 'all_vars', all_vars
+                if not random:
+                    for fragment in cls.fragments(root_func, func, cls, all_vars, extra_caller_vars, partial_schedule):
+                        yield FragmentList(func, list(L) + [fragment])
+                    continue
                 fragment = cls.random_fragment(root_func, func, cls, all_vars, extra_caller_vars, partial_schedule)
                 #for fragment in randomized(cls.fragments(root_func, func, cls, all_vars, extra_caller_vars)):
                     #print 'fragment', fragment
@@ -800,7 +876,8 @@ def schedules_func(root_func, func, min_depth=0, max_depth=DEFAULT_MAX_DEPTH, ra
     """
     Generator of valid schedules for a Func, each of which is a FragmentList (e.g. f.root().vectorize(x).parallel(y)).
     
-    If random is True then instead generate exactly one schedule randomly chosen.
+    If random is True then instead generate exactly one schedule randomly chosen. Otherwise all schedules of depth
+    min_depth to max_depth are enumerated, with the constants listed in the blocksizes of the Fragment classes.
     """
     assert partial_schedule is not None
     if vars is None:
@@ -813,12 +890,14 @@ def schedules_func(root_func, func, min_depth=0, max_depth=DEFAULT_MAX_DEPTH, ra
             depth = random_module.randrange(min_depth, max_depth+1)
         # TODO: This cannot be in check() because then we fail when trying to generate empty FragmentList [], but maybe should be pulled into a function
         if (func.name() == root_func.name() or func.isReduction()) and depth == 0:
+            if not random:
+                continue
             depth += 1
         for L in schedules_depth(root_func, func, vars, depth, random, extra_caller_vars, partial_schedule=partial_schedule):
             #print 'schedules_depth returns', L
             if L.check():
                 #print '  check'
-                yield L.randomized_const()
+                yield L.randomized_const() if random else L
                 if random:
                     return
 
@@ -954,8 +1033,23 @@ class Schedule:
         #print self.generation
         #print self.index
         return '%03d_%03d'%(self.generation,self.index) if self.identity_str is None else self.identity_str
-    #def hash(self):
-    #    return md5.md5(str(self)).hexdigest()[:10]
+
+    def canonical_str(self):
+        """
+        String which is equal for schedules that only differ in the names of variables from create_var() (renamed
+        _c0, _c1, ... in order of first appearance) or in fragments with no effect (see FragmentList.without_noops()).
+        """
+        s = '\n'.join([str(self.d[key].without_noops()) for key in sorted(self.d.keys())])
+        names = {}
+        def rename(m):
+            if m.group(0) not in names:
+                names[m.group(0)] = '_c%d' % len(names)
+            return names[m.group(0)]
+        return re.sub(r'\b_c[0-9]+\b', rename, s)
+
+    def hash(self):
+        "Stable hash of canonical_str(), used to deduplicate and cache schedules."
+        return md5.md5(self.canonical_str()).hexdigest()[:16]
         
     def randomized_const(self):
         dnew = {}
@@ -1383,6 +1477,22 @@ def test_callers():
 
     print 'valid_schedules.callers:             OK'
     
+def test_canonical():
+    h2 = simple_program()
+    def schedule(s):
+        return Schedule.fromstring(h2, s.replace('$', 'c_valid_'))
+    a = schedule('$f.chunk(_c3)\n$h.root().split($x,$x,_c1,4).vectorize(_c1,1)\n$h2.root().tile($x,$y,_c3,_c5,8,8).parallel($y).parallel($y)')
+    b = schedule('$f.chunk(_c0)\n$h.root().split($x,$x,_c2,4).reorder(_c2,$x,$y)\n$h2.root().tile($x,$y,_c0,_c1,8,8).parallel($y)')
+    c = schedule('$f.chunk(_c1)\n$h.root().split($x,$x,_c2,4)\n$h2.root().tile($x,$y,_c0,_c1,8,8).parallel($y)')
+    assert str(a) != str(b)
+    assert a.canonical_str() == b.canonical_str() and a.hash() == b.hash()
+    assert a.canonical_str() == schedule(a.canonical_str()).canonical_str()
+    assert a.hash() != c.hash()
+    d = schedule('$f.chunk(_c0)\n$h.root().split($x,$x,_c2,4).reorder($x,_c2,$y)\n$h2.root().tile($x,$y,_c0,_c1,8,8).parallel($y)')
+    assert b.hash() != d.hash()
+
+    print 'valid_schedules.canonical:           OK'
+
 def test_chunk_vars_subproc(test_index=0):
     f = halide.Func('valid_f')
     g = halide.Func('valid_g')
@@ -1480,6 +1590,7 @@ def test_valid_schedules():
         test_intersect_lists()
         test_callers()
         test_toposort()
+        test_canonical()
         for i in range(3):
             os.system('python ' + os.path.abspath(__file__) + ' test_chunk_vars %d'%i)
     elif args[0] == 'test_chunk_vars' and len(args) == 2:
@@ -0,0 +1,74 @@
+#include "Halide.h"
+#include <stdlib.h>
+#include <dirent.h>
+#include <unistd.h>
+
+// This tests reusing JIT compiled code for identical Funcs (see HL_JIT_CACHE)
+
+using namespace Halide;
+
+int errors_a = 0, errors_b = 0;
+void error_a(char *msg) {
+    errors_a++;
+}
+void error_b(char *msg) {
+    errors_b++;
+}
+
+// Realize a Func named name which doubles input, with the given error handler (or none)
+bool check(const char *name, Image<int> input, int size, void (*handler)(char *)) {
+    Var x;
+    Func f(name);
+    f(x) = input(x)*2;
+    if (handler) f.setErrorHandler(handler);
+    Image<int> out = f.realize(size);
+    if (handler) return true;
+    for (int i = 0; i < size; i++) {
+        if (out(i) != input(i)*2) {
+            printf("%s(%d) = %d instead of %d\n", name, i, out(i), input(i)*2);
+            return false;
+        }
+    }
+    return true;
+}
+
+int main(int argc, char **argv) {
+    Image<int> input(16);
+    for (int i = 0; i < 16; i++) input(i) = i;
+
+    // The second Func is compiled from the in-memory cache
+    if (!check("jit_cache_f", input, 16, NULL) || !check("jit_cache_f", input, 16, NULL)) return -1;
+
+    // Error handlers are per Func, even for otherwise identical Funcs
+    check("jit_cache_g", input, 20, error_a);
+    check("jit_cache_g", input, 20, error_b);
+    if (errors_a != 1 || errors_b != 1) {
+        printf("Error handlers called %d and %d times instead of once each\n", errors_a, errors_b);
+        return -1;
+    }
+    if (!check("jit_cache_g", input, 16, NULL)) return -1;
+
+    // The on-disk cache stores a shared object per Func, used by later processes
+    char dir[] = "/tmp/jit_cache_XXXXXX";
+    if (!mkdtemp(dir)) return -1;
+    setenv("HL_JIT_CACHE", dir, 1);
+    if (!check("jit_cache_h", input, 16, NULL)) return -1;
+    int files = 0;
+    DIR *d = opendir(dir);
+    while (dirent *entry = readdir(d)) {
+        std::string name = entry->d_name;
+        if (name.find("jit_cache_h_jit") == 0) {
+            files++;
+            unlink((std::string(dir) + "/" + name).c_str());
+        }
+    }
+    closedir(d);
+    rmdir(dir);
+    if (files != 2) {
+        printf("Expected a .so and a .key file in the JIT cache directory, found %d files\n", files);
+        return -1;
+    }
+
+    printf("Success!\n");
+    return 0;
+}